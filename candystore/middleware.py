@@ -1,13 +1,128 @@
+import hashlib
+
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_vary_headers
 from django.utils.deprecation import MiddlewareMixin
+from django.utils.http import http_date
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from store.cart import cart_fingerprint
+from store.images import RENDITION_NAME
+from store.versions import (
+    CATALOG,
+    RECOMMENDATIONS,
+    get_version,
+    reviews_scope,
+    stock_scope,
+)
+
+
+def _catalog_scopes(kwargs):
+    return [CATALOG]
+
+
+def _product_scopes(kwargs):
+    candy_id = kwargs["candy_id"]
+    return [CATALOG, RECOMMENDATIONS, reviews_scope(candy_id), stock_scope(candy_id)]
+
+
+# url_name -> version stamps the rendered page depends on
+CONDITIONAL_ROUTES = {
+    "home": _catalog_scopes,
+    "search": _catalog_scopes,
+    "candy_detail": _product_scopes,
+    "candy_reviews_api": _product_scopes,
+}
+
+# url_name of views that set their own long-lived Cache-Control
+PUBLIC_ROUTES = {"candy_thumbnail"}
+
+# url_name of views that set their own private Cache-Control and ETag
+PRIVATE_ROUTES = {"order_status_api", "order_statuses_api"}
+
+
+class ImmutableThumbnailMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise, also treating the hashed product thumbnails it serves from
+    WHITENOISE_ROOT as immutable (they get a new name whenever they change).
+    """
+
+    def immutable_file_test(self, path, url):
+        if RENDITION_NAME.match(url):
+            return True
+        return super().immutable_file_test(path, url)
 
 
-class NoCacheMiddleware(MiddlewareMixin):
+class CartCookieMiddleware(MiddlewareMixin):
+    """Writes the cart cookie for the cookie-based cart storages"""
+
+    def process_response(self, request, response):
+        storage = getattr(request, "_cart_storage", None)
+        if storage is not None:
+            storage.update_response(response)
+        return response
+
+
+class CachePolicyMiddleware(MiddlewareMixin):
+    """
+    Route-aware Cache-Control.
+
+    Anonymous GETs of catalog and product pages get a strong ETag and a
+    Last-Modified built from the catalog/review version stamps, and a matching
+    revalidation is answered with a 304 before the view runs. Everything else
+    (authenticated users, account pages, POSTs) stays no-store, so logging out
+    and pressing back doesn't show authenticated content.
+    """
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        validator = self._validator(request, view_kwargs)
+        if validator is None:
+            return None
+        request._cache_validator = validator
+        etag, last_modified = validator
+        return get_conditional_response(request, etag=etag, last_modified=last_modified)
+
     def process_response(self, request, response):
-        """
-        Add headers to prevent caching of pages, ensuring that
-        logging out and pressing back doesn't show authenticated content.
-        """
+        match = request.resolver_match
+        if match and match.url_name in PUBLIC_ROUTES | PRIVATE_ROUTES:
+            return response
+
+        validator = getattr(request, "_cache_validator", None)
+        if validator is not None and response.status_code in (200, 304):
+            etag, last_modified = validator
+            response["ETag"] = etag
+            response["Last-Modified"] = http_date(last_modified)
+            response["Cache-Control"] = "no-cache"
+            patch_vary_headers(response, ["Cookie"])
+            return response
+
         response["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
         response["Pragma"] = "no-cache"
         response["Expires"] = "0"
         return response
+
+    def _validator(self, request, view_kwargs):
+        """Return (etag, last_modified) for a cacheable request, else None"""
+        if request.method not in ("GET", "HEAD"):
+            return None
+        match = request.resolver_match
+        scopes_for = CONDITIONAL_ROUTES.get(match.url_name) if match else None
+        if scopes_for is None:
+            return None
+        if request.user.is_authenticated:
+            return None
+        # Pending flash messages are consumed by rendering the page
+        if "messages" in request.COOKIES or "_messages" in request.session:
+            return None
+
+        versions = [get_version(scope) for scope in scopes_for(view_kwargs)]
+        parts = [
+            match.url_name,
+            request.get_full_path(),
+            *(str(version) for version in versions),
+            # The page embeds the visitor's CSRF token and cart badge
+            request.COOKIES.get(settings.CSRF_COOKIE_NAME, ""),
+            cart_fingerprint(request),
+        ]
+        digest = hashlib.sha256("\n".join(parts).encode()).hexdigest()[:32]
+        return f'"{digest}"', max(versions) // 1000
@@ -39,14 +39,15 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
-    "whitenoise.middleware.WhiteNoiseMiddleware",  # only once, near the top
+    "candystore.middleware.ImmutableThumbnailMiddleware",  # WhiteNoise, once, near the top
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
-    "candystore.middleware.NoCacheMiddleware",
+    "candystore.middleware.CartCookieMiddleware",
+    "candystore.middleware.CachePolicyMiddleware",
 ]
 
 
@@ -75,6 +76,44 @@ DATABASES = {
     "default": dj_database_url.parse(os.environ.get("DATABASE_URL"))
 }
 
+# Cache
+# CACHE_BACKEND selects where cached fragments and version stamps live:
+#   "locmem" (default) - per process; fine for a single worker
+#   "file"             - shared by workers on one host (CACHE_LOCATION directory)
+#   "db"               - shared by every host; run `python manage.py createcachetable`
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "locmem")
+# Namespacing keys by release means a deploy starts with fresh version stamps,
+# so fragments and ETags from the previous templates are never reused
+CACHE_KEY_PREFIX = os.environ.get("RAILWAY_GIT_COMMIT_SHA", "dev")[:12]
+if CACHE_BACKEND == "file":
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": os.environ.get("CACHE_LOCATION", str(BASE_DIR / ".cache")),
+            "KEY_PREFIX": CACHE_KEY_PREFIX,
+        }
+    }
+elif CACHE_BACKEND == "db":
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+            "LOCATION": os.environ.get("CACHE_LOCATION", "django_cache"),
+            "KEY_PREFIX": CACHE_KEY_PREFIX,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "candystore",
+            "KEY_PREFIX": CACHE_KEY_PREFIX,
+        }
+    }
+# Seconds a version stamp lives (see store/versions.py). A per-process cache
+# never sees other processes' bumps, so its stamps expire and ETags and cached
+# fragments are at most this stale; shared caches keep them until bumped.
+VERSION_STAMP_TTL = 60 if CACHE_BACKEND == "locmem" else None
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {"NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator"},
@@ -94,12 +133,29 @@ STATIC_URL = "/static/"
 
 STATIC_ROOT = BASE_DIR / "staticfiles"
 
+# Uploaded product images (originals); pages serve the WebP thumbnails instead
+MEDIA_URL = "/media/"
+MEDIA_ROOT = BASE_DIR / "media"
+
+# Generated product thumbnails are written through the "thumbnails" storage
+# below. Its default keeps them in public/thumbs, served from the site root by
+# WhiteNoise (see store.images); that disk is lost on redeploy, so point it at
+# persistent storage in production or let the release step rebuild them.
+WHITENOISE_ROOT = BASE_DIR / "public"
+
 
 # WhiteNoise storage for compressed/minified static files
 STORAGES = {
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
     "staticfiles": {
         "BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage",
-    }
+    },
+    "thumbnails": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+        "OPTIONS": {"location": WHITENOISE_ROOT, "base_url": "/"},
+    },
 }
 
 # Login redirects
@@ -109,7 +165,47 @@ LOGOUT_REDIRECT_URL = "/accounts/login/"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# Cart storage (see store/cart_storage.py):
+#   store.cart_storage.SessionCartStorage      - in the session (default)
+#   store.cart_storage.CacheCartStorage        - in the cache, id in a cookie;
+#                                                needs CACHE_BACKEND file or db
+#   store.cart_storage.SignedCookieCartStorage - in a signed cookie
+CART_STORAGE = os.environ.get("CART_STORAGE", "store.cart_storage.SessionCartStorage")
 CART_SESSION_ID = "cart"
+# Item count cached next to the cart so the header badge needn't sum it
+CART_COUNT_SESSION_ID = "cart_count"
+CART_COOKIE_NAME = "cart"
+CART_COOKIE_AGE = 60 * 60 * 24 * 14
+CART_CACHE_ALIAS = "default"
+CART_HOLDER_SESSION_ID = "cart_holder"
+
+# Stock reservations: adding to the cart holds stock for STOCK_RESERVATION_TTL
+# seconds (see store/reservations.py). Off by default.
+STOCK_RESERVATIONS = os.environ.get("STOCK_RESERVATIONS", "False") == "True"
+STOCK_RESERVATION_TTL = int(os.environ.get("STOCK_RESERVATION_TTL", 15 * 60))
+
+# Sharded stock (store/stock.py): seconds between writes of a hot product's
+# Candy.stock total; the order worker sweeps stale totals at this interval too
+STOCK_SYNC_INTERVAL = 5
+
+# Checkout admission control (store/admission.py): at most this many orders
+# are placed at once and the rest wait in a FIFO queue. 0 turns it off.
+CHECKOUT_ADMISSION_LIMIT = int(os.environ.get("CHECKOUT_ADMISSION_LIMIT", 0))
+CHECKOUT_ADMIT_INTERVAL = 2  # seconds between waiting-room polls
+CHECKOUT_ADMIT_TIMEOUT = 60  # an admitted shopper's slot is kept this long
+CHECKOUT_SLOT_TIMEOUT = 30  # a slot is freed after this even if never released
+CHECKOUT_TICKET_MAX_AGE = 30 * 60
+
+# Products per page on the home catalog grid
+CATALOG_PAGE_SIZE = 24
+
+# Reviews per "page" on candy_detail (more load through the JSON endpoint)
+REVIEWS_PAGE_SIZE = 10
+
+# Rendered catalog fragments are keyed by the catalog version stamp; the timeout
+# only bounds how long a per-process (locmem) cache can lag another worker's edit
+CATALOG_CACHE_ALIAS = "default"
+CATALOG_CACHE_TIMEOUT = 300
 
 # Email settings
 EMAIL_BACKEND = os.environ.get("EMAIL_BACKEND", "django.core.mail.backends.console.EmailBackend")
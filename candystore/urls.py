@@ -2,6 +2,8 @@
 URL configuration for candystore project
 """
 
+from django.conf import settings
+from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 
@@ -10,3 +12,6 @@ urlpatterns = [
     path("", include("store.urls")),
     path("accounts/", include("accounts.urls")),
 ]
+
+# Uploaded originals; only served by Django itself when DEBUG is on
+urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
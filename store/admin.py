@@ -8,6 +8,6 @@ from .models import Candy
 
 @admin.register(Candy)
 class CandyAdmin(admin.ModelAdmin):
-    list_display = ("name", "category", "price", "stock")
+    list_display = ("name", "category", "price", "stock", "stock_slots")
     list_filter = ("category",)
     search_fields = ("name", "description")
@@ -0,0 +1,187 @@
+"""
+Admission control for order placement (a virtual waiting room).
+
+When a promotion starts everyone submits checkout at once, and past a point
+more concurrent order transactions only slow the database down for all of
+them. With settings.CHECKOUT_ADMISSION_LIMIT set, at most that many orders
+are placed at a time: each placement holds one of that many slots in the
+cache while it runs. Shoppers who find no free slot (or a queue already
+waiting) get a signed, numbered ticket and a waiting page that polls
+`checkout_queue`; their shipping details stay on the server meanwhile.
+
+Tickets are let in in FIFO order as slots free up: whoever releases a slot
+(or polls while one is free) hands it to the next ticket, which keeps it for
+CHECKOUT_ADMIT_TIMEOUT seconds to come back and place the order. A shopper
+who left lets that reservation expire and the slot goes to the next ticket.
+
+All state is in the default cache, and `cache.add` claims a slot atomically,
+so the limit holds across workers whenever that cache is shared.
+"""
+
+import random
+import secrets
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+
+SLOT_KEY = "admission:slot:{}"
+ISSUED_KEY = "admission:issued"  # last ticket number handed out
+ADMITTED_KEY = "admission:admitted"  # tickets up to this number may enter
+PASS_KEY = "admission:pass:{}"  # ticket number -> the slot reserved for it
+SUBMISSION_KEY = "admission:submission:{}"  # ticket number -> queued form data
+SALT = "store.admission"
+
+
+class Waiting(Exception):
+    """No placement slot for this shopper yet; they should wait with `ticket`"""
+
+    def __init__(self, ticket, position):
+        self.ticket = ticket
+        self.position = position
+        super().__init__(f"Checkout is busy. You are number {position} in line.")
+
+
+def enabled():
+    return settings.CHECKOUT_ADMISSION_LIMIT > 0
+
+
+def _counter(key):
+    return cache.get(key) or 0
+
+
+def _incr(key, delta=1):
+    cache.add(key, 0, None)
+    return cache.incr(key, delta)
+
+
+def _slot_keys():
+    return [SLOT_KEY.format(i) for i in range(settings.CHECKOUT_ADMISSION_LIMIT)]
+
+
+def _claim_slot(timeout=None):
+    """(key, token) of a slot now held by the caller, or None if all are busy"""
+    keys = _slot_keys()
+    start = random.randrange(len(keys))
+    token = secrets.token_hex(8)
+    for key in keys[start:] + keys[:start]:
+        # The timeout frees slots held by a worker that died mid-order
+        if cache.add(key, token, timeout or settings.CHECKOUT_SLOT_TIMEOUT):
+            return key, token
+    return None
+
+
+def _free_slot(slot):
+    key, token = slot
+    if cache.get(key) == token:
+        cache.delete(key)
+
+
+def _advance():
+    """
+    Reserve free slots for the tickets at the front of the queue. A slot
+    nobody comes back for expires after CHECKOUT_ADMIT_TIMEOUT.
+    """
+    while _counter(ISSUED_KEY) > _counter(ADMITTED_KEY):
+        slot = _claim_slot(settings.CHECKOUT_ADMIT_TIMEOUT)
+        if slot is None:
+            return
+        number = _incr(ADMITTED_KEY)
+        cache.set(PASS_KEY.format(number), slot, settings.CHECKOUT_ADMIT_TIMEOUT)
+
+
+def _take_pass(number):
+    """The slot reserved for ticket `number`, now held for placement, or None"""
+    slot = cache.get(PASS_KEY.format(number))
+    cache.delete(PASS_KEY.format(number))
+    if slot is None or cache.get(slot[0]) != slot[1]:
+        return None
+    cache.touch(slot[0], settings.CHECKOUT_SLOT_TIMEOUT)
+    return slot
+
+
+def issue_ticket():
+    """(signed ticket, number) for a new place at the back of the queue"""
+    number = _incr(ISSUED_KEY)
+    return signing.dumps(number, salt=SALT), number
+
+
+def read_ticket(ticket):
+    """The ticket's number, or None if it is forged or too old"""
+    try:
+        return signing.loads(
+            ticket, salt=SALT, max_age=settings.CHECKOUT_TICKET_MAX_AGE
+        )
+    except signing.BadSignature:
+        return None
+
+
+def position(number):
+    """Tickets still ahead of ticket `number`; 0 once it may enter"""
+    _advance()
+    return max(number - _counter(ADMITTED_KEY), 0)
+
+
+def keep_submission(ticket, owner, fields):
+    """
+    Hold a queued shopper's form fields (name -> list of values) until their
+    ticket is called, so the waiting page needn't carry them. Callers leave
+    out anything sensitive, such as payment details.
+    """
+    number = read_ticket(ticket)
+    if number is not None:
+        cache.set(
+            SUBMISSION_KEY.format(number),
+            (owner, fields),
+            settings.CHECKOUT_TICKET_MAX_AGE,
+        )
+
+
+def pop_submission(ticket, owner):
+    """The fields kept for `ticket` by `owner`, or None"""
+    number = read_ticket(ticket) if ticket else None
+    if number is None:
+        return None
+    kept = cache.get(SUBMISSION_KEY.format(number))
+    if kept is None or kept[0] != owner:
+        return None
+    cache.delete(SUBMISSION_KEY.format(number))
+    return kept[1]
+
+
+@contextmanager
+def admitted(ticket=None):
+    """
+    Hold a placement slot for the `with` body, or raise Waiting.
+
+    Shoppers without a (valid) ticket only go straight in when nobody is
+    queued; ticket holders go in on the slot reserved for them once the queue
+    has reached their number, or queue again if that reservation expired.
+    On the way out the slot goes to the next ticket in line.
+    """
+    if not enabled():
+        yield
+        return
+
+    number = read_ticket(ticket) if ticket else None
+    if number is None:
+        queued = _counter(ISSUED_KEY) > _counter(ADMITTED_KEY)
+        slot = None if queued else _claim_slot()
+        if slot is None:
+            ticket, number = issue_ticket()
+            raise Waiting(ticket, position(number))
+    else:
+        ahead = position(number)
+        if ahead:
+            raise Waiting(ticket, ahead)
+        slot = _take_pass(number)
+        if slot is None:
+            ticket, number = issue_ticket()
+            raise Waiting(ticket, position(number))
+
+    try:
+        yield
+    finally:
+        _free_slot(slot)
+        _advance()
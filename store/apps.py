@@ -7,3 +7,6 @@ class StoreConfig(AppConfig):
 
     def ready(self):
         import store.signals  # noqa
+        from .cart_storage import check_storage
+
+        check_storage()
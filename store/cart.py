@@ -1,75 +1,177 @@
 from decimal import Decimal
-from django.conf import settings
+from . import reservations
+from .cart_storage import get_cart_storage
 from .models import Candy
 
 
+def _to_cents(price):
+    """Decimal price (2.50) -> integer cents (250)"""
+    return int(Decimal(price) * 100)
+
+
+def _from_cents(cents):
+    """Integer cents -> two-place Decimal"""
+    return Decimal(cents).scaleb(-2)
+
+
 class Cart:
     def __init__(self, request):
         """
-        Initialize the cart.
+        Initialize the cart from the configured storage (see store.cart_storage).
         """
-        self.session = request.session
-        cart = self.session.get(settings.CART_SESSION_ID)
-        if not cart:
-            # save an empty cart in the session
-            cart = self.session[settings.CART_SESSION_ID] = {}
-        self.cart = cart
+        self.request = request
+        self.storage = get_cart_storage(request)
+        # {product_id: quantity}. An empty cart isn't stored until something
+        # is added, so reading it never creates or saves a session
+        self.cart = self.storage.load()
+        self._total_cents = None
+        # Lines cut down because stock ran out ({product_id: quantity kept});
+        # only filled when stock reservations are on
+        self.shortages = {}
+        self._stored = dict(self.cart)
 
     def add(self, product, quantity=1, override_quantity=False):
         """
         Add a product to the cart or update its quantity.
         """
-        product_id = str(product.id)
-        if product_id not in self.cart:
-            self.cart[product_id] = {"quantity": 0, "price": str(product.price)}
-
         if override_quantity:
-            self.cart[product_id]["quantity"] = quantity
+            self.cart[product.id] = quantity
         else:
-            self.cart[product_id]["quantity"] += quantity
+            self.cart[product.id] = self.cart.get(product.id, 0) + quantity
+        self._snapshot().setdefault(product.id, product)
+        self.save()
+
+    def add_many(self, quantities):
+        """Add several {product: quantity} lines at once, saving the cart once"""
+        self.set_quantities(
+            {
+                product: self.cart.get(product.id, 0) + quantity
+                for product, quantity in quantities.items()
+            }
+        )
+
+    def set_quantities(self, quantities, replace=False):
+        """
+        Set several lines at once from {product: quantity}; a quantity of 0
+        removes the line. With replace=True the cart holds exactly these lines.
+        """
+        if replace:
+            self.cart = {}
+        snapshot = self._snapshot()
+        for product, quantity in quantities.items():
+            if quantity > 0:
+                self.cart[product.id] = quantity
+                snapshot.setdefault(product.id, product)
+            else:
+                self.cart.pop(product.id, None)
         self.save()
 
     def save(self):
-        # mark the session as "modified" to make sure it gets saved
-        self.session.modified = True
+        # write the cart back to its storage
+        self._total_cents = None
+        if reservations.enabled():
+            self._hold_stock()
+        self.storage.save(self.cart)
+        self._stored = dict(self.cart)
+
+    def _hold_stock(self):
+        """Move this cart's stock holds to the new quantities"""
+        changes = {
+            pid: qty for pid, qty in self.cart.items() if self._stored.get(pid) != qty
+        }
+        changes.update({pid: 0 for pid in self._stored if pid not in self.cart})
+        if not changes:
+            return
+        held = reservations.hold(self.storage.holder_id(), changes)
+        for pid, qty in held.items():
+            if pid in self.cart and qty < self.cart[pid]:
+                self.shortages[pid] = qty
+                if qty:
+                    self.cart[pid] = qty
+                else:
+                    del self.cart[pid]
 
     def remove(self, product):
         """
         Remove a product from the cart.
         """
-        product_id = str(product.id)
-        if product_id in self.cart:
-            del self.cart[product_id]
+        if product.id in self.cart:
+            del self.cart[product.id]
             self.save()
 
+    def _snapshot(self):
+        products = getattr(self.request, "_cart_products", None)
+        if products is None:
+            products = self.request._cart_products = {}
+        return products
+
+    def products(self):
+        """
+        {id: Candy} for the products in the cart. Loaded once per request and
+        shared by every Cart built for it (view, template, context processor);
+        only products added since the last load trigger another query.
+        """
+        products = self._snapshot()
+        missing = [pid for pid in self.cart if pid not in products]
+        if missing:
+            products.update(Candy.objects.in_bulk(missing))
+        return products
+
     def __iter__(self):
         """
-        Iterate over the items in the cart and get the products from the database.
+        Iterate over the items in the cart with their products attached,
+        priced at the products' current price.
         """
-        product_ids = self.cart.keys()
-        # get the product objects and add them to the cart
-        products = Candy.objects.filter(id__in=product_ids)
-        cart = self.cart.copy()
-        for product in products:
-            cart[str(product.id)]["product"] = product
-
-        for item in cart.values():
-            item["price"] = Decimal(item["price"])
-            item["total_price"] = item["price"] * item["quantity"]
-            yield item
+        products = self.products()
+        for product_id, quantity in self.cart.items():
+            product = products.get(product_id)
+            if product is None:
+                # the product was deleted after it was added
+                continue
+            price = _to_cents(product.price)
+            yield {
+                "product": product,
+                "quantity": quantity,
+                "price": _from_cents(price),
+                "total_price": _from_cents(price * quantity),
+            }
 
     def __len__(self):
         """
         Count all items in the cart.
         """
-        return sum(item["quantity"] for item in self.cart.values())
+        return sum(self.cart.values())
 
     def get_total_price(self):
-        return sum(
-            Decimal(item["price"]) * item["quantity"] for item in self.cart.values()
-        )
+        """Cart total, summed once per cart state in integer cents"""
+        if self._total_cents is None:
+            products = self.products()
+            self._total_cents = sum(
+                _to_cents(products[pid].price) * quantity
+                for pid, quantity in self.cart.items()
+                if pid in products
+            )
+        return _from_cents(self._total_cents)
 
     def clear(self):
-        # remove cart from session
-        del self.session[settings.CART_SESSION_ID]
-        self.save()
+        # remove cart from storage
+        self.cart = {}
+        self._total_cents = None
+        # Read the holder first: clearing may drop the cookie it is kept in
+        holder = None
+        if reservations.enabled() and self._stored:
+            holder = self.storage.holder_id()
+        self.storage.clear()
+        if holder:
+            reservations.release(holder)
+        self._stored = {}
+
+
+def cart_item_count(request):
+    """Item count for the cart badge, without loading any products"""
+    return get_cart_storage(request).count()
+
+
+def cart_fingerprint(request):
+    """A string that changes whenever the visitor's cart does (used in ETags)"""
+    return get_cart_storage(request).fingerprint()
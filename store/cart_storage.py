@@ -0,0 +1,209 @@
+"""
+Where a visitor's cart lives between requests.
+
+Every backend stores the cart as a compact "id:qty,id:qty" string, and
+settings.CART_STORAGE picks one:
+
+- SessionCartStorage: in the Django session (the default).
+- CacheCartStorage: in the cache under a random id kept in a signed cookie,
+  so cart changes never write the session row. Needs a cache every worker
+  shares (CACHE_BACKEND "file" or "db"); check_storage() refuses locmem.
+- SignedCookieCartStorage: entirely in a signed cookie; for small carts.
+
+Cookie-based backends set their cookie through CartCookieMiddleware.
+"""
+
+import secrets
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+
+def encode(items):
+    """{product_id: quantity} -> "12:3,40:1" """
+    return ",".join(f"{pid}:{qty}" for pid, qty in items.items() if qty > 0)
+
+
+def decode(value):
+    """Inverse of encode(); malformed entries are dropped"""
+    items = {}
+    if isinstance(value, dict):
+        # Carts saved as {"id": {"quantity": n, "price": "..."}}
+        for pid, item in value.items():
+            if str(pid).isdigit() and isinstance(item, dict):
+                items[int(pid)] = int(item.get("quantity", 0))
+        return {pid: qty for pid, qty in items.items() if qty > 0}
+    for entry in (value or "").split(","):
+        pid, _, qty = entry.partition(":")
+        if pid.isdigit() and qty.isdigit() and int(qty) > 0:
+            items[int(pid)] = int(qty)
+    return items
+
+
+class BaseCartStorage:
+    """Loads and saves one visitor's {product_id: quantity} mapping"""
+
+    def __init__(self, request):
+        self.request = request
+
+    def load(self):
+        return decode(self.read())
+
+    def save(self, items):
+        self.write(encode(items), sum(items.values()))
+
+    def count(self):
+        """Total quantity, for the header badge"""
+        return sum(self.load().values())
+
+    def fingerprint(self):
+        """A string that changes whenever the cart does (used in ETags)"""
+        return encode(self.load())
+
+    def read(self):
+        raise NotImplementedError
+
+    def write(self, value, count):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def holder_id(self):
+        """Stable id for this visitor's cart; stock reservations are keyed on it"""
+        return self.request.session.setdefault(
+            settings.CART_HOLDER_SESSION_ID, secrets.token_urlsafe(16)
+        )
+
+    def update_response(self, response):
+        """Called by CartCookieMiddleware after the view has run"""
+
+
+class SessionCartStorage(BaseCartStorage):
+    """The cart and its cached item count, inside the Django session"""
+
+    def read(self):
+        return self.request.session.get(settings.CART_SESSION_ID)
+
+    def write(self, value, count):
+        session = self.request.session
+        session[settings.CART_SESSION_ID] = value
+        session[settings.CART_COUNT_SESSION_ID] = count
+
+    def count(self):
+        count = self.request.session.get(settings.CART_COUNT_SESSION_ID)
+        return super().count() if count is None else count
+
+    def clear(self):
+        self.request.session.pop(settings.CART_SESSION_ID, None)
+        self.request.session.pop(settings.CART_COUNT_SESSION_ID, None)
+
+
+class _CookieCartStorage(BaseCartStorage):
+    """Shared signed-cookie handling; the cookie is written once per response"""
+
+    salt = "store.cart"
+
+    def __init__(self, request):
+        super().__init__(request)
+        self._cookie = request.get_signed_cookie(
+            settings.CART_COOKIE_NAME,
+            default=None,
+            salt=self.salt,
+            max_age=settings.CART_COOKIE_AGE,
+        )
+        self._pending = False
+
+    def _set_cookie(self, value):
+        self._cookie = value
+        self._pending = True
+
+    def update_response(self, response):
+        if not self._pending:
+            return
+        if self._cookie:
+            response.set_signed_cookie(
+                settings.CART_COOKIE_NAME,
+                self._cookie,
+                salt=self.salt,
+                max_age=settings.CART_COOKIE_AGE,
+                secure=settings.SESSION_COOKIE_SECURE,
+                httponly=True,
+                samesite="Lax",
+            )
+        else:
+            response.delete_cookie(settings.CART_COOKIE_NAME, samesite="Lax")
+
+
+class CacheCartStorage(_CookieCartStorage):
+    """
+    The cart in the cache, keyed by a random cart id in a signed cookie.
+    With a per-process (locmem) cache each worker would see its own carts, so
+    the cache behind CART_CACHE_ALIAS must be shared.
+    """
+
+    salt = "store.cart.cache"
+
+    def _cache(self):
+        return caches[settings.CART_CACHE_ALIAS]
+
+    def _key(self):
+        return f"cart:{self._cookie}"
+
+    def read(self):
+        if not self._cookie:
+            return None
+        return self._cache().get(self._key())
+
+    def holder_id(self):
+        if not self._cookie:
+            self._set_cookie(secrets.token_urlsafe(16))
+        return self._cookie
+
+    def write(self, value, count):
+        self.holder_id()  # creates the cart id on the first write
+        self._cache().set(self._key(), value, settings.CART_COOKIE_AGE)
+
+    def clear(self):
+        if self._cookie:
+            self._cache().delete(self._key())
+            self._set_cookie(None)
+
+
+class SignedCookieCartStorage(_CookieCartStorage):
+    """
+    The encoded cart itself in a signed cookie: no server-side state at all.
+    Browsers cap a cookie at about 4KB, i.e. a few hundred distinct products.
+    """
+
+    def read(self):
+        return self._cookie
+
+    def write(self, value, count):
+        self._set_cookie(value or None)
+
+    def clear(self):
+        if self._cookie:
+            self._set_cookie(None)
+
+
+def check_storage():
+    """Raise ImproperlyConfigured if CART_STORAGE can't work with the caches"""
+    if not issubclass(import_string(settings.CART_STORAGE), CacheCartStorage):
+        return
+    backend = settings.CACHES[settings.CART_CACHE_ALIAS]["BACKEND"]
+    if backend == "django.core.cache.backends.locmem.LocMemCache":
+        raise ImproperlyConfigured(
+            "CacheCartStorage needs a cache shared by all workers; "
+            "set CACHE_BACKEND to 'file' or 'db'."
+        )
+
+
+def get_cart_storage(request):
+    """The configured storage for this request, created once per request"""
+    storage = getattr(request, "_cart_storage", None)
+    if storage is None:
+        storage = request._cart_storage = import_string(settings.CART_STORAGE)(request)
+    return storage
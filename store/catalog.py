@@ -0,0 +1,227 @@
+"""
+Catalog browsing: filters, sort options and paging for the home page grid
+"""
+
+import hashlib
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Exists, OuterRef
+from django.middleware.csrf import get_token
+from django.template.loader import render_to_string
+from django.utils.http import urlencode
+from django.utils.safestring import mark_safe
+
+from .models import Candy, SalesRanking
+from .pagination import KeysetPage, paginate
+from .versions import CATALOG, get_version
+
+# Columns the product grid actually renders. `description` is left out on purpose
+# so the grid query never pulls the long text column.
+GRID_FIELDS = (
+    "id",
+    "name",
+    "price",
+    "stock",
+    "category",
+    "image_url",
+    "image",
+    "image_renditions",
+    "review_count",
+    "rating_sum",
+    "rating_avg",
+)
+
+# Each sort option maps to an index-backed ordering ending in a unique column;
+# "bestselling" orders SalesRanking rows along sales_ranking_top_idx (see
+# bestselling_page)
+SORT_OPTIONS = {
+    "name": ("name", "id"),
+    "price": ("price", "id"),
+    "-price": ("-price", "-id"),
+    "rating": ("-rating_avg", "-review_count", "-id"),
+    "bestselling": ("-units", "-candy_id"),
+}
+SORT_LABELS = (
+    ("name", "Name (A-Z)"),
+    ("price", "Price: Low to High"),
+    ("-price", "Price: High to Low"),
+    ("rating", "Top Rated"),
+    ("bestselling", "Best Selling"),
+)
+DEFAULT_SORT = "name"
+
+# Products without sales follow the best sellers by name; cursors into that
+# part of the "bestselling" listing carry this prefix
+UNRANKED_ORDERING = ("name", "id")
+UNRANKED_CURSOR = "u."
+
+
+def _parse_price(value):
+    if not value:
+        return None
+    try:
+        price = Decimal(value)
+    except InvalidOperation:
+        return None
+    return price if price.is_finite() and price >= 0 else None
+
+
+class CatalogFilters:
+    """Validated catalog query parameters"""
+
+    def __init__(self, params):
+        self.category = params.get("category", "").strip()
+        self.min_price = _parse_price(params.get("min_price"))
+        self.max_price = _parse_price(params.get("max_price"))
+        sort = params.get("sort", DEFAULT_SORT)
+        self.sort = sort if sort in SORT_OPTIONS else DEFAULT_SORT
+        self.cursor = params.get("after") or None
+
+    def apply(self, queryset, prefix=""):
+        """Filter `queryset` of candies, or of rows related to one via `prefix`"""
+        if self.category:
+            queryset = queryset.filter(**{f"{prefix}category": self.category})
+        if self.min_price is not None:
+            queryset = queryset.filter(**{f"{prefix}price__gte": self.min_price})
+        if self.max_price is not None:
+            queryset = queryset.filter(**{f"{prefix}price__lte": self.max_price})
+        return queryset
+
+    @property
+    def ordering(self):
+        return SORT_OPTIONS[self.sort]
+
+    def params(self):
+        """Normalized query parameters, without defaults or empty values"""
+        params = {}
+        if self.category:
+            params["category"] = self.category
+        if self.min_price is not None:
+            params["min_price"] = str(self.min_price)
+        if self.max_price is not None:
+            params["max_price"] = str(self.max_price)
+        if self.sort != DEFAULT_SORT:
+            params["sort"] = self.sort
+        if self.cursor:
+            params["after"] = self.cursor
+        return params
+
+    def querystring(self, **overrides):
+        params = self.params()
+        for name, value in overrides.items():
+            if value is None:
+                params.pop(name, None)
+            else:
+                params[name] = value
+        return "?" + urlencode(sorted(params.items())) if params else "?"
+
+    def cache_key(self):
+        return hashlib.md5(self.querystring().encode()).hexdigest()
+
+
+def catalog_page(filters, per_page=None):
+    """Return one KeysetPage of grid rows for the given filters"""
+    if per_page is None:
+        per_page = settings.CATALOG_PAGE_SIZE
+    if filters.sort == "bestselling":
+        return bestselling_page(filters, per_page)
+    queryset = filters.apply(Candy.objects.only(*GRID_FIELDS))
+    return paginate(queryset, filters.ordering, filters.cursor, per_page)
+
+
+def bestselling_page(filters, per_page):
+    """
+    One page of the "bestselling" listing: the ranked products read in index
+    order straight from the materialized ranking for the default window, then
+    the products without sales in it, by name.
+    """
+    window = SalesRanking.WINDOW_MONTH
+    cursor = filters.cursor or ""
+    candies = []
+    if not cursor.startswith(UNRANKED_CURSOR):
+        rankings = filters.apply(
+            SalesRanking.objects.filter(window_days=window, units__gt=0)
+            .select_related("candy")
+            .only("units", "candy", *(f"candy__{field}" for field in GRID_FIELDS)),
+            prefix="candy__",
+        )
+        ranked = paginate(rankings, filters.ordering, cursor or None, per_page)
+        candies = [ranking.candy for ranking in ranked]
+        if ranked.has_next:
+            return KeysetPage(candies, ranked.next_cursor)
+        cursor = UNRANKED_CURSOR
+
+    unranked = filters.apply(Candy.objects.only(*GRID_FIELDS)).exclude(
+        Exists(
+            SalesRanking.objects.filter(
+                candy=OuterRef("pk"), window_days=window, units__gt=0
+            )
+        )
+    )
+    remaining = per_page - len(candies)
+    if not remaining:
+        more = unranked.exists()
+        return KeysetPage(candies, UNRANKED_CURSOR if more else None)
+    page = paginate(
+        unranked,
+        UNRANKED_ORDERING,
+        cursor.removeprefix(UNRANKED_CURSOR) or None,
+        remaining,
+    )
+    next_cursor = UNRANKED_CURSOR + page.next_cursor if page.has_next else None
+    return KeysetPage(candies + page.object_list, next_cursor)
+
+
+def catalog_categories():
+    """Distinct category names for the filter dropdown"""
+    return list(
+        Candy.objects.order_by("category").values_list("category", flat=True).distinct()
+    )
+
+
+# The grid is cached for every visitor, so the per-user CSRF token is rendered
+# as this marker and swapped in after the cache lookup.
+CSRF_PLACEHOLDER = "__catalog_csrf_token__"
+
+
+def _catalog_cache():
+    return caches[settings.CATALOG_CACHE_ALIAS]
+
+
+def render_catalog_grid(request, filters):
+    """
+    Return the rendered product grid (cards and pager) for `filters`.
+    Fragments are keyed by the catalog version stamp, so an unchanged catalog
+    is served from the cache without touching the database.
+    """
+    cache = _catalog_cache()
+    key = f"catalog:grid:{get_version(CATALOG)}:{filters.cache_key()}"
+    html = cache.get(key)
+    if html is None:
+        page = catalog_page(filters)
+        context = {
+            "candies": page,
+            "page": page,
+            "csrf_token": CSRF_PLACEHOLDER,
+            "first_url": filters.querystring(after=None),
+            "next_url": (
+                filters.querystring(after=page.next_cursor) if page.has_next else None
+            ),
+            "is_first_page": not filters.cursor,
+        }
+        html = render_to_string("store/candy_grid.html", context)
+        cache.set(key, html, settings.CATALOG_CACHE_TIMEOUT)
+    return mark_safe(html.replace(CSRF_PLACEHOLDER, get_token(request)))
+
+
+def cached_catalog_categories():
+    """catalog_categories() behind the same version-keyed cache"""
+    cache = _catalog_cache()
+    key = f"catalog:categories:{get_version(CATALOG)}"
+    categories = cache.get(key)
+    if categories is None:
+        categories = catalog_categories()
+        cache.set(key, categories, settings.CATALOG_CACHE_TIMEOUT)
+    return categories
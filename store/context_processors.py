@@ -1,5 +1,14 @@
-from .cart import Cart
+from django.utils.functional import SimpleLazyObject
+
+from .cart import Cart, cart_item_count
 
 
 def cart(request):
-    return {"cart": Cart(request)}
+    """
+    The cart and its badge count, built only when a template reads them, so
+    rendering a page never loads the session just for the cart.
+    """
+    return {
+        "cart": SimpleLazyObject(lambda: Cart(request)),
+        "cart_count": SimpleLazyObject(lambda: cart_item_count(request)),
+    }
@@ -5,13 +5,24 @@ from .models import Candy, Review
 class CandyForm(forms.ModelForm):
     class Meta:
         model = Candy
-        fields = ["name", "description", "price", "stock", "category", "image_url"]
+        fields = [
+            "name",
+            "description",
+            "price",
+            "stock",
+            "category",
+            "image_url",
+            "image",
+        ]
         widgets = {
             "description": forms.Textarea(attrs={"rows": 4}),
         }
 
 
 class CheckoutForm(forms.Form):
+    # Never stored server-side; a queued shopper enters them again when called
+    PAYMENT_FIELDS = ("card_number", "expiry", "cvv")
+
     full_name = forms.CharField(max_length=200, label="Full Name")
     address = forms.CharField(max_length=255, label="Address")
     city = forms.CharField(max_length=100, label="City")
@@ -23,6 +34,10 @@ class CheckoutForm(forms.Form):
     )
     expiry = forms.CharField(max_length=5, label="Expiry (MM/YY)", initial="12/26")
     cvv = forms.CharField(max_length=3, label="CVV")
+    # Filled with a fresh token when the form is shown (see store.orders)
+    idempotency_key = forms.CharField(
+        max_length=64, required=False, widget=forms.HiddenInput
+    )
 
 
 class ReviewForm(forms.ModelForm):
@@ -0,0 +1,130 @@
+"""
+Product image pipeline.
+
+Every product image (an upload, an `image_url`, or one of the original bundled
+static files) is turned into WebP thumbnails at a few widths, written through
+the "thumbnails" storage. File names carry a hash of the source bytes, so they
+are served with far-future immutable caching (by WhiteNoise from
+WHITENOISE_ROOT with the default storage), and templates pick a width through
+`srcset`. `build_candy_images` rebuilds any whose files have gone missing.
+"""
+
+import hashlib
+import io
+import re
+import urllib.request
+from pathlib import Path
+
+from django.contrib.staticfiles import finders
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+from PIL import Image, ImageOps
+
+from .models import Candy
+
+RENDITION_WIDTHS = (128, 320, 640)
+WEBP_QUALITY = 80
+FETCH_TIMEOUT = 10
+# Largest `image_url` download; anything bigger is refused, not decoded
+MAX_FETCH_BYTES = 20 * 1024 * 1024
+
+# What an unreachable, corrupt or oversized source image raises
+IMAGE_ERRORS = (OSError, ValueError, Image.DecompressionBombError)
+
+# `thumbs/<source hash>-<width>.webp`; the hash makes the URL immutable
+RENDITION_NAME = re.compile(r"^/?thumbs/[0-9a-f]{16}-\d+\.webp$")
+
+# Shown for an upload that has no thumbnails (uploads aren't served directly)
+PLACEHOLDER_IMAGE = "store/images/placeholder.svg"
+
+# Images that used to be picked by name in the templates
+LEGACY_IMAGES = {
+    "Caramel": "store/images/caramel.png",
+    "Chocolate Bar": "store/images/Chocolate_Bar.png",
+    "Dark Chocolate": "store/images/Dark_Chocolate.png",
+    "Gummy Bears": "store/images/Gummy_Bears.webp",
+    "Jelly Beans": "store/images/Jelly_Beans.jpg",
+    "Lollipop": "store/images/Lollipop.webp",
+    "Peppermint": "store/images/Peppermint.webp",
+    "Sour Patch Kids": "store/images/SourPatch_kids.webp",
+}
+
+
+def thumbnail_storage():
+    return storages["thumbnails"]
+
+
+def source_bytes(candy):
+    """Raw bytes of the best available original for `candy`, or None"""
+    if candy.image:
+        with candy.image.open("rb") as upload:
+            return upload.read()
+    if candy.image_url:
+        with urllib.request.urlopen(candy.image_url, timeout=FETCH_TIMEOUT) as resp:
+            data = resp.read(MAX_FETCH_BYTES + 1)
+        if len(data) > MAX_FETCH_BYTES:
+            raise ValueError(f"{candy.image_url} is over {MAX_FETCH_BYTES} bytes")
+        return data
+    legacy = LEGACY_IMAGES.get(candy.name)
+    path = finders.find(legacy) if legacy else None
+    if path:
+        return Path(path).read_bytes()
+    return None
+
+
+def render_renditions(data):
+    """
+    Write WebP thumbnails of the image in `data` and return the rendition map:
+    {"<width>": "thumbs/<hash>-<width>.webp", ...}. Widths larger than the
+    original are skipped, except that the smallest is always produced.
+    """
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    with Image.open(io.BytesIO(data)) as original:
+        image = ImageOps.exif_transpose(original)
+        image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+
+    storage = thumbnail_storage()
+    renditions = {}
+    for width in RENDITION_WIDTHS:
+        if width > image.width and renditions:
+            break
+        name = f"thumbs/{digest}-{width}.webp"
+        if not storage.exists(name):
+            thumb = image.copy()
+            thumb.thumbnail((width, width * 4), Image.LANCZOS)
+            buffer = io.BytesIO()
+            thumb.save(buffer, "WEBP", quality=WEBP_QUALITY, method=6)
+            storage.save(name, ContentFile(buffer.getvalue()))
+        renditions[str(width)] = name
+    return renditions
+
+
+def renditions_missing(renditions):
+    """True if any of the rendition files is gone from storage"""
+    storage = thumbnail_storage()
+    return any(not storage.exists(name) for name in renditions.values())
+
+
+def refresh_candy_image(candy):
+    """
+    Rebuild the renditions for one candy and store them without re-saving the
+    whole row. Returns the rendition map ({} when there is no source image).
+    Callers bump the catalog version so cached grids pick up the new markup.
+    """
+    data = source_bytes(candy)
+    renditions = render_renditions(data) if data else {}
+    Candy.objects.filter(pk=candy.pk).update(image_renditions=renditions)
+    candy.image_renditions = renditions
+    return renditions
+
+
+def rendition_url(name):
+    return thumbnail_storage().url(name)
+
+
+def srcset(renditions):
+    """`srcset` attribute value for a rendition map"""
+    return ", ".join(
+        f"{rendition_url(name)} {width}w"
+        for width, name in sorted(renditions.items(), key=lambda item: int(item[0]))
+    )
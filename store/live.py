@@ -0,0 +1,170 @@
+"""
+Live order status over server-sent events.
+
+The order page opens one long-lived `text/event-stream` connection instead of
+polling the status API. The stream is an async generator served under ASGI,
+so an idle connection costs no worker thread. It pushes a `status` event
+whenever the order moves and ends once the order is delivered or cancelled.
+
+Changes are noticed two ways:
+
+- Saved changes (cancellation, the lifecycle scheduler) bump the order's
+  version stamp. One ChangeNotifier per process watches the global ORDERS
+  stamp and wakes every open stream when it moves, so the cost is one cache
+  read a second however many streams are open. Each stream then checks its
+  own order's stamp and only re-reads the order if that moved.
+- Time-based transitions need no write: a stream sleeps until its order's
+  next one is due and re-reads the order then.
+"""
+
+import asyncio
+import json
+import math
+
+from asgiref.sync import sync_to_async
+from django.utils import timezone
+
+from .models import DELIVER_AFTER, SHIP_AFTER, Order
+from .versions import ORDERS, get_version, order_scope
+
+FINAL_STATUSES = (Order.STATUS_DELIVERED, Order.STATUS_CANCELLED)
+HEARTBEAT = 15  # seconds between keep-alive comments
+STREAM_MAX_AGE = 10 * 60  # clients reconnect after this; bounds stale streams
+RETRY_MS = 3000
+FINAL_MAX_AGE = 60 * 60
+
+
+def status_payload(order):
+    """What the order page shows, from an order with effective status"""
+    status = order.effective_status
+    shipped_at, delivered_at = order.effective_shipped_at, order.effective_delivered_at
+    return {
+        "status": status,
+        "shipped_at": shipped_at.isoformat() if shipped_at else None,
+        "delivered_at": delivered_at.isoformat() if delivered_at else None,
+        "is_shipped": status in [Order.STATUS_SHIPPED, Order.STATUS_DELIVERED],
+        "is_delivered": status == Order.STATUS_DELIVERED,
+    }
+
+
+def next_transition(order):
+    """When `order`'s effective status will next change by itself, or None"""
+    if order.effective_status == Order.STATUS_CREATED:
+        return order.created_at + SHIP_AFTER
+    if order.effective_status == Order.STATUS_SHIPPED:
+        return order.created_at + DELIVER_AFTER
+    return None
+
+
+def status_max_age(order, now=None):
+    """
+    Seconds until `order`'s status next changes by itself (how long clients
+    may cache it); final orders get FINAL_MAX_AGE
+    """
+    due = next_transition(order)
+    if due is None:
+        return FINAL_MAX_AGE
+    remaining = (due - (now or timezone.now())).total_seconds()
+    return max(math.ceil(remaining), 1)
+
+
+class ChangeNotifier:
+    """
+    Watches one version stamp and wakes every waiting coroutine when it
+    moves. It polls only while someone is waiting, once per `interval`.
+    """
+
+    def __init__(self, scope, interval=1.0):
+        self.scope = scope
+        self.interval = interval
+        self.generation = 0
+        self._loop = None
+        self._task = None
+        self._changed = None
+        self._waiting = 0
+
+    async def wait(self, seen, timeout):
+        """
+        Wait up to `timeout` seconds for a change after generation `seen`.
+        Returns the current generation (unchanged if nothing happened).
+        """
+        self._start()
+        if self.generation != seen:
+            return self.generation
+        changed = self._changed
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._waiting -= 1
+        return self.generation
+
+    def _start(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # asyncio objects belong to one event loop
+            self._loop, self._task, self._changed = loop, None, asyncio.Event()
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._watch())
+
+    async def _watch(self):
+        last = await sync_to_async(get_version)(self.scope)
+        while True:
+            await asyncio.sleep(self.interval)
+            if not self._waiting:
+                return
+            current = await sync_to_async(get_version)(self.scope)
+            if current != last:
+                last = current
+                self.generation += 1
+                changed, self._changed = self._changed, asyncio.Event()
+                changed.set()
+
+
+notifier = ChangeNotifier(ORDERS)
+
+
+def _event(name, data):
+    return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+
+async def order_status_events(order_id, user):
+    """SSE chunks for one order until it is final or the stream gets old"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + STREAM_MAX_AGE
+    orders = Order.objects.filter(pk=order_id, user=user)
+    scope = order_scope(order_id)
+    generation = notifier.generation
+    sent = None
+
+    yield f"retry: {RETRY_MS}\n\n"
+    while True:
+        stamp = await sync_to_async(get_version)(scope)
+        order = await orders.with_effective_status().afirst()
+        if order is None:
+            return
+        payload = status_payload(order)
+        if payload != sent:
+            yield _event("status", payload)
+            sent = payload
+        if order.effective_status in FINAL_STATUSES:
+            return
+
+        due = next_transition(order)
+        while True:
+            if await sync_to_async(get_version)(scope) != stamp:
+                break
+            timeouts = [HEARTBEAT, deadline - loop.time()]
+            if due is not None:
+                timeouts.append((due - timezone.now()).total_seconds())
+            timeout = min(timeouts)
+            if timeout <= 0:
+                break
+            # Woken by a change anywhere, this order's stamp is checked again
+            seen, generation = generation, await notifier.wait(generation, timeout)
+            if generation == seen and timeout == HEARTBEAT:
+                yield ": keep-alive\n\n"
+        if loop.time() >= deadline:
+            return
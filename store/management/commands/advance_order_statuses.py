@@ -0,0 +1,29 @@
+"""
+Management command to save simulated order status transitions.
+Pages read an order's status from a query annotation, so nothing is written
+when customers look at their orders. This persists the due transitions in
+bulk and sends the shipping and delivery emails in one pass; for a
+long-running process that acts as each transition comes due, use
+`run_order_scheduler`.
+"""
+
+from django.core.management.base import BaseCommand
+from store.models import Order
+from store.signals import status_emails
+
+
+class Command(BaseCommand):
+    help = "Persist due order status transitions and notify customers"
+
+    def handle(self, *args, **options):
+        moved = Order.objects.advance_statuses()
+
+        for send, order in status_emails(moved):
+            send(order)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Shipped {len(moved[Order.STATUS_SHIPPED])} and delivered "
+                f"{len(moved[Order.STATUS_DELIVERED])} orders"
+            )
+        )
@@ -0,0 +1,51 @@
+"""
+Management command to build the WebP thumbnails for product images.
+Also converts the original bundled images (previously picked by name in the
+templates) for candies that have no upload or image_url.
+
+Without --force it builds candies that have no thumbnails yet and rebuilds
+those whose files are missing from the thumbnail storage (e.g. after a
+redeploy wiped a local disk), so it is cheap to run on every release.
+"""
+
+from django.core.management.base import BaseCommand
+from store.images import IMAGE_ERRORS, refresh_candy_image, renditions_missing
+from store.models import Candy
+from store.signals import bump_catalog_version
+
+
+class Command(BaseCommand):
+    help = "Build responsive WebP thumbnails for every candy image"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Rebuild candies that already have thumbnails",
+        )
+
+    def handle(self, *args, **options):
+        built = failed = 0
+        for candy in Candy.objects.order_by("id").iterator():
+            renditions = candy.image_renditions
+            if (
+                renditions
+                and not options["force"]
+                and not renditions_missing(renditions)
+            ):
+                continue
+            try:
+                renditions = refresh_candy_image(candy)
+            except IMAGE_ERRORS as e:
+                failed += 1
+                self.stderr.write(f"{candy.name}: {e}")
+                continue
+            if renditions:
+                built += 1
+
+        bump_catalog_version()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Built thumbnails for {built} candies ({failed} failed)"
+            )
+        )
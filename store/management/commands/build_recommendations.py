@@ -0,0 +1,139 @@
+"""
+Management command to build "customers also bought" recommendations.
+
+Reads every (order, product) pair from non-cancelled orders, counts how often
+each pair of products shares an order as a sparse co-occurrence matrix with
+vectorized NumPy operations, and stores the top-K neighbours per product.
+Neighbours are scored by cosine similarity (co-purchases divided by the
+geometric mean of both products' order counts), so a product that is in every
+basket doesn't top every list.
+"""
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from store.models import CandyRecommendation, Order, OrderItem
+from store.versions import RECOMMENDATIONS, bump_version
+
+
+def order_products():
+    """Unique (order index, product id) rows as two aligned int64 arrays"""
+    rows = (
+        OrderItem.objects.exclude(order__status=Order.STATUS_CANCELLED)
+        .values_list("order_id", "product_id")
+        .order_by()
+    )
+    pairs = np.array(list(rows), dtype=np.int64).reshape(-1, 2)
+    pairs = np.unique(pairs, axis=0)  # sorted by order; repeated lines collapse
+    _, order_index = np.unique(pairs[:, 0], return_inverse=True)
+    return order_index, pairs[:, 1]
+
+
+def _chunk_pairs(order_index, product_index, n_products):
+    """
+    Encoded (left * n + right) keys for every ordered pair of distinct products
+    sharing an order. Rows must be grouped by order.
+    """
+    starts = np.flatnonzero(np.r_[True, order_index[1:] != order_index[:-1]])
+    sizes = np.diff(np.r_[starts, len(order_index)])
+    # Each row pairs with every row of its own order
+    row_sizes = np.repeat(sizes, sizes)
+    row_starts = np.repeat(starts, sizes)
+    offsets = np.cumsum(row_sizes) - row_sizes
+    within = np.arange(row_sizes.sum()) - np.repeat(offsets, row_sizes)
+    left = np.repeat(np.arange(len(order_index)), row_sizes)
+    right = np.repeat(row_starts, row_sizes) + within
+
+    left, right = product_index[left], product_index[right]
+    distinct = left != right
+    return left[distinct] * n_products + right[distinct]
+
+
+def co_occurrence(order_index, product_index, n_products, chunk_size):
+    """Sparse co-occurrence counts as (keys, counts), keys = left * n + right"""
+    if not len(order_index):
+        return np.empty(0, np.int64), np.empty(0, np.float64)
+    keys, counts = [], []
+    boundaries = np.flatnonzero(np.r_[True, order_index[1:] != order_index[:-1]])
+    for first in range(0, len(boundaries), chunk_size):
+        start = boundaries[first]
+        stop = (
+            boundaries[first + chunk_size]
+            if first + chunk_size < len(boundaries)
+            else len(order_index)
+        )
+        chunk = _chunk_pairs(
+            order_index[start:stop], product_index[start:stop], n_products
+        )
+        chunk_keys, chunk_counts = np.unique(chunk, return_counts=True)
+        keys.append(chunk_keys)
+        counts.append(chunk_counts)
+
+    merged, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+    return merged, np.bincount(inverse, weights=np.concatenate(counts))
+
+
+def top_neighbours(keys, counts, order_counts, n_products, top_k):
+    """(left, right, rank, score) arrays of the best `top_k` neighbours per row"""
+    left, right = np.divmod(keys, n_products)
+    scores = counts / np.sqrt(order_counts[left] * order_counts[right])
+    # Group by row, best score first, product index as the tie-breaker
+    order = np.lexsort((right, -scores, left))
+    left, right, scores = left[order], right[order], scores[order]
+    starts = np.flatnonzero(np.r_[True, left[1:] != left[:-1]])[: len(left)]
+    sizes = np.diff(np.r_[starts, len(left)])
+    rank = np.arange(len(left)) - np.repeat(starts, sizes)
+    keep = rank < top_k
+    return left[keep], right[keep], rank[keep], scores[keep]
+
+
+class Command(BaseCommand):
+    help = "Rebuild the co-purchase recommendations shown on product pages"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--top-k",
+            type=int,
+            default=8,
+            help="Neighbours stored per product (default: 8)",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=5000,
+            help="Orders expanded into pairs at a time (default: 5000)",
+        )
+
+    def handle(self, *args, **options):
+        order_index, product_ids = order_products()
+        candy_ids, product_index = np.unique(product_ids, return_inverse=True)
+        n_products = len(candy_ids)
+
+        keys, counts = co_occurrence(
+            order_index, product_index, n_products, options["chunk_size"]
+        )
+        order_counts = np.bincount(product_index, minlength=n_products)
+        left, right, rank, scores = top_neighbours(
+            keys, counts, order_counts, n_products, options["top_k"]
+        )
+
+        rows = [
+            CandyRecommendation(
+                candy_id=int(candy_ids[a]),
+                recommended_id=int(candy_ids[b]),
+                rank=int(r),
+                score=float(s),
+            )
+            for a, b, r, s in zip(left, right, rank, scores)
+        ]
+        with transaction.atomic():
+            CandyRecommendation.objects.all().delete()
+            CandyRecommendation.objects.bulk_create(rows, batch_size=1000)
+        bump_version(RECOMMENDATIONS)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Built {len(rows)} recommendations for "
+                f"{len(np.unique(left))} of {n_products} products"
+            )
+        )
@@ -0,0 +1,60 @@
+"""
+Management command to recompute Candy.review_count, Candy.rating_sum and
+Candy.rating_avg
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+from store.models import Candy, Review
+from store.signals import bump_catalog_version
+
+
+class Command(BaseCommand):
+    help = "Rebuild the denormalized review count, sum and average on every candy"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Rows per bulk UPDATE (default: 500)",
+        )
+
+    def handle(self, *args, **options):
+        totals = {
+            row["candy"]: (row["count"], row["total"])
+            for row in Review.objects.order_by()
+            .values("candy")
+            .annotate(count=Count("id"), total=Sum("rating"))
+        }
+
+        changed = []
+        candies = Candy.objects.only("id", "review_count", "rating_sum", "rating_avg")
+        for candy in candies.iterator():
+            count, total = totals.get(candy.id, (0, 0))
+            average = total / count if count else 0
+            if (candy.review_count, candy.rating_sum, candy.rating_avg) != (
+                count,
+                total,
+                average,
+            ):
+                candy.review_count = count
+                candy.rating_sum = total
+                candy.rating_avg = average
+                changed.append(candy)
+
+        with transaction.atomic():
+            Candy.objects.bulk_update(
+                changed,
+                ["review_count", "rating_sum", "rating_avg"],
+                batch_size=options["batch_size"],
+            )
+            if changed:
+                bump_catalog_version()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Rebuilt rating aggregates: {len(changed)} candies updated"
+            )
+        )
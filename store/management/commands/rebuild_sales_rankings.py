@@ -0,0 +1,31 @@
+"""
+Management command to roll the best-seller windows forward.
+Run daily (e.g. from cron) so sales older than a window drop out of it.
+"""
+
+from django.core.management.base import BaseCommand
+from store.rankings import rebuild_daily_sales, rebuild_rankings
+from store.signals import bump_catalog_version
+
+
+class Command(BaseCommand):
+    help = "Rebuild the materialized best-seller rankings"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Also recompute the daily sales buckets from every order",
+        )
+
+    def handle(self, *args, **options):
+        if options["full"]:
+            buckets = rebuild_daily_sales()
+            self.stdout.write(f"Rebuilt {buckets} daily sales buckets")
+
+        rows = rebuild_rankings()
+        bump_catalog_version()
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Rebuilt sales rankings: {rows} ranking rows")
+        )
@@ -0,0 +1,18 @@
+"""
+Management command to delete expired stock reservations.
+Expired holds already stop counting against stock; run this periodically
+(e.g. every few minutes from cron) to keep the reservations table small.
+"""
+
+from django.core.management.base import BaseCommand
+from store.reservations import release_expired
+
+
+class Command(BaseCommand):
+    help = "Delete expired cart stock reservations"
+
+    def handle(self, *args, **options):
+        count = release_expired()
+        self.stdout.write(
+            self.style.SUCCESS(f"Released {count} expired stock reservations")
+        )
@@ -0,0 +1,123 @@
+"""
+Management command that moves orders through Created -> Shipped -> Delivered
+as each transition comes due.
+
+Upcoming transitions are kept in a min-heap of (due time, order id). The
+process sleeps until the earliest one is due, saves every due order with one
+bulk UPDATE per status (Order.objects.advance_statuses) and hands the emails
+to a sender thread, so a slow mail server never delays the next transition.
+
+A new order can't come due sooner than SHIP_AFTER after it is placed, so the
+open orders are re-read at that interval and no transition is ever late.
+
+Every STOCK_SYNC_INTERVAL it also refreshes the Candy.stock totals of sharded
+products whose orders came in after their last throttled sync (store.stock).
+"""
+
+import heapq
+import queue
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+from store import stock
+from store.models import DELIVER_AFTER, SHIP_AFTER, Order
+from store.signals import status_emails
+
+
+def upcoming_transitions():
+    """Heap of (due time, order id) for every order not yet delivered"""
+    heap = [
+        (
+            created_at
+            + (SHIP_AFTER if status == Order.STATUS_CREATED else DELIVER_AFTER),
+            pk,
+        )
+        for pk, status, created_at in Order.objects.filter(
+            status__in=[Order.STATUS_CREATED, Order.STATUS_SHIPPED]
+        ).values_list("pk", "status", "created_at")
+    ]
+    heapq.heapify(heap)
+    return heap
+
+
+def pop_due(heap, now):
+    """Ids of every transition in `heap` due by `now`"""
+    due = []
+    while heap and heap[0][0] <= now:
+        due.append(heapq.heappop(heap)[1])
+    return due
+
+
+def send_emails(outbox):
+    """Sender thread: sends queued (send, order) jobs until it gets None"""
+    while True:
+        job = outbox.get()
+        if job is None:
+            break
+        send, order = job
+        send(order)
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = "Advance order statuses as they come due (long-running)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Advance whatever is due now, send its emails and exit",
+        )
+
+    def handle(self, *args, **options):
+        outbox = queue.Queue()
+        sender = threading.Thread(target=send_emails, args=(outbox,), daemon=True)
+        sender.start()
+        self.stop = threading.Event()
+        try:
+            self.run(outbox, once=options["once"])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            outbox.put(None)
+            sender.join()
+
+    def run(self, outbox, once=False):
+        heap, rescan_at = [], timezone.now()
+        sync_at = rescan_at
+        while not self.stop.is_set():
+            now = timezone.now()
+            if now >= rescan_at:
+                heap = upcoming_transitions()
+                rescan_at = now + SHIP_AFTER
+            if now >= sync_at:
+                stock.sync_totals()
+                sync_at = now + timedelta(seconds=settings.STOCK_SYNC_INTERVAL)
+
+            due = pop_due(heap, now)
+            if due:
+                moved = Order.objects.filter(pk__in=due).advance_statuses(now)
+                for job in status_emails(moved):
+                    outbox.put(job)
+                # Shipped orders come back for their delivery
+                for pk, created_at in Order.objects.filter(
+                    pk__in=moved[Order.STATUS_SHIPPED]
+                ).values_list("pk", "created_at"):
+                    heapq.heappush(heap, (created_at + DELIVER_AFTER, pk))
+                self.stdout.write(
+                    f"{now:%H:%M:%S} shipped {len(moved[Order.STATUS_SHIPPED])}, "
+                    f"delivered {len(moved[Order.STATUS_DELIVERED])}"
+                )
+            if once:
+                return
+
+            # Sleep until the next transition, look for new orders or sync
+            wake_at = min(rescan_at, sync_at)
+            if heap:
+                wake_at = min(heap[0][0], wake_at)
+            close_old_connections()
+            self.stop.wait(max((wake_at - timezone.now()).total_seconds(), 0))
@@ -0,0 +1,33 @@
+# Generated by Django 6.0 on 2026-10-17 03:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0009_alter_productwatchlist_options_and_more"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="candy",
+            index=models.Index(fields=["name", "id"], name="candy_name_id_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="candy",
+            index=models.Index(fields=["price", "id"], name="candy_price_id_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="candy",
+            index=models.Index(
+                fields=["category", "name", "id"], name="candy_cat_name_id_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="candy",
+            index=models.Index(
+                fields=["category", "price", "id"], name="candy_cat_price_id_idx"
+            ),
+        ),
+    ]
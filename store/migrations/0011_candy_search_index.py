@@ -0,0 +1,66 @@
+# Generated by Django 6.0 on 2026-10-17 03:40
+
+from django.db import migrations
+
+POSTGRES_FORWARD = [
+    """
+    ALTER TABLE store_candy ADD COLUMN search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(category, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'C')
+    ) STORED
+    """,
+    "CREATE INDEX candy_search_vector_idx ON store_candy USING GIN (search_vector)",
+]
+POSTGRES_REVERSE = [
+    "DROP INDEX IF EXISTS candy_search_vector_idx",
+    "ALTER TABLE store_candy DROP COLUMN IF EXISTS search_vector",
+]
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE store_candy_fts USING fts5(name, description, category)",
+    """
+    INSERT INTO store_candy_fts (rowid, name, description, category)
+    SELECT id, name, description, category FROM store_candy
+    """,
+]
+SQLITE_REVERSE = ["DROP TABLE IF EXISTS store_candy_fts"]
+
+
+def _run(schema_editor, statements):
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        _run(schema_editor, POSTGRES_FORWARD)
+    elif vendor == "sqlite":
+        from django.db import OperationalError
+
+        try:
+            _run(schema_editor, SQLITE_FORWARD)
+        except OperationalError:
+            # SQLite built without FTS5: store.search falls back to icontains
+            pass
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        _run(schema_editor, POSTGRES_REVERSE)
+    elif vendor == "sqlite":
+        _run(schema_editor, SQLITE_REVERSE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0010_candy_catalog_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 6.0 on 2026-10-17 03:22
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def populate_rating_aggregates(apps, schema_editor):
+    Candy = apps.get_model("store", "Candy")
+    Review = apps.get_model("store", "Review")
+    totals = Review.objects.values("candy").annotate(
+        count=Count("id"), total=Sum("rating")
+    )
+    for row in totals:
+        Candy.objects.filter(pk=row["candy"]).update(
+            review_count=row["count"], rating_sum=row["total"]
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0011_candy_search_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="candy",
+            name="rating_sum",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="candy",
+            name="review_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_rating_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 6.0 on 2026-10-17 03:23
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0012_candy_rating_aggregates"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="review",
+            index=models.Index(
+                fields=["candy", "-created_at", "-id"], name="review_candy_created_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 6.0 on 2026-10-17 03:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0014_sales_rankings"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CandyRecommendation",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("rank", models.PositiveSmallIntegerField()),
+                ("score", models.FloatField()),
+                (
+                    "candy",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="recommendations",
+                        to="store.candy",
+                    ),
+                ),
+                (
+                    "recommended",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="store.candy",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["candy", "rank"],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("candy", "rank"), name="unique_recommendation_rank"
+                    )
+                ],
+            },
+        ),
+    ]
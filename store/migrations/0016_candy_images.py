@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-17 03:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0015_candy_recommendations"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="candy",
+            name="image",
+            field=models.ImageField(blank=True, upload_to="candies/"),
+        ),
+        migrations.AddField(
+            model_name="candy",
+            name="image_renditions",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 6.0 on 2026-10-17 03:38
+
+from django.db import migrations, models
+
+
+def clamp_negative_stock(apps, schema_editor):
+    # Oversold products from before the constraint would make it fail to apply
+    Candy = apps.get_model("store", "Candy")
+    Candy.objects.filter(stock__lt=0).update(stock=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0016_candy_images"),
+    ]
+
+    operations = [
+        migrations.RunPython(clamp_negative_stock, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="candy",
+            constraint=models.CheckConstraint(
+                condition=models.Q(("stock__gte", 0)), name="candy_stock_non_negative"
+            ),
+        ),
+    ]
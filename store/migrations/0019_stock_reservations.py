@@ -0,0 +1,52 @@
+# Generated by Django 6.0 on 2026-10-17 03:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0018_order_idempotency_key"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StockReservation",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("holder", models.CharField(max_length=64)),
+                ("quantity", models.PositiveIntegerField()),
+                ("expires_at", models.DateTimeField()),
+                (
+                    "candy",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="reservations",
+                        to="store.candy",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["candy", "expires_at"], name="reservation_active_idx"
+                    ),
+                    models.Index(fields=["expires_at"], name="reservation_expiry_idx"),
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("holder", "candy"), name="unique_stock_reservation"
+                    )
+                ],
+            },
+        ),
+    ]
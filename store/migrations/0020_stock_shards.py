@@ -0,0 +1,54 @@
+# Generated by Django 6.0 on 2026-10-17 03:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0019_stock_reservations"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="candy",
+            name="stock_slots",
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name="StockShard",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("slot", models.PositiveSmallIntegerField()),
+                ("stock", models.IntegerField(default=0)),
+                (
+                    "candy",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="stock_shards",
+                        to="store.candy",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("candy", "slot"), name="unique_stock_shard"
+                    ),
+                    models.CheckConstraint(
+                        condition=models.Q(("stock__gte", 0)),
+                        name="stock_shard_non_negative",
+                    ),
+                ],
+            },
+        ),
+    ]
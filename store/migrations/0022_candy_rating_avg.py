@@ -0,0 +1,34 @@
+# Generated by Django 6.0 on 2026-10-17 04:47
+
+from django.db import migrations, models
+from django.db.models import F, FloatField
+from django.db.models.functions import Cast
+
+
+def populate_rating_avg(apps, schema_editor):
+    Candy = apps.get_model("store", "Candy")
+    Candy.objects.filter(review_count__gt=0).update(
+        rating_avg=Cast("rating_sum", FloatField()) / F("review_count")
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0021_order_history_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="candy",
+            name="rating_avg",
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name="candy",
+            index=models.Index(
+                fields=["rating_avg", "review_count", "id"], name="candy_rating_idx"
+            ),
+        ),
+        migrations.RunPython(populate_rating_avg, migrations.RunPython.noop),
+    ]
@@ -2,11 +2,18 @@
 Store models
 """
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
+from django.db.models.functions import Cast, Coalesce, Greatest
 from django.utils import timezone
 import datetime
 
 
+def rating_average(count, total):
+    """Expression for the mean of `total` over `count` ratings; 0 when unrated"""
+    return Cast(total, models.FloatField()) / Greatest(count, 1)
+
+
 class Candy(models.Model):
     """Candy model"""
 
@@ -14,16 +21,152 @@ class Candy(models.Model):
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.IntegerField(default=0)
+    # Hot products can split their stock over this many StockShard rows so
+    # concurrent orders don't all lock this row; `stock` then holds their
+    # total (see store.stock). 0 keeps stock on this row.
+    stock_slots = models.PositiveSmallIntegerField(default=0)
     category = models.CharField(max_length=100)
     image_url = models.URLField(blank=True, default="")
+    image = models.ImageField(upload_to="candies/", blank=True)
+    # Width -> hashed WebP thumbnail path, built by store.images
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
+
+    # Denormalized review aggregates, maintained by the Review signals and
+    # rebuilt by `manage.py rebuild_rating_aggregates`
+    review_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    # rating_sum / review_count (0 when unrated), stored so "Top Rated" can
+    # walk an index
+    rating_avg = models.FloatField(default=0, editable=False)
 
     class Meta:
         verbose_name_plural = "candies"
         ordering = ["name"]
+        constraints = [
+            models.CheckConstraint(
+                condition=models.Q(stock__gte=0), name="candy_stock_non_negative"
+            ),
+        ]
+        # Back the catalog's keyset sort options (see store.catalog.SORT_OPTIONS)
+        indexes = [
+            models.Index(fields=["name", "id"], name="candy_name_id_idx"),
+            models.Index(fields=["price", "id"], name="candy_price_id_idx"),
+            models.Index(
+                fields=["category", "name", "id"], name="candy_cat_name_id_idx"
+            ),
+            models.Index(
+                fields=["category", "price", "id"], name="candy_cat_price_id_idx"
+            ),
+            models.Index(
+                fields=["rating_avg", "review_count", "id"], name="candy_rating_idx"
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored image source so a replaced one gets new thumbnails
+        instance._loaded_image_source = (
+            instance.__dict__.get("image"),
+            instance.__dict__.get("image_url"),
+        )
+        return instance
+
+    @property
+    def has_image(self):
+        return bool(self.image_renditions or self.image or self.image_url)
+
+    @property
+    def average_rating(self):
+        """Mean review rating, or None when there are no reviews"""
+        if not self.review_count:
+            return None
+        return self.rating_sum / self.review_count
+
+
+# Simulated fulfilment: an order ships a minute after it is placed and is
+# delivered a minute after that
+SHIP_AFTER = datetime.timedelta(minutes=1)
+DELIVER_AFTER = datetime.timedelta(minutes=2)
+
+
+class OrderQuerySet(models.QuerySet):
+    def with_effective_status(self, now=None):
+        """
+        Annotate where each order has got to by `now`, computed in SQL:
+        `effective_status`, `effective_shipped_at` and `effective_delivered_at`.
+        Reads use these and never write; advance_statuses() saves them.
+        """
+        now = now or timezone.now()
+        shipped = models.Q(created_at__lte=now - SHIP_AFTER)
+        delivered = models.Q(created_at__lte=now - DELIVER_AFTER)
+        settled = models.Q(status__in=[Order.STATUS_DELIVERED, Order.STATUS_CANCELLED])
+        cancelled = models.Q(status=Order.STATUS_CANCELLED)
+        return self.annotate(
+            effective_status=models.Case(
+                models.When(settled, then=models.F("status")),
+                models.When(delivered, then=models.Value(Order.STATUS_DELIVERED)),
+                models.When(shipped, then=models.Value(Order.STATUS_SHIPPED)),
+                default=models.F("status"),
+                output_field=models.CharField(),
+            ),
+            effective_shipped_at=models.Case(
+                models.When(
+                    models.Q(shipped_at__isnull=False) | cancelled,
+                    then=models.F("shipped_at"),
+                ),
+                models.When(shipped, then=models.F("created_at") + SHIP_AFTER),
+                default=None,
+                output_field=models.DateTimeField(),
+            ),
+            effective_delivered_at=models.Case(
+                models.When(
+                    models.Q(delivered_at__isnull=False) | cancelled,
+                    then=models.F("delivered_at"),
+                ),
+                models.When(delivered, then=models.F("created_at") + DELIVER_AFTER),
+                default=None,
+                output_field=models.DateTimeField(),
+            ),
+        )
+
+    def advance_statuses(self, now=None):
+        """
+        Save every due transition in bulk, one UPDATE per target status.
+        Returns {status: [ids of the orders moved to it]}.
+        """
+        now = now or timezone.now()
+        moved = {}
+        for status, sources in (
+            (Order.STATUS_DELIVERED, [Order.STATUS_CREATED, Order.STATUS_SHIPPED]),
+            (Order.STATUS_SHIPPED, [Order.STATUS_CREATED]),
+        ):
+            ids = list(
+                self.with_effective_status(now)
+                .filter(effective_status=status, status__in=sources)
+                .values_list("id", flat=True)
+            )
+            changes = {
+                "status": status,
+                "shipped_at": Coalesce(
+                    "shipped_at", models.F("created_at") + SHIP_AFTER
+                ),
+                "updated_at": now,
+            }
+            if status == Order.STATUS_DELIVERED:
+                changes["delivered_at"] = models.F("created_at") + DELIVER_AFTER
+            # `status__in` again: an order cancelled meanwhile stays cancelled
+            self.filter(pk__in=ids, status__in=sources).update(**changes)
+            moved[status] = ids
+
+        from .signals import bump_order_versions
+
+        bump_order_versions(moved[Order.STATUS_SHIPPED] + moved[Order.STATUS_DELIVERED])
+        return moved
+
 
 class Order(models.Model):
     """Order model"""
@@ -58,55 +201,90 @@ class Order(models.Model):
     city = models.CharField(max_length=100, default="")
     zip_code = models.CharField(max_length=20, default="")
 
+    # Token from the checkout form; a resubmitted form finds this order
+    # instead of placing a second one
+    idempotency_key = models.CharField(
+        max_length=64, unique=True, null=True, blank=True, editable=False
+    )
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        # Backs the order history's keyset pages (see views.order_history_page)
+        indexes = [
+            models.Index(
+                fields=["user", "created_at", "id"], name="order_user_created_idx"
+            ),
+        ]
+
     def cancel_order(self):
         """
         Cancel the order and restore stock for all items.
         Only allowed if order status is 'Created'.
         Returns True if successful, False otherwise.
         """
-        if self.status != self.STATUS_CREATED:
-            return False
-
-        # Restore stock for all items
-        for item in self.items.all():
-            item.product.stock += item.quantity
-            item.product.save()
-
-        # Update order status
-        self.status = self.STATUS_CANCELLED
-        self.save()
+        from . import stock
+        from .rankings import record_sales_on_commit
+        from .signals import bump_catalog_version, stock_changed
+
+        with transaction.atomic():
+            # Lock the order so a second cancel or the lifecycle scheduler
+            # waits for us. An order that has (virtually) shipped can't be
+            # cancelled, even if that transition hasn't been saved yet
+            locked = (
+                Order.objects.select_for_update()
+                .with_effective_status()
+                .filter(
+                    pk=self.pk,
+                    status=self.STATUS_CREATED,
+                    effective_status=self.STATUS_CREATED,
+                )
+                .first()
+            )
+            if locked is None:
+                return False
+
+            lines = list(self.items.values_list("product_id", "quantity", "price"))
+            quantities = {}
+            for product_id, quantity, _ in lines:
+                quantities[product_id] = quantities.get(product_id, 0) + quantity
+            products = Candy.objects.in_bulk(quantities)
+
+            # Restore stock for all items, in the same order place_order takes it
+            sharded = []
+            for product_id, quantity in sorted(quantities.items()):
+                product = products[product_id]
+                if product.stock_slots:
+                    stock.restore(product, quantity)
+                    sharded.append(product_id)
+                else:
+                    Candy.objects.filter(pk=product_id).update(
+                        stock=F("stock") + quantity
+                    )
+            for product_id, level in stock.stock_levels(quantities).items():
+                products[product_id].stock = level
+            old_stock = {
+                pid: products[pid].stock - qty for pid, qty in quantities.items()
+            }
+
+            # Update order status
+            self.status = self.STATUS_CANCELLED
+            self.save()
+
+            record_sales_on_commit(lines, timezone.localdate(self.created_at), sign=-1)
+            if sharded:
+                transaction.on_commit(lambda: stock.sync_totals(sharded))
+            bump_catalog_version()
+            transaction.on_commit(
+                lambda: stock_changed.send(
+                    sender=Order,
+                    candies=list(products.values()),
+                    old_stock=old_stock,
+                    order=self,
+                )
+            )
         return True
 
-    def update_status_based_on_time(self):
-        """
-        Simulate order processing:
-        Created -> Shipped (after 1 min)
-        Shipped -> Delivered (after 2 mins from creation)
-        """
-        if self.status == self.STATUS_DELIVERED:
-            return
-
-        now = timezone.now()
-        diff = now - self.created_at
-        updated = False
-
-        # Status transitions based on elapsed time
-        if diff >= datetime.timedelta(minutes=1):
-            if self.status == self.STATUS_CREATED:
-                self.status = self.STATUS_SHIPPED
-                # Backdate the timestamp to when it 'should' have happened
-                self.shipped_at = self.created_at + datetime.timedelta(minutes=1)
-                self.save()
-
-        if diff >= datetime.timedelta(minutes=2):
-            if self.status in [self.STATUS_CREATED, self.STATUS_SHIPPED]:
-                self.status = self.STATUS_DELIVERED
-                # Ensure shipped_at is set if skipped
-                if not self.shipped_at:
-                    self.shipped_at = self.created_at + datetime.timedelta(minutes=1)
-                self.delivered_at = self.created_at + datetime.timedelta(minutes=2)
-                self.save()
-
     def __str__(self):
         return f"Order {self.id} - {self.status}"
 
@@ -158,10 +336,24 @@ class Review(models.Model):
     class Meta:
         ordering = ["-created_at"]
         unique_together = ("user", "candy")  # Limit 1 review per candy per user
+        # Backs the newest-first review pages on candy_detail
+        indexes = [
+            models.Index(
+                fields=["candy", "-created_at", "-id"], name="review_candy_created_idx"
+            ),
+        ]
 
     def __str__(self):
         return f"{self.rating}* by {self.user.username} for {self.candy.name}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored rating so an edit can adjust Candy.rating_sum
+        # by the difference without re-reading the row
+        instance._loaded_rating = instance.__dict__.get("rating")
+        return instance
+
 
 class ProductWatchlist(models.Model):
     """
@@ -222,3 +414,146 @@ class StockAlert(models.Model):
 
     def __str__(self):
         return f"Restock Alert: {self.user.username} - {self.product.name}"
+
+
+class DailySales(models.Model):
+    """
+    Units and revenue sold per candy per day.
+    Source data for the rolling SalesRanking windows.
+    """
+
+    candy = models.ForeignKey(
+        Candy, on_delete=models.CASCADE, related_name="daily_sales"
+    )
+    day = models.DateField()
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name_plural = "daily sales"
+        constraints = [
+            models.UniqueConstraint(fields=["candy", "day"], name="unique_daily_sales")
+        ]
+
+    def __str__(self):
+        return f"{self.candy.name} on {self.day}: {self.units}"
+
+
+class SalesRanking(models.Model):
+    """
+    Materialized best-seller table: units and revenue per candy over a rolling
+    window. Updated incrementally as orders are placed or cancelled, and
+    rebuilt from DailySales by `manage.py rebuild_sales_rankings`.
+    """
+
+    WINDOW_WEEK = 7
+    WINDOW_MONTH = 30
+
+    WINDOW_CHOICES = (
+        (WINDOW_WEEK, "Last 7 days"),
+        (WINDOW_MONTH, "Last 30 days"),
+    )
+
+    candy = models.ForeignKey(
+        Candy, on_delete=models.CASCADE, related_name="sales_rankings"
+    )
+    window_days = models.PositiveSmallIntegerField(choices=WINDOW_CHOICES)
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["candy", "window_days"], name="unique_sales_ranking"
+            )
+        ]
+        # Top-N reads walk this index in order
+        indexes = [
+            models.Index(
+                fields=["window_days", "-units", "-candy"], name="sales_ranking_top_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.candy.name}: {self.units} units / {self.window_days} days"
+
+
+class CandyRecommendation(models.Model):
+    """
+    Precomputed "customers also bought" neighbours for a candy, best first.
+    Rebuilt offline by `manage.py build_recommendations`.
+    """
+
+    candy = models.ForeignKey(
+        Candy, on_delete=models.CASCADE, related_name="recommendations"
+    )
+    recommended = models.ForeignKey(Candy, on_delete=models.CASCADE, related_name="+")
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ["candy", "rank"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["candy", "rank"], name="unique_recommendation_rank"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.candy.name} -> {self.recommended.name} (#{self.rank})"
+
+
+class StockReservation(models.Model):
+    """
+    A time-limited hold on stock for one cart (see store.reservations).
+    Only used when settings.STOCK_RESERVATIONS is on; holds past `expires_at`
+    no longer count and are deleted by `manage.py release_reservations`.
+    """
+
+    candy = models.ForeignKey(
+        Candy, on_delete=models.CASCADE, related_name="reservations"
+    )
+    holder = models.CharField(max_length=64)
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["holder", "candy"], name="unique_stock_reservation"
+            )
+        ]
+        indexes = [
+            models.Index(fields=["candy", "expires_at"], name="reservation_active_idx"),
+            models.Index(fields=["expires_at"], name="reservation_expiry_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.candy.name} for {self.holder}"
+
+
+class StockShard(models.Model):
+    """
+    One slot of a sharded product's stock (see Candy.stock_slots and
+    store.stock). The product's stock is the sum over its slots.
+    """
+
+    candy = models.ForeignKey(
+        Candy, on_delete=models.CASCADE, related_name="stock_shards"
+    )
+    slot = models.PositiveSmallIntegerField()
+    stock = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["candy", "slot"], name="unique_stock_shard"
+            ),
+            models.CheckConstraint(
+                condition=models.Q(stock__gte=0), name="stock_shard_non_negative"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.candy} slot {self.slot}: {self.stock}"
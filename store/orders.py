@@ -0,0 +1,174 @@
+"""
+Order placement.
+
+Stock is taken with one conditional UPDATE per product
+(`SET stock = stock - n WHERE stock >= n`) inside a transaction, so two
+checkouts racing for the last items can't both succeed, and the database's
+`stock >= 0` constraint backs that up. Alerts and cache invalidation run once
+per order, after commit.
+
+With stock reservations on, other carts' unexpired holds are left alone and
+the buyer's own holds are released as their lines become the order.
+
+Products with sharded stock (see store.stock) are decremented one slot at a
+time instead of on their `store_candy` row.
+
+Checkout forms carry an idempotency key, stored unique on the Order, so a
+double-click or client retry gets the first order back instead of a second.
+"""
+
+import uuid
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Value
+from django.utils import timezone
+
+from . import reservations, stock
+from .models import Candy, Order, OrderItem
+from .rankings import record_sales_on_commit
+from .signals import (
+    bump_catalog_version,
+    send_order_confirmation_on_commit,
+    stock_changed,
+)
+
+
+class OutOfStock(Exception):
+    """A cart line asks for more than is left"""
+
+    def __init__(self, product, available):
+        self.product = product
+        self.available = available
+        super().__init__(f"Not enough stock for {product.name}. Only {available} left.")
+
+
+def new_idempotency_key():
+    return uuid.uuid4().hex
+
+
+def replayed_order(user, idempotency_key):
+    """The order `user` already placed with this key, or None"""
+    if not idempotency_key:
+        return None
+    return Order.objects.filter(user=user, idempotency_key=idempotency_key).first()
+
+
+def take_stock(quantities, holder=None, sharded_hint=()):
+    """
+    Decrement stock for {product_id: quantity}, all or nothing.
+    Must run inside a transaction; raises OutOfStock on the first short line.
+    With stock reservations on, units held by carts other than `holder` are
+    not for sale. `sharded_hint` names products believed to have sharded
+    stock, which skip the attempt on their own row.
+
+    Returns the ids of the sharded products taken from, whose `Candy.stock`
+    totals are stale until store.stock syncs them.
+    """
+    sharded = []
+    # A fixed order keeps concurrent orders from locking rows in opposite orders
+    for product_id in sorted(quantities):
+        quantity = quantities[product_id]
+        if product_id not in sharded_hint:
+            needed = Value(quantity)
+            if reservations.enabled():
+                needed = needed + reservations.held_by_others(holder)
+            taken = Candy.objects.filter(
+                pk=product_id, stock_slots=0, stock__gte=needed
+            ).update(stock=F("stock") - quantity)
+            if taken:
+                continue
+
+        product = Candy.objects.get(pk=product_id)
+        if reservations.enabled():
+            available = reservations.available_to_sell(product, holder)
+        else:
+            available = stock.stock_levels([product_id])[product_id]
+        # Sharded products: holds are checked up front here, and the slots
+        # themselves can't go negative
+        if product.stock_slots:
+            sharded.append(product_id)
+            if available >= quantity and stock.take(product, quantity):
+                continue
+        raise OutOfStock(product, max(available, 0))
+    return sharded
+
+
+def place_order(user, cart, idempotency_key=None, **details):
+    """
+    Turn the cart into an Order with its items and take the stock, in one
+    transaction. `details` are extra Order fields (shipping address etc.).
+    Raises OutOfStock, leaving stock and orders untouched.
+
+    If an order was already placed with `idempotency_key`, that order is
+    returned and nothing else happens.
+    """
+    existing = replayed_order(user, idempotency_key)
+    if existing is not None:
+        return existing
+    try:
+        return _place_order(user, cart, idempotency_key or None, details)
+    except IntegrityError:
+        # A concurrent submission with the same key committed first; our
+        # transaction (stock included) was rolled back
+        existing = replayed_order(user, idempotency_key)
+        if existing is None:
+            raise
+        return existing
+
+
+def _place_order(user, cart, idempotency_key, details):
+    lines = list(cart)
+    quantities = {}
+    for line in lines:
+        product_id = line["product"].id
+        quantities[product_id] = quantities.get(product_id, 0) + line["quantity"]
+    products = {line["product"].id: line["product"] for line in lines}
+    hint = {pid for pid, product in products.items() if product.stock_slots}
+
+    holder = cart.storage.holder_id() if reservations.enabled() else None
+
+    with transaction.atomic():
+        sharded = take_stock(quantities, holder, hint)
+        order = Order(
+            user=user,
+            total_price=cart.get_total_price(),
+            idempotency_key=idempotency_key,
+            **details,
+        )
+        order._defer_confirmation = True
+        order.save(force_insert=True)
+        OrderItem.objects.bulk_create(
+            [
+                OrderItem(
+                    order=order,
+                    product=line["product"],
+                    price=line["price"],
+                    quantity=line["quantity"],
+                )
+                for line in lines
+            ]
+        )
+        record_sales_on_commit(
+            [(line["product"].id, line["quantity"], line["price"]) for line in lines],
+            timezone.localdate(order.created_at),
+        )
+
+        # Keep the request's product snapshot in step with the new stock
+        for product_id, level in stock.stock_levels(quantities).items():
+            products[product_id].stock = level
+        old_stock = {pid: products[pid].stock + qty for pid, qty in quantities.items()}
+
+        if holder:
+            reservations.release(holder, quantities)
+        stock.sync_totals_on_commit(sharded)
+        bump_catalog_version()
+        send_order_confirmation_on_commit(order)
+        transaction.on_commit(
+            lambda: stock_changed.send(
+                sender=Order,
+                candies=list(products.values()),
+                old_stock=old_stock,
+                order=order,
+            )
+        )
+    return order
@@ -0,0 +1,116 @@
+"""
+Keyset (cursor) pagination helpers
+"""
+
+import base64
+import binascii
+import datetime
+import json
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class KeysetPage:
+    """One page of results plus the cursor that continues after it"""
+
+    def __init__(self, object_list, next_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def encode_cursor(values):
+    """Pack the ordering values of the last row into an opaque URL-safe token"""
+    payload = []
+    for value in values:
+        if isinstance(value, (Decimal, datetime.datetime, datetime.date)):
+            value = str(value) if isinstance(value, Decimal) else value.isoformat()
+        payload.append(value)
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor, fields):
+    """
+    Unpack a cursor produced by encode_cursor, converting each value with the
+    matching ordering field's `to_python`.
+    Returns None for a missing, malformed or tampered cursor so callers fall
+    back to page one.
+    """
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, ValueError):
+        return None
+    if not isinstance(values, list) or len(values) != len(fields):
+        return None
+    try:
+        values = [field.to_python(value) for field, value in zip(fields, values)]
+    except (ValidationError, ValueError, TypeError):
+        return None
+    if any(value is None for value in values):
+        return None
+    return values
+
+
+def ordering_fields(queryset, ordering):
+    """The model field or annotation output field behind each ordering name"""
+    fields = []
+    for field in ordering:
+        name = field.lstrip("-")
+        annotation = queryset.query.annotations.get(name)
+        if annotation is not None:
+            fields.append(annotation.output_field)
+        else:
+            fields.append(queryset.model._meta.get_field(name))
+    return fields
+
+
+def keyset_filter(ordering, values):
+    """
+    Build the "comes after" condition for a row with the given ordering values.
+    For ("name", "id") this is: name > v0 OR (name = v0 AND id > v1).
+    """
+    condition = Q()
+    equal = Q()
+    for field, value in zip(ordering, values):
+        name = field.lstrip("-")
+        lookup = "lt" if field.startswith("-") else "gt"
+        condition |= equal & Q(**{f"{name}__{lookup}": value})
+        equal &= Q(**{name: value})
+    return condition
+
+
+def paginate(queryset, ordering, cursor=None, per_page=24):
+    """
+    Return a KeysetPage of `queryset` ordered by `ordering`.
+    The last ordering field must be unique (normally the primary key) so the
+    cursor identifies exactly one position.
+    """
+    queryset = queryset.order_by(*ordering)
+    values = decode_cursor(cursor, ordering_fields(queryset, ordering))
+    if values is not None:
+        queryset = queryset.filter(keyset_filter(ordering, values))
+
+    rows = list(queryset[: per_page + 1])
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        next_cursor = encode_cursor(
+            [getattr(last, field.lstrip("-")) for field in ordering]
+        )
+    return KeysetPage(rows, next_cursor)
@@ -0,0 +1,149 @@
+"""
+Best-seller rankings materialized from order sales.
+
+Placing or cancelling an order adjusts the per-day DailySales bucket and every
+SalesRanking window that day falls in, so reads never aggregate OrderItem.
+The counters are shared by every order for a product, so they are adjusted
+after the order commits rather than locked inside its transaction.
+Windows roll forward when `manage.py rebuild_sales_rankings` runs (daily).
+"""
+
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import DailySales, Order, OrderItem, SalesRanking
+from .versions import CATALOG, get_version
+
+WINDOWS = (SalesRanking.WINDOW_WEEK, SalesRanking.WINDOW_MONTH)
+DEFAULT_WINDOW = SalesRanking.WINDOW_MONTH
+
+
+def _increment(model, keys, units, revenue):
+    """UPDATE the counter row for `keys`, creating it on first sale"""
+    changes = {"units": F("units") + units, "revenue": F("revenue") + revenue}
+    if model.objects.filter(**keys).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**keys, units=units, revenue=revenue)
+    except IntegrityError:
+        # Another order created the row first
+        model.objects.filter(**keys).update(**changes)
+
+
+def record_sales(lines, day, sign=1):
+    """
+    Add (sign=1) or remove (sign=-1) sold lines from the sales tables.
+    `lines` yields (product_id, quantity, unit_price) tuples.
+    """
+    totals = defaultdict(lambda: [0, Decimal("0")])
+    for product_id, quantity, price in lines:
+        totals[product_id][0] += quantity
+        totals[product_id][1] += Decimal(price) * quantity
+
+    today = timezone.localdate()
+    windows = [window for window in WINDOWS if (today - day).days < window]
+    with transaction.atomic():
+        for product_id, (units, revenue) in totals.items():
+            units, revenue = units * sign, revenue * sign
+            _increment(DailySales, {"candy_id": product_id, "day": day}, units, revenue)
+            for window in windows:
+                _increment(
+                    SalesRanking,
+                    {"candy_id": product_id, "window_days": window},
+                    units,
+                    revenue,
+                )
+
+
+def record_order_sales(order, sign=1):
+    """record_sales() for every line of `order`"""
+    lines = order.items.values_list("product_id", "quantity", "price")
+    record_sales(lines, timezone.localdate(order.created_at), sign)
+
+
+def record_sales_on_commit(lines, day, sign=1):
+    """record_sales() once the current transaction commits"""
+    lines = list(lines)
+    transaction.on_commit(lambda: record_sales(lines, day, sign))
+
+
+def rebuild_daily_sales():
+    """Recompute every DailySales bucket from non-cancelled orders"""
+    buckets = defaultdict(lambda: [0, Decimal("0")])
+    items = (
+        OrderItem.objects.exclude(order__status=Order.STATUS_CANCELLED)
+        .values_list("product_id", "order__created_at", "quantity", "price")
+        .iterator()
+    )
+    for product_id, created_at, quantity, price in items:
+        bucket = buckets[(product_id, timezone.localdate(created_at))]
+        bucket[0] += quantity
+        bucket[1] += price * quantity
+
+    with transaction.atomic():
+        DailySales.objects.all().delete()
+        DailySales.objects.bulk_create(
+            [
+                DailySales(candy_id=product_id, day=day, units=units, revenue=revenue)
+                for (product_id, day), (units, revenue) in buckets.items()
+            ],
+            batch_size=1000,
+        )
+    return len(buckets)
+
+
+def rebuild_rankings():
+    """Recompute every SalesRanking window from DailySales"""
+    today = timezone.localdate()
+    rows = []
+    for window in WINDOWS:
+        since = today - datetime.timedelta(days=window - 1)
+        totals = (
+            DailySales.objects.filter(day__gte=since)
+            .values("candy")
+            .annotate(total_units=Sum("units"), total_revenue=Sum("revenue"))
+            .filter(total_units__gt=0)
+        )
+        rows.extend(
+            SalesRanking(
+                candy_id=row["candy"],
+                window_days=window,
+                units=row["total_units"],
+                revenue=row["total_revenue"],
+            )
+            for row in totals
+        )
+
+    with transaction.atomic():
+        SalesRanking.objects.all().delete()
+        SalesRanking.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def best_sellers(limit=4, window=DEFAULT_WINDOW):
+    """Top candies by units sold in `window`, read straight from the ranking index"""
+    rankings = (
+        SalesRanking.objects.filter(window_days=window, units__gt=0)
+        .select_related("candy")
+        .order_by("-units", "-candy")[:limit]
+    )
+    return [ranking.candy for ranking in rankings]
+
+
+def cached_best_sellers(limit=4):
+    """best_sellers() behind the catalog cache; orders move the catalog stamp"""
+    cache = caches[settings.CATALOG_CACHE_ALIAS]
+    key = f"catalog:best_sellers:{get_version(CATALOG)}:{limit}"
+    candies = cache.get(key)
+    if candies is None:
+        candies = best_sellers(limit)
+        cache.set(key, candies, settings.CATALOG_CACHE_TIMEOUT)
+    return candies
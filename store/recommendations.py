@@ -0,0 +1,41 @@
+"""
+"Customers also bought" recommendations.
+
+`manage.py build_recommendations` computes the co-purchase neighbours offline
+and stores them in CandyRecommendation; pages only read that table.
+"""
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import CandyRecommendation
+from .versions import CATALOG, RECOMMENDATIONS, get_version
+
+DEFAULT_LIMIT = 4
+
+
+def recommendations_for(candy_id, limit=DEFAULT_LIMIT):
+    """Recommended candies for `candy_id`, best first"""
+    rows = (
+        CandyRecommendation.objects.filter(candy_id=candy_id)
+        .select_related("recommended")
+        .order_by("rank")[:limit]
+    )
+    return [row.recommended for row in rows]
+
+
+def cached_recommendations(candy_id, limit=DEFAULT_LIMIT):
+    """
+    recommendations_for() behind the catalog cache. Keyed by both stamps:
+    a rebuild changes the neighbours, a catalog edit their names and prices.
+    """
+    cache = caches[settings.CATALOG_CACHE_ALIAS]
+    key = (
+        f"recommendations:{get_version(RECOMMENDATIONS)}:{get_version(CATALOG)}"
+        f":{candy_id}:{limit}"
+    )
+    candies = cache.get(key)
+    if candies is None:
+        candies = recommendations_for(candy_id, limit)
+        cache.set(key, candies, settings.CATALOG_CACHE_TIMEOUT)
+    return candies
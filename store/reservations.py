@@ -0,0 +1,140 @@
+"""
+Optional time-limited stock holds for carts.
+
+With settings.STOCK_RESERVATIONS on, putting a candy in the cart holds that
+quantity for STOCK_RESERVATION_TTL seconds, so a drop sells out at
+add-to-cart time instead of at the last checkout step. Available-to-sell is
+stock minus other carts' unexpired holds, and checkout turns the cart's own
+holds into order lines. Expired holds simply stop counting;
+`manage.py release_reservations` deletes them in bulk.
+"""
+
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Candy, StockReservation
+from .stock import current_stock
+from .versions import bump_version, stock_scope
+
+
+def enabled():
+    return settings.STOCK_RESERVATIONS
+
+
+def active(now=None):
+    """Holds that haven't expired"""
+    return StockReservation.objects.filter(expires_at__gt=now or timezone.now())
+
+
+def held_by_others(holder=None, now=None):
+    """
+    Expression for the units of the outer Candy held by carts other than
+    `holder` (all carts when holder is None)
+    """
+    held = active(now).filter(candy=OuterRef("pk"))
+    if holder:
+        held = held.exclude(holder=holder)
+    total = held.order_by().values("candy").annotate(total=Sum("quantity"))
+    return Coalesce(
+        Subquery(total.values("total"), output_field=IntegerField()), Value(0)
+    )
+
+
+def with_available(queryset, holder=None):
+    """Annotate `available`: stock minus other carts' active holds"""
+    return queryset.annotate(available=current_stock() - held_by_others(holder))
+
+
+def available_to_sell(candy, holder=None):
+    available = (
+        with_available(Candy.objects.filter(pk=candy.pk), holder)
+        .values_list("available", flat=True)
+        .first()
+    )
+    return max(available or 0, 0)
+
+
+def _bump_stock_scopes(candy_ids):
+    candy_ids = list(candy_ids)
+    transaction.on_commit(lambda: [bump_version(stock_scope(pid)) for pid in candy_ids])
+
+
+def hold(holder, quantities):
+    """
+    Set `holder`'s holds to {candy_id: quantity} (0 releases a hold), as far
+    as available stock allows, and restart their TTL.
+    Returns {candy_id: quantity actually held}.
+    """
+    now = timezone.now()
+    expires_at = now + datetime.timedelta(seconds=settings.STOCK_RESERVATION_TTL)
+    wanted = {pid: qty for pid, qty in quantities.items() if qty > 0}
+    held = {pid: 0 for pid, qty in quantities.items() if qty <= 0}
+
+    with transaction.atomic():
+        if held:
+            StockReservation.objects.filter(holder=holder, candy_id__in=held).delete()
+        if wanted:
+            # Lock the rows so two carts can't both hold the last units
+            stock = dict(
+                Candy.objects.select_for_update()
+                .filter(pk__in=wanted)
+                .order_by("pk")
+                .annotate(current=current_stock())
+                .values_list("id", "current")
+            )
+            others = dict(
+                active(now)
+                .filter(candy_id__in=wanted)
+                .exclude(holder=holder)
+                .order_by()
+                .values("candy")
+                .annotate(total=Sum("quantity"))
+                .values_list("candy", "total")
+            )
+            for pid, qty in wanted.items():
+                held[pid] = max(min(qty, stock.get(pid, 0) - others.get(pid, 0)), 0)
+
+            StockReservation.objects.filter(
+                holder=holder, candy_id__in=[p for p, q in held.items() if not q]
+            ).delete()
+            StockReservation.objects.bulk_create(
+                [
+                    StockReservation(
+                        holder=holder, candy_id=pid, quantity=qty, expires_at=expires_at
+                    )
+                    for pid, qty in held.items()
+                    if qty
+                ],
+                update_conflicts=True,
+                unique_fields=["holder", "candy"],
+                update_fields=["quantity", "expires_at"],
+            )
+        _bump_stock_scopes(quantities)
+    return held
+
+
+def release(holder, candy_ids=None):
+    """Drop `holder`'s holds (all of them, or just `candy_ids`)"""
+    holds = StockReservation.objects.filter(holder=holder)
+    if candy_ids is not None:
+        holds = holds.filter(candy_id__in=candy_ids)
+    released = list(holds.values_list("candy_id", flat=True))
+    if released:
+        holds.delete()
+        _bump_stock_scopes(released)
+    return len(released)
+
+
+def release_expired(now=None):
+    """Delete every expired hold in bulk; returns how many were removed"""
+    expired = StockReservation.objects.filter(expires_at__lte=now or timezone.now())
+    candy_ids = set(expired.values_list("candy_id", flat=True))
+    count, _ = expired.delete()
+    if candy_ids:
+        _bump_stock_scopes(candy_ids)
+    return count
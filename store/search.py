@@ -0,0 +1,147 @@
+"""
+Full-text product search over Candy name, description and category.
+
+Postgres: a generated, weighted `search_vector` tsvector column with a GIN index.
+SQLite: an FTS5 table keyed by candy id, kept in sync from Candy signals.
+Other databases fall back to a plain icontains scan.
+"""
+
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Candy
+
+FTS_TABLE = "store_candy_fts"
+
+# Name matches outrank category matches, which outrank description matches
+SQLITE_BM25_WEIGHTS = (10.0, 1.0, 5.0)  # name, description, category
+
+MAX_TERMS = 8
+
+_fts_available = None
+
+
+class SearchPage:
+    """One page of ranked search results"""
+
+    def __init__(self, candies, number, has_next):
+        self.object_list = candies
+        self.number = number
+        self.has_next = has_next
+
+    @property
+    def has_previous(self):
+        return self.number > 1
+
+    @property
+    def next_page_number(self):
+        return self.number + 1
+
+    @property
+    def previous_page_number(self):
+        return self.number - 1
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def search_terms(query):
+    """Split free text into lowercase word tokens safe to splice into a text query"""
+    return re.findall(r"\w+", query.lower())[:MAX_TERMS]
+
+
+def sqlite_fts_available():
+    """Whether the FTS5 table exists (SQLite builds without FTS5 skip creating it)"""
+    global _fts_available
+    if _fts_available is None:
+        _fts_available = FTS_TABLE in connection.introspection.table_names()
+    return _fts_available
+
+
+def _postgres_ids(terms, limit, offset):
+    tsquery = " & ".join(f"{term}:*" for term in terms)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.id FROM store_candy c, to_tsquery('english', %s) q "
+            "WHERE c.search_vector @@ q "
+            "ORDER BY ts_rank_cd(c.search_vector, q) DESC, c.id "
+            "LIMIT %s OFFSET %s",
+            [tsquery, limit, offset],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _sqlite_ids(terms, limit, offset):
+    match = " AND ".join(f'"{term}"*' for term in terms)
+    weights = ", ".join(str(weight) for weight in SQLITE_BM25_WEIGHTS)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+            f"ORDER BY bm25({FTS_TABLE}, {weights}), rowid "
+            "LIMIT %s OFFSET %s",
+            [match, limit, offset],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _fallback_ids(terms, limit, offset):
+    queryset = Candy.objects.all()
+    for term in terms:
+        queryset = queryset.filter(
+            Q(name__icontains=term)
+            | Q(category__icontains=term)
+            | Q(description__icontains=term)
+        )
+    return list(
+        queryset.order_by("name", "id").values_list("id", flat=True)[
+            offset : offset + limit
+        ]
+    )
+
+
+def ranked_ids(query, limit, offset=0):
+    """Return candy ids matching `query`, best match first"""
+    terms = search_terms(query)
+    if not terms:
+        return []
+    if connection.vendor == "postgresql":
+        return _postgres_ids(terms, limit, offset)
+    if connection.vendor == "sqlite" and sqlite_fts_available():
+        return _sqlite_ids(terms, limit, offset)
+    return _fallback_ids(terms, limit, offset)
+
+
+def search_candies(query, page=1, per_page=24):
+    """Return a SearchPage of candies for `query`"""
+    page = max(page, 1)
+    ids = ranked_ids(query, per_page + 1, (page - 1) * per_page)
+    has_next = len(ids) > per_page
+    ids = ids[:per_page]
+    candies = Candy.objects.in_bulk(ids)
+    return SearchPage([candies[pk] for pk in ids if pk in candies], page, has_next)
+
+
+def index_candy(candy):
+    """Write one candy into the SQLite FTS table (Postgres keeps itself in sync)"""
+    if connection.vendor != "sqlite" or not sqlite_fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [candy.pk])
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, name, description, category) "
+            "VALUES (%s, %s, %s, %s)",
+            [candy.pk, candy.name, candy.description, candy.category],
+        )
+
+
+def unindex_candy(candy_id):
+    """Drop one candy from the SQLite FTS table"""
+    if connection.vendor != "sqlite" or not sqlite_fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [candy_id])
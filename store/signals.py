@@ -2,13 +2,22 @@
 Store signals for automatic watchlist management and email alerts
 """
 
-from django.db.models.signals import post_save, pre_save
-from django.dispatch import receiver
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.db import transaction
+from django.db.models import F
+from django.dispatch import Signal, receiver
 from django.core.mail import send_mail
 from django.conf import settings
 from django.utils import timezone
 from datetime import timedelta
-from .models import OrderItem, ProductWatchlist, Candy, Order
+from .models import OrderItem, ProductWatchlist, Candy, Order, Review, rating_average
+from . import images, search, stock, typeahead
+from .versions import CATALOG, ORDERS, bump_version, order_scope, reviews_scope
+
+# Sent after commit when stock changes without a Candy.save() (e.g. an order
+# taking stock with conditional UPDATEs). Arguments: `candies` (with their new
+# stock) and `old_stock` ({candy id: previous stock}).
+stock_changed = Signal()
 
 
 @receiver(pre_save, sender=Order)
@@ -35,9 +44,10 @@ def send_order_status_emails(sender, instance, created, **kwargs):
     if not instance.user or not instance.user.email:
         return
 
-    # 1. Order Confirmation (Created)
+    # 1. Order Confirmation (Created); place_order sends it after commit
     if created:
-        send_order_confirmation_email(instance)
+        if not getattr(instance, "_defer_confirmation", False):
+            send_order_confirmation_email(instance)
         return
 
     # Check for status changes
@@ -58,6 +68,24 @@ def send_order_status_emails(sender, instance, created, **kwargs):
             send_cancellation_email(instance)
 
 
+def status_emails(moved):
+    """
+    (send function, order) pairs for the orders Order.objects.advance_statuses()
+    moved; orders that changed again since (e.g. were cancelled) are skipped
+    """
+    senders = {
+        Order.STATUS_SHIPPED: send_shipping_email,
+        Order.STATUS_DELIVERED: send_delivery_email,
+    }
+    jobs = []
+    for status, send in senders.items():
+        orders = Order.objects.filter(
+            pk__in=moved.get(status, []), status=status, user__email__gt=""
+        ).select_related("user")
+        jobs.extend((send, order) for order in orders)
+    return jobs
+
+
 def send_order_confirmation_email(order):
     """Send order confirmation email"""
     subject = f"Order Confirmation #{order.id}"
@@ -85,6 +113,15 @@ Visit Keanu's Candy Store: http://localhost:8000/orders/{order.id}/
         print(f"Failed to send confirmation email: {e}")
 
 
+def send_order_confirmation_on_commit(order):
+    """
+    Confirm `order` once its transaction commits, so a rolled-back order is
+    never announced and the email doesn't go out while stock rows are locked
+    """
+    if order.user and order.user.email:
+        transaction.on_commit(lambda: send_order_confirmation_email(order))
+
+
 def send_shipping_email(order):
     """Send shipping notification email"""
     subject = f"Order #{order.id} Shipped!"
@@ -197,13 +234,27 @@ def send_delivery_email(order):
 def check_and_send_low_stock_alerts(sender, instance, created, **kwargs):
     """
     Automatically send low stock alerts when product stock is updated.
-    Checks:
-    1. Users who have PURCHASED this product (Default threshold).
-    2. Users who are WATCHING this product (Custom threshold).
     """
     if created:
         return
+    send_low_stock_alerts(instance)
+
 
+@receiver(stock_changed)
+def send_alerts_for_stock_change(sender, candies, old_stock, **kwargs):
+    """Low stock and restock alerts for stock changed in bulk (once per order)"""
+    for candy in candies:
+        send_low_stock_alerts(candy)
+        send_restock_alerts(candy, old_stock.get(candy.pk))
+
+
+def send_low_stock_alerts(instance):
+    """
+    Send low stock alerts for one product.
+    Checks:
+    1. Users who have PURCHASED this product (Default threshold).
+    2. Users who are WATCHING this product (Custom threshold).
+    """
     from django.contrib.auth import get_user_model
     from .models import ProductWatchlist
 
@@ -342,10 +393,26 @@ def track_candy_stock_change(sender, instance, **kwargs):
         try:
             old_candy = Candy.objects.get(pk=instance.pk)
             instance._old_stock = old_candy.stock
+            instance._old_stock_slots = old_candy.stock_slots
         except Candy.DoesNotExist:
             instance._old_stock = None
+            instance._old_stock_slots = 0
     else:
         instance._old_stock = None
+        instance._old_stock_slots = 0
+
+
+@receiver(post_save, sender=Candy)
+def spread_sharded_stock(sender, instance, **kwargs):
+    """Keep a sharded product's stock slots in step with a saved total"""
+    old_slots = getattr(instance, "_old_stock_slots", 0)
+    if not (instance.stock_slots or old_slots):
+        return
+    if (
+        instance.stock != getattr(instance, "_old_stock", None)
+        or instance.stock_slots != old_slots
+    ):
+        stock.spread(instance)
 
 
 @receiver(post_save, sender=Candy)
@@ -357,10 +424,11 @@ def check_and_send_restock_alerts(sender, instance, created, **kwargs):
     """
     if created:
         return
+    send_restock_alerts(instance, getattr(instance, "_old_stock", None))
 
-    # Check previous stock
-    old_stock = getattr(instance, "_old_stock", None)
 
+def send_restock_alerts(instance, old_stock):
+    """Email restock subscribers if `instance` went from no stock to some"""
     # Only fire if it was OOS and now has stock
     if old_stock is not None and old_stock <= 0 and instance.stock > 0:
         from django.contrib.auth import get_user_model
@@ -402,3 +470,135 @@ To unsubscribe from restock alerts, visit your account page.
         )
     except Exception as e:
         print(f"Failed to send email to {user.email}: {e}")
+
+
+SEARCH_FIELDS = {"name", "description", "category"}
+
+
+@receiver(post_save, sender=Candy)
+def update_candy_search_index(sender, instance, update_fields=None, **kwargs):
+    """
+    Keep the full-text index in sync with the product text.
+    Saves that only touch non-text columns (e.g. stock) are skipped.
+    """
+    if update_fields is not None and not SEARCH_FIELDS & set(update_fields):
+        return
+    search.index_candy(instance)
+
+
+@receiver(post_delete, sender=Candy)
+def remove_candy_from_search_index(sender, instance, **kwargs):
+    """Drop deleted products from the full-text index"""
+    search.unindex_candy(instance.pk)
+
+
+IMAGE_FIELDS = {"image", "image_url"}
+
+
+@receiver(post_save, sender=Candy)
+def refresh_candy_thumbnails(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Rebuild the WebP thumbnails when the upload or image_url changes. The
+    fetch and resize run after commit, so they never hold the save's
+    transaction open.
+    """
+    if update_fields is not None and not IMAGE_FIELDS & set(update_fields):
+        return
+    source = (instance.image.name or "", instance.image_url)
+    if created and not any(source):
+        return
+    if not created and source == getattr(instance, "_loaded_image_source", None):
+        return
+    instance._loaded_image_source = source
+
+    def rebuild():
+        try:
+            images.refresh_candy_image(instance)
+        except images.IMAGE_ERRORS as e:
+            # Pages fall back to the original until `build_candy_images` runs
+            print(f"Failed to build thumbnails for {instance.name}: {e}")
+            return
+        bump_catalog_version()
+
+    transaction.on_commit(rebuild)
+
+
+def bump_catalog_version():
+    """Invalidate catalog-derived data (typeahead index, cached pages) after commit"""
+
+    def bump():
+        bump_version(CATALOG)
+        typeahead.invalidate()
+
+    transaction.on_commit(bump)
+
+
+@receiver(post_save, sender=Candy)
+@receiver(post_delete, sender=Candy)
+def candy_catalog_changed(sender, instance, **kwargs):
+    """Any product save or delete moves the catalog version stamp"""
+    bump_catalog_version()
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def candy_reviews_changed(sender, instance, **kwargs):
+    """Move the product page's review stamp so cached copies revalidate"""
+    candy_id = instance.candy_id
+    transaction.on_commit(lambda: bump_version(reviews_scope(candy_id)))
+
+
+def _adjust_rating_aggregates(candy_id, count_delta, sum_delta):
+    """Apply a review change to Candy's denormalized aggregates in one UPDATE"""
+    count = F("review_count") + count_delta
+    total = F("rating_sum") + sum_delta
+    Candy.objects.filter(pk=candy_id).update(
+        review_count=count,
+        rating_sum=total,
+        rating_avg=rating_average(count, total),
+    )
+    # A queryset update sends no Candy signals, so move the stamp here
+    bump_catalog_version()
+
+
+@receiver(post_save, sender=Review)
+def update_rating_aggregates_on_save(sender, instance, created, **kwargs):
+    """Count a new review, or shift the rating sum by an edit's difference"""
+    if created:
+        _adjust_rating_aggregates(instance.candy_id, 1, instance.rating)
+    else:
+        old_rating = getattr(instance, "_loaded_rating", None)
+        if old_rating is None:
+            # Saved from an instance that wasn't loaded from the database
+            old_rating = instance.rating
+        if old_rating != instance.rating:
+            _adjust_rating_aggregates(
+                instance.candy_id, 0, instance.rating - old_rating
+            )
+    instance._loaded_rating = instance.rating
+
+
+@receiver(post_delete, sender=Review)
+def update_rating_aggregates_on_delete(sender, instance, **kwargs):
+    """Remove a deleted review from the aggregates"""
+    rating = getattr(instance, "_loaded_rating", None) or instance.rating
+    _adjust_rating_aggregates(instance.candy_id, -1, -rating)
+
+
+def bump_order_versions(order_ids):
+    """Tell live status streams (store.live) that these orders changed, after commit"""
+    order_ids = list(order_ids)
+
+    def bump():
+        for order_id in order_ids:
+            bump_version(order_scope(order_id))
+        bump_version(ORDERS)
+
+    if order_ids:
+        transaction.on_commit(bump)
+
+
+@receiver(post_save, sender=Order)
+def order_status_changed(sender, instance, created, **kwargs):
+    if not created and instance.status != getattr(instance, "_old_status", None):
+        bump_order_versions([instance.pk])
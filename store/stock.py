@@ -0,0 +1,154 @@
+"""
+Sharded stock counters for hot products.
+
+Every order for a product decrements its `store_candy` row, so during a flash
+sale all checkouts for a best-seller queue on that one row lock. A product
+with `stock_slots = N` keeps its stock in N StockShard rows instead: an order
+decrements one random slot and only falls back to the others when that slot
+runs short, so concurrent orders mostly lock different rows and contention
+falls roughly by N.
+
+`Candy.stock` stays the product's total for templates, filters and admin.
+Orders don't write it: after commit it is refreshed from the slots at most
+once per STOCK_SYNC_INTERVAL per product, and the order worker's periodic
+sweep catches the orders in between, so the hot row is written a few times a
+minute rather than once per order. Checkout always reads the live slots.
+Saving a new total (admin, inventory) spreads it back over the slots.
+"""
+
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+from .models import Candy, StockShard
+
+SYNC_KEY = "stock:synced:{}"
+
+
+def _slot_total():
+    shards = (
+        StockShard.objects.filter(candy=OuterRef("pk"))
+        .order_by()
+        .values("candy")
+        .annotate(total=Sum("stock"))
+        .values("total")
+    )
+    return Coalesce(Subquery(shards), Value(0))
+
+
+def current_stock():
+    """Expression for the outer Candy's live stock: its slots' sum when sharded"""
+    return Case(When(stock_slots=0, then=F("stock")), default=_slot_total())
+
+
+def stock_levels(candy_ids):
+    """{candy_id: live stock} in one query, sharded or not"""
+    return dict(
+        Candy.objects.filter(pk__in=candy_ids)
+        .order_by()
+        .annotate(current=current_stock())
+        .values_list("id", "current")
+    )
+
+
+def take(candy, quantity):
+    """
+    Take `quantity` from a sharded product's slots; False (and nothing taken)
+    if they don't hold that much together. Must run inside a transaction.
+    """
+    slots = list(range(candy.stock_slots))
+    start = random.randrange(len(slots))
+    for slot in slots[start:] + slots[:start]:
+        taken = StockShard.objects.filter(
+            candy=candy, slot=slot, stock__gte=quantity
+        ).update(stock=F("stock") - quantity)
+        if taken:
+            return True
+
+    # No single slot has enough: lock them all (in slot order) and take across
+    shards = list(
+        StockShard.objects.select_for_update().filter(candy=candy).order_by("slot")
+    )
+    if sum(shard.stock for shard in shards) < quantity:
+        return False
+    remaining = quantity
+    for shard in shards:
+        part = min(shard.stock, remaining)
+        if part:
+            StockShard.objects.filter(pk=shard.pk).update(stock=F("stock") - part)
+            remaining -= part
+        if not remaining:
+            break
+    return True
+
+
+def sync_totals(candy_ids=None):
+    """
+    Write the slots' sum back to `Candy.stock` for the sharded products
+    (all of them by default), touching only rows whose total moved. Cached
+    catalog pages are invalidated whenever one did.
+    """
+    from .signals import bump_catalog_version
+
+    candies = Candy.objects.filter(stock_slots__gt=0)
+    if candy_ids is not None:
+        candies = candies.filter(pk__in=candy_ids)
+    synced = candies.exclude(stock=_slot_total()).update(stock=_slot_total())
+    if synced:
+        bump_catalog_version()
+    return synced
+
+
+def sync_totals_on_commit(candy_ids):
+    """
+    After commit, sync the products that weren't synced in the last
+    STOCK_SYNC_INTERVAL seconds; the rest wait for the next order or sweep
+    """
+
+    def throttled_sync():
+        due = [
+            candy_id
+            for candy_id in candy_ids
+            if cache.add(SYNC_KEY.format(candy_id), 1, settings.STOCK_SYNC_INTERVAL)
+        ]
+        if due:
+            sync_totals(due)
+
+    candy_ids = list(candy_ids)
+    if candy_ids:
+        transaction.on_commit(throttled_sync)
+
+
+def restore(candy, quantity):
+    """
+    Put `quantity` back into one slot of a sharded product. The caller
+    refreshes the total and sends stock alerts, as for an order.
+    """
+    StockShard.objects.filter(
+        candy=candy, slot=random.randrange(candy.stock_slots)
+    ).update(stock=F("stock") + quantity)
+
+
+def spread(candy):
+    """
+    Split `candy.stock` evenly over its `stock_slots` slots, dropping any
+    slots beyond that (all of them when sharding is switched off)
+    """
+    with transaction.atomic():
+        StockShard.objects.filter(candy=candy, slot__gte=candy.stock_slots).delete()
+        if not candy.stock_slots:
+            return
+        base, extra = divmod(max(candy.stock, 0), candy.stock_slots)
+        StockShard.objects.bulk_create(
+            [
+                StockShard(candy=candy, slot=slot, stock=base + (slot < extra))
+                for slot in range(candy.stock_slots)
+            ],
+            update_conflicts=True,
+            unique_fields=["candy", "slot"],
+            update_fields=["stock"],
+        )
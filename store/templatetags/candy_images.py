@@ -0,0 +1,40 @@
+"""
+{% candy_image %}: responsive product image markup from the WebP renditions
+"""
+
+from django import template
+from django.templatetags.static import static
+
+from ..images import LEGACY_IMAGES, PLACEHOLDER_IMAGE, rendition_url, srcset
+
+register = template.Library()
+
+# Width used for `src` by browsers that ignore `srcset`
+DEFAULT_WIDTH = 320
+
+
+@register.inclusion_tag("store/candy_image.html")
+def candy_image(candy, sizes="100vw", css_class="candy-image", style=""):
+    """
+    <img> for `candy` with a srcset over its thumbnails and lazy loading.
+    Candies without thumbnails yet fall back to their URL or bundled static
+    image, and an upload that couldn't be converted to a placeholder (MEDIA_URL
+    is only served in development); candies with no image at all render nothing.
+    """
+    context = {"candy": candy, "css_class": css_class, "style": style}
+    renditions = candy.image_renditions
+    if renditions:
+        widths = sorted(int(width) for width in renditions)
+        src_width = next((w for w in widths if w >= DEFAULT_WIDTH), widths[-1])
+        context.update(
+            src=rendition_url(renditions[str(src_width)]),
+            srcset=srcset(renditions),
+            sizes=sizes,
+        )
+    elif candy.image_url:
+        context["src"] = candy.image_url
+    elif candy.name in LEGACY_IMAGES:
+        context["src"] = static(LEGACY_IMAGES[candy.name])
+    elif candy.image:
+        context["src"] = static(PLACEHOLDER_IMAGE)
+    return context
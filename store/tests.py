@@ -1,11 +1,78 @@
-from django.test import TestCase, RequestFactory
+import asyncio
+import datetime
+import json
+import re
+import shutil
+import tempfile
+import time
+from io import BytesIO, StringIO
+from unittest import mock
+
+from PIL import Image
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
 from django.contrib.sessions.middleware import SessionMiddleware
-from django.contrib.auth.models import User, AnonymousUser
-from .models import Candy, Order
-from .views import order_create
+from django.contrib.sessions.models import Session
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from candystore.middleware import ImmutableThumbnailMiddleware
+
+from . import live, typeahead
+from .admission import (
+    ADMITTED_KEY,
+    SUBMISSION_KEY,
+    _claim_slot,
+    _free_slot,
+    position,
+    read_ticket,
+)
 from .cart import Cart
+from .cart_storage import check_storage, decode, encode
+from .catalog import CatalogFilters, catalog_page
+from .context_processors import cart as cart_context
+from .forms import CheckoutForm
+from .images import MAX_FETCH_BYTES, source_bytes, thumbnail_storage
+from .management.commands.run_order_scheduler import pop_due, upcoming_transitions
+from .models import (
+    Candy,
+    DailySales,
+    Favorite,
+    Order,
+    OrderItem,
+    Review,
+    SalesRanking,
+    StockReservation,
+)
+from .orders import OutOfStock, place_order
+from .pagination import encode_cursor
+from .rankings import best_sellers, record_order_sales
+from .recommendations import recommendations_for
+from .reservations import available_to_sell
+from .signals import stock_changed
+from .versions import CATALOG, ORDERS, bump_version, get_version, order_scope
+from .views import order_create
+
+# Render {% static %} without the manifest that collectstatic would build
+plain_static = override_settings(
+    STORAGES={
+        **settings.STORAGES,
+        "staticfiles": {
+            "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"
+        },
+    }
+)
 
 
+@plain_static
 class OrderCreationTest(TestCase):
     def setUp(self):
         self.candy = Candy.objects.create(
@@ -66,6 +133,7 @@ class OrderCreationTest(TestCase):
         self.assertIn("/accounts/login/", response.url)
 
 
+@plain_static
 class FavoriteTest(TestCase):
     def setUp(self):
         self.candy = Candy.objects.create(
@@ -80,7 +148,6 @@ class FavoriteTest(TestCase):
 
     def test_toggle_favorite_add(self):
         # Initial state: no favorite
-        from .models import Favorite
 
         self.assertEqual(Favorite.objects.count(), 0)
 
@@ -99,8 +166,6 @@ class FavoriteTest(TestCase):
         self.assertEqual(Favorite.objects.count(), 0)
 
     def test_listing_favorites_account(self):
-        from .models import Favorite
-
         Favorite.objects.create(user=self.user, candy=self.candy)
 
         response = self.client.get("/accounts/account/")
@@ -109,6 +174,7 @@ class FavoriteTest(TestCase):
         self.assertContains(response, "Test Candy")
 
 
+@plain_static
 class ReviewTest(TestCase):
     def setUp(self):
         self.candy = Candy.objects.create(
@@ -122,8 +188,6 @@ class ReviewTest(TestCase):
         self.client.login(username="testuser", password="password")
 
     def test_add_review(self):
-        from .models import Review
-
         response = self.client.post(
             f"/candy/{self.candy.id}/",
             {"add_review": "true", "rating": 5, "comment": "Great candy!"},
@@ -135,8 +199,6 @@ class ReviewTest(TestCase):
         self.assertContains(response, "Great candy!")
 
     def test_edit_review(self):
-        from .models import Review
-
         review = Review.objects.create(
             user=self.user, candy=self.candy, rating=1, comment="Bad"
         )
@@ -153,8 +215,6 @@ class ReviewTest(TestCase):
         self.assertEqual(review.comment, "Changed my mind")
 
     def test_delete_review(self):
-        from .models import Review
-
         review = Review.objects.create(
             user=self.user, candy=self.candy, rating=1, comment="Bad"
         )
@@ -162,3 +222,1478 @@ class ReviewTest(TestCase):
         response = self.client.post(f"/review/delete/{review.id}/", follow=True)
         self.assertEqual(response.status_code, 200)
         self.assertEqual(Review.objects.count(), 0)
+
+
+@plain_static
+@override_settings(CATALOG_PAGE_SIZE=2)
+class CatalogPaginationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        for name, price, category in [
+            ("Apple Drops", "1.50", "Hard Candy"),
+            ("Berry Gummies", "3.00", "Gummies"),
+            ("Cocoa Bites", "2.25", "Chocolate"),
+            ("Dark Truffle", "4.75", "Chocolate"),
+            ("Eclair", "0.99", "Caramel"),
+        ]:
+            Candy.objects.create(
+                name=name,
+                price=price,
+                stock=10,
+                description=f"{name} description",
+                category=category,
+            )
+
+    def _names(self, response):
+        return [candy.name for candy in response.context["candies"]]
+
+    def test_keyset_pages_follow_name_order(self):
+        response = self.client.get("/")
+        self.assertEqual(self._names(response), ["Apple Drops", "Berry Gummies"])
+        cursor = response.context["page"].next_cursor
+        self.assertIsNotNone(cursor)
+
+        response = self.client.get("/", {"after": cursor})
+        self.assertEqual(self._names(response), ["Cocoa Bites", "Dark Truffle"])
+
+        response = self.client.get("/", {"after": response.context["page"].next_cursor})
+        self.assertEqual(self._names(response), ["Eclair"])
+        self.assertFalse(response.context["page"].has_next)
+
+    def test_filters_and_price_sort(self):
+        response = self.client.get(
+            "/", {"category": "Chocolate", "sort": "-price", "max_price": "10"}
+        )
+        self.assertEqual(self._names(response), ["Dark Truffle", "Cocoa Bites"])
+
+        response = self.client.get("/", {"min_price": "2", "sort": "price"})
+        self.assertEqual(self._names(response), ["Cocoa Bites", "Berry Gummies"])
+
+    def test_grid_does_not_load_description(self):
+        response = self.client.get("/")
+        self.assertNotContains(response, "Apple Drops description")
+        candy = response.context["candies"].object_list[0]
+        self.assertIn("description", candy.get_deferred_fields())
+
+    def test_malformed_cursor_falls_back_to_first_page(self):
+        response = self.client.get("/", {"after": "not-a-cursor!"})
+        self.assertEqual(self._names(response), ["Apple Drops", "Berry Gummies"])
+
+    def test_tampered_cursor_falls_back_to_first_page(self):
+        for values in (["Apple Drops", "x"], [1.5, 2], ["-price", [3]], [None, 1]):
+            with self.subTest(values=values):
+                response = self.client.get("/", {"after": encode_cursor(values)})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(
+                    self._names(response), ["Apple Drops", "Berry Gummies"]
+                )
+        response = self.client.get(
+            "/", {"sort": "price", "after": encode_cursor(["cheap", 1])}
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+@plain_static
+class SearchTest(TestCase):
+    def setUp(self):
+        self.bar = Candy.objects.create(
+            name="Chocolate Bar",
+            price="2.99",
+            stock=10,
+            description="Milk chocolate",
+            category="Chocolate",
+        )
+        self.caramel = Candy.objects.create(
+            name="Caramel Chew",
+            price="1.99",
+            stock=10,
+            description="Soft caramel with a chocolate coating",
+            category="Caramel",
+        )
+
+    def _names(self, query):
+        response = self.client.get("/search/", {"q": query})
+        self.assertEqual(response.status_code, 200)
+        return [candy.name for candy in response.context["results"]]
+
+    def test_name_match_ranks_above_description_match(self):
+        self.assertEqual(self._names("choc"), ["Chocolate Bar", "Caramel Chew"])
+        self.assertEqual(self._names("soft caramel"), ["Caramel Chew"])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.bar.name = "Cocoa Brick"
+        self.bar.save()
+        self.assertEqual(self._names("cocoa"), ["Cocoa Brick"])
+
+        self.bar.delete()
+        self.assertEqual(self._names("cocoa"), [])
+
+    def test_empty_query_renders_prompt(self):
+        response = self.client.get("/search/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.context["results"])
+
+
+class TypeaheadTest(TestCase):
+    def setUp(self):
+        typeahead._index = None
+        for name, category in [
+            ("Gummy Bears", "Gummies"),
+            ("Gummy Worms", "Gummies"),
+            ("Chocolate Bar", "Chocolate"),
+        ]:
+            Candy.objects.create(
+                name=name, price="1.00", stock=5, description="", category=category
+            )
+
+    def _labels(self, query):
+        response = self.client.get("/api/search/autocomplete/", {"q": query})
+        self.assertEqual(response.status_code, 200)
+        return [result["label"] for result in response.json()["results"]]
+
+    def test_prefix_and_word_matches(self):
+        self.assertEqual(self._labels("gum"), ["Gummy Bears", "Gummy Worms", "Gummies"])
+        self.assertEqual(self._labels("BEA"), ["Gummy Bears"])
+        self.assertEqual(self._labels("choc"), ["Chocolate Bar", "Chocolate"])
+        self.assertEqual(self._labels(""), [])
+
+    def test_warm_lookups_skip_the_database(self):
+        self._labels("gum")
+        with self.assertNumQueries(0):
+            self._labels("gummy w")
+
+    def test_index_rebuilds_after_catalog_change(self):
+        self.assertEqual(self._labels("lic"), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            Candy.objects.create(
+                name="Licorice", price="1.00", stock=5, description="", category="Chewy"
+            )
+        self.assertEqual(self._labels("lic"), ["Licorice"])
+
+
+@plain_static
+class CatalogFragmentCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.candy = Candy.objects.create(
+            name="Toffee", price="2.00", stock=4, description="", category="Chewy"
+        )
+
+    def _candy_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/")
+        self.assertEqual(response.status_code, 200)
+        return response, [q["sql"] for q in queries if "store_candy" in q["sql"]]
+
+    def test_unchanged_catalog_is_served_without_product_queries(self):
+        response, queries = self._candy_queries()
+        self.assertTrue(queries)
+        self.assertContains(response, "Toffee")
+
+        response, queries = self._candy_queries()
+        self.assertEqual(queries, [])
+        self.assertContains(response, "Toffee")
+        self.assertContains(response, 'name="csrfmiddlewaretoken"')
+        self.assertNotContains(response, "__catalog_csrf_token__")
+
+    def test_product_save_invalidates_the_fragment(self):
+        self._candy_queries()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.candy.stock = 0
+            self.candy.save()
+        response, queries = self._candy_queries()
+        self.assertTrue(queries)
+        self.assertContains(response, "Out of Stock")
+
+
+@plain_static
+class CachePolicyTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.candy = Candy.objects.create(
+            name="Fudge", price="2.50", stock=3, description="", category="Fudge"
+        )
+
+    def test_anonymous_catalog_revalidates_with_304(self):
+        response = self.client.get("/")
+        etag = response["ETag"]
+        self.assertEqual(response["Cache-Control"], "no-cache")
+        self.assertIn("Cookie", response["Vary"])
+        self.assertIn("Last-Modified", response)
+
+        # The first response set the CSRF cookie, which the page depends on
+        etag = self.client.get("/")["ETag"]
+        response = self.client.get("/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertTemplateNotUsed(response, "store/home.html")
+
+    def test_new_review_changes_product_etag(self):
+        url = f"/candy/{self.candy.id}/"
+        self.client.get(url)
+        etag = self.client.get(url)["ETag"]
+
+        user = User.objects.create_user(username="reviewer", password="password")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(user=user, candy=self.candy, rating=4)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    @override_settings(VERSION_STAMP_TTL=60)
+    def test_per_process_stamps_expire(self):
+        # A change saved by another process never bumps this process's
+        # stamps, so they expire and the page is rendered again
+        self.client.get("/")
+        etag = self.client.get("/")["ETag"]
+        with mock.patch("time.time", return_value=time.time() + 61):
+            response = self.client.get("/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_authenticated_pages_stay_no_store(self):
+        User.objects.create_user(username="shopper", password="password")
+        self.client.login(username="shopper", password="password")
+        response = self.client.get("/")
+        self.assertNotIn("ETag", response)
+        self.assertIn("no-store", response["Cache-Control"])
+
+
+class RatingAggregateTest(TestCase):
+    def setUp(self):
+        self.candy = Candy.objects.create(
+            name="Nougat", price="1.00", stock=5, description="", category="Chewy"
+        )
+        self.users = [
+            User.objects.create_user(username=f"rater{i}", password="password")
+            for i in range(3)
+        ]
+
+    def _aggregates(self):
+        self.candy.refresh_from_db()
+        candy = self.candy
+        return candy.review_count, candy.rating_sum, candy.rating_avg
+
+    def test_create_edit_delete_keep_aggregates_current(self):
+        first = Review.objects.create(user=self.users[0], candy=self.candy, rating=5)
+        Review.objects.create(user=self.users[1], candy=self.candy, rating=2)
+        self.assertEqual(self._aggregates(), (2, 7, 3.5))
+        self.assertEqual(self.candy.average_rating, 3.5)
+
+        review = Review.objects.get(pk=first.pk)
+        review.rating = 3
+        review.save()
+        self.assertEqual(self._aggregates(), (2, 5, 2.5))
+
+        Review.objects.get(pk=first.pk).delete()
+        self.assertEqual(self._aggregates(), (1, 2, 2.0))
+
+    def test_rebuild_command_repairs_drift(self):
+        Review.objects.create(user=self.users[0], candy=self.candy, rating=4)
+        Candy.objects.filter(pk=self.candy.pk).update(
+            review_count=9, rating_sum=1, rating_avg=0.1
+        )
+
+        call_command("rebuild_rating_aggregates", stdout=StringIO())
+        self.assertEqual(self._aggregates(), (1, 4, 4.0))
+
+    def test_top_rated_sort(self):
+        other = Candy.objects.create(
+            name="Brittle", price="1.00", stock=5, description="", category="Hard"
+        )
+        Review.objects.create(user=self.users[0], candy=self.candy, rating=3)
+        Review.objects.create(user=self.users[0], candy=other, rating=5)
+
+        page = catalog_page(CatalogFilters({"sort": "rating"}), per_page=1)
+        self.assertEqual([c.name for c in page], ["Brittle"])
+        page = catalog_page(
+            CatalogFilters({"sort": "rating", "after": page.next_cursor}), per_page=1
+        )
+        self.assertEqual([c.name for c in page], ["Nougat"])
+
+
+@plain_static
+@override_settings(REVIEWS_PAGE_SIZE=5)
+class ReviewPaginationTest(TestCase):
+    def setUp(self):
+        self.candy = Candy.objects.create(
+            name="Taffy", price="1.00", stock=5, description="", category="Chewy"
+        )
+        for i in range(7):
+            user = User.objects.create_user(username=f"fan{i}", password="password")
+            Review.objects.create(
+                user=user, candy=self.candy, rating=4, comment=f"comment {i}"
+            )
+
+    def _query_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(f"/candy/{self.candy.id}/")
+        return len(queries)
+
+    def test_detail_page_shows_newest_page_with_constant_queries(self):
+        response = self.client.get(f"/candy/{self.candy.id}/")
+        reviews = response.context["reviews"]
+        self.assertEqual(
+            [r.comment for r in reviews], [f"comment {i}" for i in range(6, 1, -1)]
+        )
+        self.assertTrue(reviews.has_next)
+
+        baseline = self._query_count()
+
+        extra = User.objects.create_user(username="late", password="password")
+        Review.objects.create(user=extra, candy=self.candy, rating=1)
+        self.assertEqual(self._query_count(), baseline)
+
+    def test_load_more_endpoint_continues_from_cursor(self):
+        cursor = (
+            self.client.get(f"/candy/{self.candy.id}/").context["reviews"].next_cursor
+        )
+        data = self.client.get(
+            f"/candy/{self.candy.id}/reviews/", {"after": cursor}
+        ).json()
+        self.assertEqual(
+            [r["comment"] for r in data["reviews"]], ["comment 1", "comment 0"]
+        )
+        self.assertEqual(data["reviews"][0]["username"], "fan1")
+        self.assertIsNone(data["next_cursor"])
+
+
+class BestSellerTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="buyer", password="password")
+        self.toffee = Candy.objects.create(
+            name="Toffee", price="2.00", stock=50, description="", category="Chewy"
+        )
+        self.fudge = Candy.objects.create(
+            name="Fudge", price="3.00", stock=50, description="", category="Chewy"
+        )
+
+    def _order(self, *lines):
+        order = Order.objects.create(user=self.user, total_price=0)
+        for candy, quantity in lines:
+            OrderItem.objects.create(
+                order=order, product=candy, price=candy.price, quantity=quantity
+            )
+        record_order_sales(order)
+        return order
+
+    def test_orders_update_rankings_and_cancel_reverts(self):
+        self._order((self.toffee, 2), (self.fudge, 1))
+        order = self._order((self.fudge, 3))
+        self.assertEqual(best_sellers(), [self.fudge, self.toffee])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order.cancel_order()
+        self.assertEqual(best_sellers(), [self.toffee, self.fudge])
+
+    def test_bestselling_sort_and_rebuild_command(self):
+        self._order((self.fudge, 4))
+        DailySales.objects.all().delete()
+        SalesRanking.objects.all().delete()
+
+        call_command("rebuild_sales_rankings", "--full", stdout=StringIO())
+        self.assertEqual(
+            SalesRanking.objects.get(
+                candy=self.fudge, window_days=SalesRanking.WINDOW_WEEK
+            ).units,
+            4,
+        )
+
+        Candy.objects.create(
+            name="Brittle", price="1.00", stock=5, description="", category="Hard"
+        )
+        # Ranked products first, then the rest by name, one page at a time
+        names, cursor = [], None
+        while True:
+            params = {"sort": "bestselling", "after": cursor} if cursor else {}
+            page = catalog_page(
+                CatalogFilters({"sort": "bestselling", **params}), per_page=1
+            )
+            names += [c.name for c in page]
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        self.assertEqual(names, ["Fudge", "Brittle", "Toffee"])
+
+        # A page can span both parts; filters apply to both
+        page = catalog_page(CatalogFilters({"sort": "bestselling"}), per_page=2)
+        self.assertEqual([c.name for c in page], ["Fudge", "Brittle"])
+        page = catalog_page(
+            CatalogFilters({"sort": "bestselling", "category": "Chewy"}), per_page=5
+        )
+        self.assertEqual([c.name for c in page], ["Fudge", "Toffee"])
+        self.assertFalse(page.has_next)
+
+
+@plain_static
+class RecommendationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user(username="shopper", password="password")
+        self.candies = {
+            name: Candy.objects.create(
+                name=name, price="1.00", stock=50, description="", category="Mix"
+            )
+            for name in ("Licorice", "Mints", "Taffy", "Brittle")
+        }
+        baskets = [
+            ("Licorice", "Mints"),
+            ("Licorice", "Mints", "Taffy"),
+            ("Licorice", "Mints"),
+            ("Taffy", "Brittle"),
+        ]
+        for basket in baskets:
+            order = Order.objects.create(user=user, total_price=0)
+            for name in basket:
+                OrderItem.objects.create(
+                    order=order, product=self.candies[name], price="1.00"
+                )
+
+    def _build(self, *args):
+        call_command("build_recommendations", *args, stdout=StringIO())
+
+    def _names(self, name):
+        return [c.name for c in recommendations_for(self.candies[name].id)]
+
+    def test_builds_ranked_neighbours(self):
+        self._build("--chunk-size", "1")
+        self.assertEqual(self._names("Licorice"), ["Mints", "Taffy"])
+        self.assertEqual(self._names("Taffy"), ["Brittle", "Licorice", "Mints"])
+
+        self._build("--top-k", "1")
+        self.assertEqual(self._names("Taffy"), ["Brittle"])
+
+    def test_detail_page_reads_precomputed_table(self):
+        self._build()
+        url = f"/candy/{self.candies['Licorice'].id}/"
+        response = self.client.get(url)
+        self.assertEqual(
+            [c.name for c in response.context["recommendations"]], ["Mints", "Taffy"]
+        )
+        self.assertContains(response, "Customers Also Bought")
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertFalse(
+            any(
+                "store_candyrecommendation" in q["sql"]
+                for q in queries.captured_queries
+            )
+        )
+
+
+class CandyImageTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        overrides = override_settings(
+            WHITENOISE_ROOT=f"{root}/public",
+            MEDIA_ROOT=f"{root}/media",
+            STORAGES={
+                "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+                "staticfiles": {
+                    "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"
+                },
+                "thumbnails": {
+                    "BACKEND": "django.core.files.storage.FileSystemStorage",
+                    "OPTIONS": {"location": f"{root}/public", "base_url": "/"},
+                },
+            },
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def _png(self, width, height):
+        buffer = BytesIO()
+        Image.new("RGB", (width, height), "pink").save(buffer, "PNG")
+        return SimpleUploadedFile("candy.png", buffer.getvalue(), "image/png")
+
+    def test_upload_builds_hashed_webp_renditions(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            candy = Candy.objects.create(
+                name="Rock Candy",
+                price="1.00",
+                stock=5,
+                description="",
+                category="Hard",
+                image=self._png(800, 400),
+            )
+        # Nothing is rendered inside the save's transaction
+        candy.refresh_from_db()
+        self.assertEqual(candy.image_renditions, {})
+        for callback in callbacks:
+            callback()
+        candy.refresh_from_db()
+        self.assertEqual(sorted(candy.image_renditions, key=int), ["128", "320", "640"])
+
+        name = candy.image_renditions["320"].split("/")[-1]
+
+        with Image.open(thumbnail_storage().open(f"thumbs/{name}")) as thumb:
+            self.assertEqual((thumb.format, thumb.size), ("WEBP", (320, 160)))
+
+        response = self.client.get(f"/thumbs/{name}")
+        self.assertEqual(response["Content-Type"], "image/webp")
+        self.assertIn("immutable", response["Cache-Control"])
+
+        middleware = ImmutableThumbnailMiddleware(lambda request: None)
+        self.assertTrue(middleware.immutable_file_test("", f"/thumbs/{name}"))
+        self.assertFalse(middleware.immutable_file_test("", "/thumbs/logo.webp"))
+
+    def test_oversized_upload_keeps_the_original(self):
+        self.addCleanup(setattr, Image, "MAX_IMAGE_PIXELS", Image.MAX_IMAGE_PIXELS)
+        Image.MAX_IMAGE_PIXELS = 1000
+
+        with self.captureOnCommitCallbacks(execute=True):
+            candy = Candy.objects.create(
+                name="Giant Jawbreaker",
+                price="1.00",
+                stock=5,
+                description="",
+                category="Hard",
+                image=self._png(800, 400),
+            )
+        candy.refresh_from_db()
+        self.assertEqual(candy.image_renditions, {})
+        # The upload itself isn't served outside DEBUG, so a placeholder is
+        html = self.client.get("/").content.decode()
+        self.assertIn('src="/static/store/images/placeholder.svg"', html)
+        self.assertNotIn("/media/", html)
+
+    def test_oversized_download_is_refused(self):
+        candy = Candy(name="Remote", image_url="https://example.com/huge.png")
+        response = mock.MagicMock()
+        response.__enter__.return_value.read.side_effect = lambda size: b"x" * size
+        with mock.patch("urllib.request.urlopen", return_value=response):
+            with self.assertRaises(ValueError):
+                source_bytes(candy)
+        response.__enter__.return_value.read.assert_called_once_with(
+            MAX_FETCH_BYTES + 1
+        )
+
+    def test_command_converts_legacy_images_for_the_grid(self):
+        Candy.objects.create(
+            name="Caramel", price="1.00", stock=5, description="", category="Chewy"
+        )
+        # Until the command runs the bundled image is served as it was
+        html = self.client.get("/").content.decode()
+        self.assertIn('src="/static/store/images/caramel.png"', html)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("build_candy_images", stdout=StringIO())
+
+        html = self.client.get("/").content.decode()
+        self.assertIn('srcset="/thumbs/', html)
+        self.assertIn('loading="lazy"', html)
+        self.assertNotIn("store/images/caramel.png", html)
+
+    def test_command_rebuilds_missing_thumbnail_files(self):
+        candy = Candy.objects.create(
+            name="Caramel", price="1.00", stock=5, description="", category="Chewy"
+        )
+        call_command("build_candy_images", stdout=StringIO())
+        candy.refresh_from_db()
+        storage = thumbnail_storage()
+        for name in candy.image_renditions.values():
+            storage.delete(name)
+
+        out = StringIO()
+        call_command("build_candy_images", stdout=out)
+        self.assertIn("Built thumbnails for 1 candies", out.getvalue())
+        for name in candy.image_renditions.values():
+            self.assertTrue(storage.exists(name))
+
+
+@plain_static
+class LazyCartTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.candy = Candy.objects.create(
+            name="Gumdrop", price="1.50", stock=10, description="", category="Chewy"
+        )
+
+    def test_anonymous_browsing_writes_no_session(self):
+        for url in ("/", "/search/?q=gum", f"/candy/{self.candy.id}/", "/cart/"):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertEqual(Session.objects.count(), 0)
+
+    def test_badge_reads_cached_count_without_saving_session(self):
+        self.client.post(f"/cart/add/{self.candy.id}/", {"quantity": 3})
+        session = self.client.session
+        self.assertEqual(session[settings.CART_COUNT_SESSION_ID], 3)
+
+        request = RequestFactory().get("/")
+        request.session = session
+        context = cart_context(request)
+        self.assertEqual(context["cart_count"], 3)
+        self.assertFalse(session.modified)
+        self.assertContains(self.client.get("/"), "🛒 Cart")
+
+
+@plain_static
+class CartSnapshotTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="snap", password="password")
+        self.client.login(username="snap", password="password")
+        self.candies = [
+            Candy.objects.create(
+                name=name, price=price, stock=10, description="", category="Mix"
+            )
+            for name, price in (("Mallow", "0.10"), ("Praline", "0.20"))
+        ]
+        for candy in self.candies:
+            self.client.post(f"/cart/add/{candy.id}/", {"quantity": 3})
+
+    def _product_loads(self, queries):
+        return [
+            q["sql"]
+            for q in queries.captured_queries
+            if q["sql"].startswith("SELECT")
+            and 'FROM "store_candy" WHERE "store_candy"."id" IN' in q["sql"]
+            # full product rows, not the post-order stock re-read
+            and '"store_candy"."name"' in q["sql"]
+        ]
+
+    def test_totals_are_exact(self):
+        request = RequestFactory().get("/")
+        request.session = self.client.session
+        cart = Cart(request)
+        self.assertEqual(len(cart), 6)
+        self.assertEqual(str(cart.get_total_price()), "0.90")
+        self.assertEqual([str(item["total_price"]) for item in cart], ["0.30", "0.60"])
+
+    def test_checkout_loads_products_once(self):
+        data = {
+            "full_name": "Snap Shot",
+            "address": "1 Main St",
+            "city": "Town",
+            "zip_code": "12345",
+            "card_number": "4242424242424242",
+            "expiry": "12/26",
+            "cvv": "123",
+        }
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post("/checkout/", data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self._product_loads(queries)), 1)
+        self.assertEqual(str(Order.objects.get().total_price), "0.90")
+
+
+@plain_static
+class CartStorageTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.candies = [
+            Candy.objects.create(
+                name=name, price="1.25", stock=10, description="", category="Mix"
+            )
+            for name in ("Humbug", "Sherbet")
+        ]
+
+    def test_compact_encoding(self):
+        self.assertEqual(encode({12: 3, 40: 1, 7: 0}), "12:3,40:1")
+        self.assertEqual(decode("12:3,40:1,x:2,9:"), {12: 3, 40: 1})
+        legacy = {"12": {"quantity": 3, "price": "1.00"}}
+        self.assertEqual(decode(legacy), {12: 3})
+
+    def _shop(self):
+        for candy in self.candies:
+            self.client.post(f"/cart/add/{candy.id}/", {"quantity": 2})
+        self.client.post(f"/cart/add/{self.candies[0].id}/", {"quantity": 1})
+
+        response = self.client.get("/cart/")
+        self.assertEqual(
+            [(i["product"].name, i["quantity"]) for i in response.context["cart"]],
+            [("Humbug", 3), ("Sherbet", 2)],
+        )
+        self.assertEqual(str(response.context["cart"].get_total_price()), "6.25")
+        self.assertEqual(Session.objects.count(), 0)
+
+    @override_settings(CART_STORAGE="store.cart_storage.CacheCartStorage")
+    def test_cache_storage_keeps_cart_out_of_the_session(self):
+        self._shop()
+        cart_id = self.client.cookies["cart"].value
+        self.client.post(f"/cart/remove/{self.candies[0].id}/")
+        self.client.post(f"/cart/remove/{self.candies[1].id}/")
+        self.assertEqual(self.client.cookies["cart"].value, cart_id)
+        self.assertEqual(len(self.client.get("/cart/").context["cart"]), 0)
+
+    @override_settings(CART_STORAGE="store.cart_storage.CacheCartStorage")
+    def test_cache_storage_refuses_a_per_process_cache(self):
+        with self.assertRaises(ImproperlyConfigured):
+            check_storage()
+        shared = {"default": {"BACKEND": "django.core.cache.backends.db.DatabaseCache"}}
+        with override_settings(CACHES=shared):
+            check_storage()
+
+    @override_settings(CART_STORAGE="store.cart_storage.SignedCookieCartStorage")
+    def test_signed_cookie_storage_rejects_tampering(self):
+        self._shop()
+        self.client.cookies["cart"] = self.client.cookies["cart"].value.replace(
+            ":3", ":9"
+        )
+        self.assertEqual(len(self.client.get("/cart/").context["cart"]), 0)
+
+
+class CartApiTest(TestCase):
+    def setUp(self):
+        self.fudge = Candy.objects.create(
+            name="Fudge", price="2.50", stock=10, description="", category="Chewy"
+        )
+        self.mints = Candy.objects.create(
+            name="Mints", price="0.75", stock=10, description="", category="Hard"
+        )
+
+    def test_add_update_remove_return_mini_cart(self):
+        data = self.client.post(
+            f"/api/cart/add/{self.fudge.id}/", {"quantity": 2}
+        ).json()
+        self.assertEqual(data["count"], 2)
+        self.assertEqual(data["total"], "5.00")
+        self.assertEqual(data["items"][0]["name"], "Fudge")
+
+        self.client.post(f"/api/cart/add/{self.mints.id}/")
+        data = self.client.post(
+            f"/api/cart/update/{self.fudge.id}/", {"quantity": 4}
+        ).json()
+        self.assertEqual((data["count"], data["total"]), (5, "10.75"))
+
+        data = self.client.post(f"/api/cart/remove/{self.fudge.id}/").json()
+        self.assertEqual([item["name"] for item in data["items"]], ["Mints"])
+
+        response = self.client.post(
+            f"/api/cart/update/{self.mints.id}/", {"quantity": "-1"}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_bulk_set_replaces_cart(self):
+        self.client.post(f"/api/cart/add/{self.fudge.id}/", {"quantity": 2})
+        response = self.client.post(
+            "/api/cart/",
+            json.dumps({"items": {str(self.mints.id): 3, "999999": 1}}),
+            content_type="application/json",
+        )
+        data = response.json()
+        self.assertEqual(
+            [(i["name"], i["quantity"]) for i in data["items"]], [("Mints", 3)]
+        )
+        self.assertEqual(self.client.get("/api/cart/").json()["total"], "2.25")
+
+
+class ReorderTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="again", password="password")
+        self.client.login(username="again", password="password")
+        self.order = Order.objects.create(user=self.user, total_price=0)
+        self.candies = []
+        for i in range(6):
+            candy = Candy.objects.create(
+                name=f"Bonbon {i}",
+                price="1.00",
+                stock=0 if i == 5 else 10,
+                description="",
+                category="Mix",
+            )
+            OrderItem.objects.create(
+                order=self.order, product=candy, price="1.00", quantity=2
+            )
+            self.candies.append(candy)
+
+    def test_reorder_fills_cart_in_one_pass(self):
+        self.client.post(f"/cart/add/{self.candies[0].id}/", {"quantity": 1})
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(f"/orders/{self.order.id}/reorder/")
+        store_queries = [q for q in queries.captured_queries if '"store_' in q["sql"]]
+        self.assertEqual(len(store_queries), 2)
+
+        request = RequestFactory().get("/")
+        request.session = self.client.session
+        cart = Cart(request)
+        self.assertEqual(cart.cart[self.candies[0].id], 3)
+        self.assertEqual(len(cart), 11)
+        self.assertNotIn(self.candies[5].id, cart.cart)
+
+
+class OrderPlacementTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="placer", password="password")
+        self.toffee = Candy.objects.create(
+            name="Toffee", price="1.00", stock=3, description="", category="Chewy"
+        )
+        self.brittle = Candy.objects.create(
+            name="Brittle", price="2.00", stock=1, description="", category="Hard"
+        )
+
+    def _cart(self, *lines):
+        request = RequestFactory().post("/")
+        middleware = SessionMiddleware(lambda x: None)
+        middleware.process_request(request)
+        cart = Cart(request)
+        for candy, quantity in lines:
+            cart.add(candy, quantity)
+        return cart
+
+    def test_places_order_and_sends_one_stock_event(self):
+        events = []
+
+        def listener(sender, candies, old_stock, **kwargs):
+            events.append({c.name: (old_stock[c.pk], c.stock) for c in candies})
+
+        stock_changed.connect(listener)
+        self.addCleanup(stock_changed.disconnect, listener)
+
+        cart = self._cart((self.toffee, 2), (self.brittle, 1))
+        with self.captureOnCommitCallbacks(execute=True):
+            order = place_order(self.user, cart)
+
+        self.assertEqual(order.items.count(), 2)
+        self.assertEqual(str(order.total_price), "4.00")
+        self.assertEqual(events, [{"Toffee": (3, 1), "Brittle": (1, 0)}])
+        self.toffee.refresh_from_db()
+        self.assertEqual(self.toffee.stock, 1)
+
+    def test_confirmation_waits_for_commit(self):
+        self.user.email = "placer@example.com"
+        self.user.save()
+        mail.outbox = []
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            order = place_order(self.user, self._cart((self.toffee, 1)))
+            self.assertEqual(mail.outbox, [])
+        for callback in callbacks:
+            callback()
+
+        self.assertEqual(mail.outbox[0].subject, f"Order Confirmation #{order.id}")
+
+    def test_short_line_rolls_back_whole_order(self):
+        place_order(self.user, self._cart((self.brittle, 1)))
+        with self.assertRaisesMessage(OutOfStock, "Only 0 left"):
+            place_order(self.user, self._cart((self.toffee, 2), (self.brittle, 1)))
+
+        self.toffee.refresh_from_db()
+        self.assertEqual(self.toffee.stock, 3)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_cancel_restocks_once_and_only_once(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            order = place_order(self.user, self._cart((self.toffee, 2)))
+        stale = Order.objects.get(pk=order.pk)
+
+        events = []
+
+        def listener(sender, candies, old_stock, **kwargs):
+            events.append({c.name: (old_stock[c.pk], c.stock) for c in candies})
+
+        stock_changed.connect(listener)
+        self.addCleanup(stock_changed.disconnect, listener)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(order.cancel_order())
+        # A second cancel of the same order (e.g. from another tab) is refused
+        self.assertFalse(stale.cancel_order())
+
+        self.assertEqual(events, [{"Toffee": (1, 3)}])
+        self.toffee.refresh_from_db()
+        self.assertEqual(self.toffee.stock, 3)
+
+    def test_database_rejects_negative_stock(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Candy.objects.filter(pk=self.toffee.pk).update(stock=-1)
+
+
+@plain_static
+class CheckoutIdempotencyTest(TestCase):
+    def setUp(self):
+        User.objects.create_user(username="retry", password="password")
+        self.client.login(username="retry", password="password")
+        self.candy = Candy.objects.create(
+            name="Nougat", price="1.00", stock=5, description="", category="Chewy"
+        )
+        self.client.post(f"/cart/add/{self.candy.id}/", {"quantity": 2})
+
+    def test_resubmitted_checkout_replays_original_order(self):
+        form = self.client.get("/checkout/").context["form"]
+        data = {
+            "full_name": "Re Try",
+            "address": "1 Main St",
+            "city": "Town",
+            "zip_code": "12345",
+            "card_number": "4242424242424242",
+            "expiry": "12/26",
+            "cvv": "123",
+            "idempotency_key": form.initial["idempotency_key"],
+        }
+        first = self.client.post("/checkout/", data)
+        second = self.client.post("/checkout/", data)
+
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(first.context["order"], second.context["order"])
+        self.candy.refresh_from_db()
+        self.assertEqual(self.candy.stock, 3)
+
+    def test_key_race_returns_the_committed_order(self):
+        user = User.objects.get(username="retry")
+        winner = Order.objects.create(user=user, idempotency_key="k1")
+        request = RequestFactory().post("/")
+        SessionMiddleware(lambda x: None).process_request(request)
+        cart = Cart(request)
+        cart.add(self.candy, 1)
+
+        # The pre-check misses (the other request hasn't committed yet), then
+        # the unique key rejects our insert and the winner is looked up
+        with mock.patch(
+            "store.orders.replayed_order", side_effect=[None, winner]
+        ) as lookup:
+            self.assertEqual(place_order(user, cart, idempotency_key="k1"), winner)
+        self.assertEqual(lookup.call_count, 2)
+        self.candy.refresh_from_db()
+        self.assertEqual(self.candy.stock, 5)
+
+
+@override_settings(STOCK_RESERVATIONS=True, STOCK_RESERVATION_TTL=600)
+class StockReservationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.candy = Candy.objects.create(
+            name="Drop", price="2.00", stock=5, category="Candy"
+        )
+        self.buyer = User.objects.create_user(username="holder", password="pw")
+
+    def _cart(self):
+        request = RequestFactory().post("/")
+        SessionMiddleware(lambda x: None).process_request(request)
+        return Cart(request)
+
+    @override_settings(CART_STORAGE="store.cart_storage.CacheCartStorage")
+    def test_clearing_a_cache_cart_releases_its_holds(self):
+        cart = self._cart()
+        cart.add(self.candy, 2)
+        holder = cart.storage.holder_id()
+        self.assertTrue(StockReservation.objects.filter(holder=holder).exists())
+
+        cart.clear()
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertIsNone(cart.storage._cookie)
+
+    def test_hold_limits_other_carts(self):
+        first, second = self._cart(), self._cart()
+        first.add(self.candy, 4)
+        second.add(self.candy, 3)
+
+        self.assertEqual(second.cart, {self.candy.id: 1})
+        self.assertEqual(second.shortages, {self.candy.id: 1})
+        self.assertEqual(available_to_sell(self.candy), 0)
+        self.assertEqual(available_to_sell(self.candy, first.storage.holder_id()), 4)
+
+        first.remove(self.candy)
+        self.assertFalse(
+            StockReservation.objects.filter(holder=first.storage.holder_id()).exists()
+        )
+        self.assertEqual(available_to_sell(self.candy), 4)
+
+    def test_expired_holds_free_stock(self):
+        self._cart().add(self.candy, 5)
+        self.assertEqual(available_to_sell(self.candy), 0)
+
+        StockReservation.objects.update(
+            expires_at=timezone.now() - datetime.timedelta(seconds=1)
+        )
+        self.assertEqual(available_to_sell(self.candy), 5)
+
+        out = StringIO()
+        call_command("release_reservations", stdout=out)
+        self.assertIn("Released 1", out.getvalue())
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_checkout_converts_own_holds(self):
+        mine, other = self._cart(), self._cart()
+        mine.add(self.candy, 2)
+        other.add(self.candy, 3)
+
+        order = place_order(self.buyer, mine)
+        self.assertEqual(order.items.get().quantity, 2)
+        self.candy.refresh_from_db()
+        self.assertEqual(self.candy.stock, 3)
+        self.assertEqual(
+            list(StockReservation.objects.values_list("holder", "quantity")),
+            [(other.storage.holder_id(), 3)],
+        )
+
+        # The remaining stock is all held by the other cart
+        late = self._cart()
+        late.cart = {self.candy.id: 1}
+        with self.assertRaises(OutOfStock) as raised:
+            place_order(self.buyer, late)
+        self.assertEqual(raised.exception.available, 0)
+
+
+class ShardedStockTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.candy = Candy.objects.create(
+            name="Hot", price="1.00", stock=10, category="Candy", stock_slots=4
+        )
+        self.buyer = User.objects.create_user(username="rush", password="pw")
+
+    def _cart(self, quantity):
+        request = RequestFactory().post("/")
+        SessionMiddleware(lambda x: None).process_request(request)
+        cart = Cart(request)
+        cart.add(self.candy, quantity)
+        return cart
+
+    def _slots(self):
+        return list(
+            self.candy.stock_shards.order_by("slot").values_list("stock", flat=True)
+        )
+
+    def test_saved_stock_is_spread_over_slots(self):
+        self.assertEqual(self._slots(), [3, 3, 2, 2])
+        self.candy.stock, self.candy.stock_slots = 7, 2
+        self.candy.save()
+        self.assertEqual(self._slots(), [4, 3])
+        self.candy.stock_slots = 0
+        self.candy.save()
+        self.assertEqual(self._slots(), [])
+
+    def test_order_takes_from_a_slot_not_the_product_row(self):
+        cart = self._cart(2)
+        before = self._slots()
+        with self.captureOnCommitCallbacks() as callbacks:
+            with CaptureQueriesContext(connection) as ctx:
+                place_order(self.buyer, cart)
+        self.assertFalse(
+            [
+                q
+                for q in ctx.captured_queries
+                if q["sql"].startswith('UPDATE "store_candy"')
+            ]
+        )
+        # One random slot paid for the whole line
+        changes = [b - a for b, a in zip(before, self._slots()) if b != a]
+        self.assertEqual(changes, [2])
+
+        for callback in callbacks:
+            callback()
+        self.candy.refresh_from_db()
+        self.assertEqual(self.candy.stock, 8)
+
+    def test_order_falls_back_across_slots(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            place_order(self.buyer, self._cart(9))
+        self.assertEqual(sum(self._slots()), 1)
+        with self.assertRaises(OutOfStock) as raised:
+            place_order(self.buyer, self._cart(2))
+        self.assertEqual(raised.exception.available, 1)
+        self.candy.refresh_from_db()
+        self.assertEqual(self.candy.stock, 1)
+
+    def test_totals_sync_at_most_once_per_interval(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            place_order(self.buyer, self._cart(1))
+        with self.captureOnCommitCallbacks(execute=True):
+            place_order(self.buyer, self._cart(2))
+        self.candy.refresh_from_db()
+        self.assertEqual(self.candy.stock, 9)
+
+        # The order worker's sweep catches up, and cached pages with it
+        catalog = get_version(CATALOG)
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("run_order_scheduler", once=True, stdout=StringIO())
+        self.candy.refresh_from_db()
+        self.assertEqual(self.candy.stock, 7)
+        self.assertNotEqual(get_version(CATALOG), catalog)
+
+    def test_cancel_puts_stock_back_in_a_slot(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            order = place_order(self.buyer, self._cart(4))
+        catalog = get_version(CATALOG)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(order.cancel_order())
+        self.assertNotEqual(get_version(CATALOG), catalog)
+        self.assertEqual(sum(self._slots()), 10)
+        self.candy.refresh_from_db()
+        self.assertEqual(self.candy.stock, 10)
+
+
+@plain_static
+@override_settings(CHECKOUT_ADMISSION_LIMIT=1)
+class CheckoutAdmissionTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.candy = Candy.objects.create(
+            name="Promo", price="1.00", stock=10, category="Candy"
+        )
+        User.objects.create_user(username="queued", password="pw")
+        self.client.login(username="queued", password="pw")
+
+    def _checkout(self, ticket=None):
+        self.client.post(f"/cart/add/{self.candy.id}/", {"quantity": 1})
+        data = {
+            "full_name": "In Line",
+            "address": "1 Main St",
+            "city": "Town",
+            "zip_code": "12345",
+            "card_number": "4242424242424242",
+            "expiry": "12/26",
+            "cvv": "123",
+            "idempotency_key": "",
+        }
+        if ticket:
+            data["admission_ticket"] = ticket
+        return self.client.post("/checkout/", data)
+
+    def _payment(self, ticket):
+        return {
+            "admission_ticket": ticket,
+            "card_number": "4242424242424242",
+            "expiry": "12/26",
+            "cvv": "123",
+        }
+
+    def test_busy_checkout_queues_then_admits(self):
+        slot = _claim_slot()
+        response = self._checkout()
+        self.assertEqual(response.status_code, 503)
+        self.assertTemplateUsed(response, "store/waiting_room.html")
+        self.assertEqual(Order.objects.count(), 0)
+        ticket = response.context["ticket"]
+        # Only the shipping details are kept while the shopper waits
+        self.assertNotContains(response, "4242424242424242", status_code=503)
+        self.assertContains(response, 'name="card_number"', status_code=503)
+        owner, kept = cache.get(SUBMISSION_KEY.format(read_ticket(ticket)))
+        self.assertEqual(kept["address"], ["1 Main St"])
+        self.assertFalse(set(kept) & set(CheckoutForm.PAYMENT_FIELDS))
+
+        poll = self.client.get("/checkout/queue/", {"ticket": ticket}).json()
+        self.assertEqual(poll["position"], 1)
+        self.assertFalse(poll["ready"])
+
+        _free_slot(slot)
+        poll = self.client.get("/checkout/queue/", {"ticket": ticket}).json()
+        self.assertTrue(poll["ready"])
+
+        # The waiting page posts the ticket with the payment details re-entered
+        response = self.client.post("/checkout/", self._payment(ticket))
+        self.assertTemplateUsed(response, "store/order_created.html")
+        self.assertEqual(Order.objects.get().full_name, "In Line")
+
+    def test_queue_is_first_in_first_out(self):
+        slot = _claim_slot()
+        first, second = self._checkout(), self._checkout()
+        self.assertEqual(second.context["position"], first.context["position"] + 1)
+
+        # A newcomer can't jump the queue even once a slot is free
+        _free_slot(slot)
+        self.assertEqual(self._checkout().status_code, 503)
+
+        # One free slot admits exactly the oldest ticket
+        self.assertEqual(position(read_ticket(first.context["ticket"])), 0)
+        self.assertEqual(position(read_ticket(second.context["ticket"])), 1)
+
+    def test_finished_order_admits_the_next_ticket(self):
+        slot = _claim_slot()
+        ticket = self._checkout().context["ticket"]
+        number = read_ticket(ticket)
+        _free_slot(slot)
+        self.assertEqual(position(number), 0)
+
+        # Placing its order releases the slot straight to the next in line
+        following = read_ticket(self._checkout().context["ticket"])
+        self.assertEqual(position(following), 1)
+        self.client.post("/checkout/", self._payment(ticket))
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(cache.get(ADMITTED_KEY), following)
+
+    def test_unused_admission_expires(self):
+        slot = _claim_slot()
+        absent = read_ticket(self._checkout().context["ticket"])
+        present = read_ticket(self._checkout().context["ticket"])
+        _free_slot(slot)
+        self.assertEqual(position(absent), 0)
+        self.assertEqual(position(present), 1)
+
+        # The first shopper never comes back; their slot passes on
+        with mock.patch("time.time", return_value=time.time() + 61):
+            self.assertEqual(position(present), 0)
+
+    def test_forged_ticket_is_rejected(self):
+        response = self.client.get("/checkout/queue/", {"ticket": "7:forged"})
+        self.assertEqual(response.status_code, 400)
+
+
+@plain_static
+class EffectiveOrderStatusTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username="tracker", password="pw", email="tracker@example.com"
+        )
+        self.client.login(username="tracker", password="pw")
+        now = timezone.now()
+        self.fresh = Order.objects.create(user=self.user)
+        self.shipping = Order.objects.create(user=self.user)
+        self.arrived = Order.objects.create(user=self.user)
+        self.cancelled = Order.objects.create(
+            user=self.user, status=Order.STATUS_CANCELLED
+        )
+        Order.objects.filter(pk=self.shipping.pk).update(
+            created_at=now - datetime.timedelta(seconds=90)
+        )
+        Order.objects.filter(pk__in=[self.arrived.pk, self.cancelled.pk]).update(
+            created_at=now - datetime.timedelta(minutes=5)
+        )
+
+    def test_reads_compute_status_without_writing(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get("/orders/")
+        self.assertEqual(response.status_code, 200)
+        writes = [
+            q["sql"]
+            for q in ctx.captured_queries
+            if q["sql"].startswith(("UPDATE", "INSERT")) and "store_order" in q["sql"]
+        ]
+        self.assertEqual(writes, [])
+
+        statuses = {o.pk: o.effective_status for o in response.context["orders"]}
+        self.assertEqual(statuses[self.fresh.pk], Order.STATUS_CREATED)
+        self.assertEqual(statuses[self.shipping.pk], Order.STATUS_SHIPPED)
+        self.assertEqual(statuses[self.arrived.pk], Order.STATUS_DELIVERED)
+        self.assertEqual(statuses[self.cancelled.pk], Order.STATUS_CANCELLED)
+
+        data = self.client.get(f"/api/order/{self.shipping.pk}/status/").json()
+        self.assertEqual(data["status"], Order.STATUS_SHIPPED)
+        self.assertTrue(data["shipped_at"])
+        self.assertIsNone(data["delivered_at"])
+        self.shipping.refresh_from_db()
+        self.assertEqual(self.shipping.status, Order.STATUS_CREATED)
+
+    def test_shipped_order_cannot_be_cancelled(self):
+        self.assertFalse(self.shipping.cancel_order())
+        self.assertTrue(self.fresh.cancel_order())
+
+    def test_command_saves_transitions_in_bulk(self):
+        mail.outbox = []
+        out = StringIO()
+        call_command("advance_order_statuses", stdout=out)
+        self.assertIn("Shipped 1 and delivered 1", out.getvalue())
+
+        saved = dict(Order.objects.values_list("pk", "status"))
+        self.assertEqual(saved[self.fresh.pk], Order.STATUS_CREATED)
+        self.assertEqual(saved[self.shipping.pk], Order.STATUS_SHIPPED)
+        self.assertEqual(saved[self.arrived.pk], Order.STATUS_DELIVERED)
+        self.assertEqual(saved[self.cancelled.pk], Order.STATUS_CANCELLED)
+        self.arrived.refresh_from_db()
+        self.assertIsNotNone(self.arrived.shipped_at)
+        self.assertIsNotNone(self.arrived.delivered_at)
+        self.assertEqual(
+            sorted(m.subject for m in mail.outbox),
+            [
+                f"Order #{self.shipping.pk} Shipped!",
+                f"Order #{self.arrived.pk} Delivered! 🍬",
+            ],
+        )
+
+
+class OrderSchedulerTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="waiter", password="pw", email="waiter@example.com"
+        )
+        self.now = timezone.now()
+        self.orders = []
+        for age in (5, 90, 30, 200):
+            order = Order.objects.create(user=self.user)
+            Order.objects.filter(pk=order.pk).update(
+                created_at=self.now - datetime.timedelta(seconds=age)
+            )
+            self.orders.append(order)
+
+    def test_heap_pops_due_transitions_in_time_order(self):
+        heap = upcoming_transitions()
+        self.assertEqual(len(heap), 4)
+        due = pop_due(heap, self.now)
+        self.assertEqual(due, [self.orders[3].pk, self.orders[1].pk])
+        later = pop_due(heap, self.now + datetime.timedelta(seconds=40))
+        self.assertEqual(later, [self.orders[2].pk])
+
+    def test_once_advances_due_orders_and_sends_emails(self):
+        mail.outbox = []
+        out = StringIO()
+        call_command("run_order_scheduler", "--once", stdout=out)
+        self.assertIn("shipped 1, delivered 1", out.getvalue())
+
+        statuses = [Order.objects.get(pk=order.pk).status for order in self.orders]
+        self.assertEqual(
+            statuses,
+            [
+                Order.STATUS_CREATED,
+                Order.STATUS_SHIPPED,
+                Order.STATUS_CREATED,
+                Order.STATUS_DELIVERED,
+            ],
+        )
+        self.assertEqual(len(mail.outbox), 2)
+
+
+class OrderStatusStreamTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="watcher", password="pw")
+        self.order = Order.objects.create(user=self.user)
+
+    def _age(self, seconds):
+        Order.objects.filter(pk=self.order.pk).update(
+            created_at=timezone.now() - datetime.timedelta(seconds=seconds)
+        )
+
+    async def test_stream_pushes_status_and_ends_when_final(self):
+        await sync_to_async(self._age)(300)
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(
+            f"/api/order/{self.order.pk}/status/stream/"
+        )
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        chunks = [chunk async for chunk in response.streaming_content]
+        body = b"".join(chunks).decode()
+        self.assertIn("event: status", body)
+        self.assertIn('"status": "Delivered"', body)
+
+    async def test_saved_change_wakes_the_stream(self):
+        live.notifier.interval = 0.01
+        self.addCleanup(setattr, live.notifier, "interval", 1.0)
+        events = live.order_status_events(self.order.pk, self.user)
+        self.assertTrue((await anext(events)).startswith("retry:"))
+        self.assertIn('"status": "Created"', await anext(events))
+
+        def cancel():
+            Order.objects.filter(pk=self.order.pk).update(status=Order.STATUS_CANCELLED)
+            bump_version(order_scope(self.order.pk))
+            bump_version(ORDERS)
+
+        # The stream is already waiting when the change lands
+        pending = asyncio.ensure_future(anext(events))
+        await asyncio.sleep(0.05)
+        await sync_to_async(cancel)()
+        self.assertIn('"status": "Cancelled"', await asyncio.wait_for(pending, 5))
+        with self.assertRaises(StopAsyncIteration):
+            await anext(events)
+
+    def test_wsgi_falls_back_to_polling(self):
+        self.client.force_login(self.user)
+        response = self.client.get(f"/api/order/{self.order.pk}/status/stream/")
+        self.assertEqual(response.status_code, 501)
+
+
+class OrderStatusCachingTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="cacher", password="pw")
+        self.client.login(username="cacher", password="pw")
+        self.fresh = Order.objects.create(user=self.user)
+        self.shipping = Order.objects.create(user=self.user)
+        self.done = Order.objects.create(user=self.user)
+        now = timezone.now()
+        Order.objects.filter(pk=self.shipping.pk).update(
+            created_at=now - datetime.timedelta(seconds=80)
+        )
+        Order.objects.filter(pk=self.done.pk).update(
+            created_at=now - datetime.timedelta(minutes=10)
+        )
+
+    def _max_age(self, response):
+        return int(re.search(r"max-age=(\d+)", response["Cache-Control"]).group(1))
+
+    def test_max_age_runs_to_next_transition_and_revalidates(self):
+        response = self.client.get(f"/api/order/{self.shipping.pk}/status/")
+        self.assertEqual(response.json()["status"], Order.STATUS_SHIPPED)
+        self.assertIn("private", response["Cache-Control"])
+        self.assertTrue(35 <= self._max_age(response) <= 40)
+
+        again = self.client.get(
+            f"/api/order/{self.shipping.pk}/status/",
+            HTTP_IF_NONE_MATCH=response["ETag"],
+        )
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again["ETag"], response["ETag"])
+
+        fresh = self.client.get(f"/api/order/{self.fresh.pk}/status/")
+        self.assertTrue(55 <= self._max_age(fresh) <= 60)
+        self.assertNotEqual(fresh["ETag"], response["ETag"])
+
+    def test_batch_returns_all_statuses_in_one_query(self):
+        other = User.objects.create_user(username="someone", password="pw")
+        foreign = Order.objects.create(user=other)
+        ids = [self.fresh.pk, self.shipping.pk, self.done.pk, foreign.pk]
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(
+                "/api/orders/status/", {"ids": ",".join(map(str, ids))}
+            )
+        order_queries = [
+            q for q in ctx.captured_queries if 'FROM "store_order"' in q["sql"]
+        ]
+        self.assertEqual(len(order_queries), 1)
+
+        statuses = {k: v["status"] for k, v in response.json()["orders"].items()}
+        self.assertEqual(
+            statuses,
+            {
+                str(self.fresh.pk): Order.STATUS_CREATED,
+                str(self.shipping.pk): Order.STATUS_SHIPPED,
+                str(self.done.pk): Order.STATUS_DELIVERED,
+            },
+        )
+        # Cacheable until the soonest transition among them
+        self.assertTrue(35 <= self._max_age(response) <= 40)
+
+        bad = self.client.get("/api/orders/status/", {"ids": "1,x"})
+        self.assertEqual(bad.status_code, 400)
+
+
+@plain_static
+class OrderHistoryPageTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="regular", password="pw")
+        self.client.login(username="regular", password="pw")
+        self.candies = [
+            Candy.objects.create(name=f"Pick {n}", price="1.00", stock=5, category="C")
+            for n in range(4)
+        ]
+        self.orders = []
+        for _ in range(25):
+            order = Order.objects.create(user=self.user)
+            OrderItem.objects.bulk_create(
+                [OrderItem(order=order, product=c, price="1.00") for c in self.candies]
+            )
+            self.orders.append(order)
+
+    def test_history_pages_with_a_fixed_number_of_queries(self):
+        with CaptureQueriesContext(connection) as full:
+            response = self.client.get("/orders/")
+        page = response.context["orders"]
+        self.assertEqual(len(page), 20)
+        self.assertTrue(page.has_next)
+        self.assertEqual(
+            [o.pk for o in page][:2], [self.orders[-1].pk, self.orders[-2].pk]
+        )
+        first = page.object_list[0]
+        self.assertEqual(len(first.preview_items), 3)
+        self.assertEqual(first.item_count, 4)
+        self.assertContains(response, "+1")
+
+        with CaptureQueriesContext(connection) as rest:
+            older = self.client.get("/orders/", {"after": page.next_cursor})
+        self.assertEqual(
+            [o.pk for o in older.context["orders"]],
+            [o.pk for o in reversed(self.orders[:5])],
+        )
+        self.assertFalse(older.context["orders"].has_next)
+        # Same cost for a full page as for a short one: no per-order queries
+        self.assertEqual(len(full.captured_queries), len(rest.captured_queries))
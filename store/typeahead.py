@@ -0,0 +1,129 @@
+"""
+In-memory typeahead index for the header search box.
+
+Each worker keeps a sorted array of normalized keys built from Candy names and
+categories and answers prefix lookups with bisect, so a keystroke never touches
+the database. The index is rebuilt lazily when the catalog version stamp moves.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+
+from django.urls import reverse
+from django.utils.http import urlencode
+
+from .models import Candy
+from .versions import CATALOG, get_version
+
+# How often a worker re-reads the catalog stamp from the cache
+VERSION_CHECK_INTERVAL = 1.0
+
+KIND_PRODUCT = "product"
+KIND_CATEGORY = "category"
+
+
+def normalize(text):
+    return " ".join(text.lower().split())
+
+
+class PrefixIndex:
+    """Sorted keys with parallel suggestion entries, searched by bisect"""
+
+    def __init__(self, suggestions):
+        rows = []
+        for suggestion in suggestions:
+            label = normalize(suggestion["label"])
+            words = label.split(" ")
+            # Index the full label and every word suffix so "bears" finds
+            # "Gummy Bears"; word matches sort after full-label matches.
+            for position in range(len(words)):
+                key = " ".join(words[position:])
+                rows.append((key, position > 0, label, suggestion))
+        rows.sort(key=lambda row: row[:3])
+        self._keys = [row[0] for row in rows]
+        self._rows = rows
+
+    def __len__(self):
+        return len(self._keys)
+
+    def lookup(self, prefix, limit=8):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        start = bisect_left(self._keys, prefix)
+        matches = []
+        for index in range(start, len(self._keys)):
+            if not self._keys[index].startswith(prefix):
+                break
+            matches.append(self._rows[index])
+        matches.sort(key=lambda row: (row[1], row[3]["kind"] != KIND_PRODUCT, row[2]))
+
+        results = []
+        seen = set()
+        for row in matches:
+            suggestion = row[3]
+            identity = (suggestion["kind"], suggestion["url"])
+            if identity in seen:
+                continue
+            seen.add(identity)
+            results.append(suggestion)
+            if len(results) == limit:
+                break
+        return results
+
+
+def build_index():
+    """Load names and categories once and build a fresh PrefixIndex"""
+    suggestions = []
+    categories = set()
+    for candy_id, name, category in Candy.objects.values_list("id", "name", "category"):
+        suggestions.append(
+            {
+                "label": name,
+                "kind": KIND_PRODUCT,
+                "url": reverse("candy_detail", args=[candy_id]),
+            }
+        )
+        categories.add(category)
+    home_url = reverse("home")
+    for category in categories:
+        suggestions.append(
+            {
+                "label": category,
+                "kind": KIND_CATEGORY,
+                "url": f"{home_url}?{urlencode({'category': category})}",
+            }
+        )
+    return PrefixIndex(suggestions)
+
+
+_lock = threading.Lock()
+_index = None
+_index_version = None
+_checked_at = 0.0
+
+
+def get_index():
+    """Return this worker's index, rebuilding it if the catalog stamp changed"""
+    global _index, _index_version, _checked_at
+    now = time.monotonic()
+    if _index is not None and now - _checked_at < VERSION_CHECK_INTERVAL:
+        return _index
+    with _lock:
+        version = get_version(CATALOG)
+        if _index is None or version != _index_version:
+            _index = build_index()
+            _index_version = version
+        _checked_at = now
+    return _index
+
+
+def invalidate():
+    """Make the next lookup in this worker re-check the catalog stamp"""
+    global _checked_at
+    _checked_at = 0.0
+
+
+def suggest(prefix, limit=8):
+    return get_index().lookup(prefix, limit)
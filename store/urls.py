@@ -7,10 +7,34 @@ from . import views
 
 urlpatterns = [
     path("", views.home, name="home"),
+    path("search/", views.search, name="search"),
+    path(
+        "api/search/autocomplete/",
+        views.search_autocomplete,
+        name="search_autocomplete",
+    ),
+    path("thumbs/<str:name>", views.candy_thumbnail, name="candy_thumbnail"),
     path("candy/<int:candy_id>/", views.candy_detail, name="candy_detail"),
+    path(
+        "candy/<int:candy_id>/reviews/",
+        views.candy_reviews_api,
+        name="candy_reviews_api",
+    ),
     path("cart/", views.cart_detail, name="cart_detail"),
     path("cart/add/<int:candy_id>/", views.cart_add, name="cart_add"),
     path("cart/remove/<int:candy_id>/", views.cart_remove, name="cart_remove"),
+    path("api/cart/", views.cart_api, name="cart_api"),
+    path("api/cart/add/<int:candy_id>/", views.cart_api_add, name="cart_api_add"),
+    path(
+        "api/cart/update/<int:candy_id>/",
+        views.cart_api_update,
+        name="cart_api_update",
+    ),
+    path(
+        "api/cart/remove/<int:candy_id>/",
+        views.cart_api_remove,
+        name="cart_api_remove",
+    ),
     path("order/create/", views.order_create, name="order_create"),
     path("orders/", views.order_history, name="order_history"),
     path("orders/<int:order_id>/", views.order_detail, name="order_detail"),
@@ -18,11 +42,22 @@ urlpatterns = [
     path("inventory/add/", views.inventory_add, name="inventory_add"),
     path("inventory/update/<int:pk>/", views.inventory_update, name="inventory_update"),
     path("checkout/", views.checkout, name="checkout"),
+    path("checkout/queue/", views.checkout_queue, name="checkout_queue"),
     path(
         "api/order/<int:order_id>/status/",
         views.order_status_api,
         name="order_status_api",
     ),
+    path(
+        "api/orders/status/",
+        views.order_statuses_api,
+        name="order_statuses_api",
+    ),
+    path(
+        "api/order/<int:order_id>/status/stream/",
+        views.order_status_stream,
+        name="order_status_stream",
+    ),
     path("orders/<int:order_id>/cancel/", views.cancel_order, name="cancel_order"),
     path("orders/<int:order_id>/delete/", views.delete_order, name="delete_order"),
     path("orders/<int:order_id>/reorder/", views.reorder, name="reorder"),
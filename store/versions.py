@@ -0,0 +1,62 @@
+"""
+Version stamps for derived catalog data.
+
+A stamp is a millisecond timestamp kept in the default cache. Writers bump it
+after commit; readers compare it with the stamp their derived data was built
+from (typeahead index, cached fragments, ETags). Because stamps are times, a
+stamp that gets evicted comes back as a newer value and can never repeat an
+old one.
+
+With a per-process cache (locmem) bumps made by other processes (commands,
+the order worker, other web workers) are never seen, so there stamps expire
+after settings.VERSION_STAMP_TTL: derived data built from them is then at
+most that old instead of stale until the process restarts.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+CATALOG = "catalog"
+RECOMMENDATIONS = "recommendations"
+ORDERS = "orders"  # moves whenever any order's status does
+
+KEY_PREFIX = "version:"
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+def reviews_scope(candy_id):
+    """Stamp for the reviews shown on one product page"""
+    return f"reviews:{candy_id}"
+
+
+def stock_scope(candy_id):
+    """Stamp for one product's available-to-sell (moved by stock reservations)"""
+    return f"stock:{candy_id}"
+
+
+def order_scope(order_id):
+    """Stamp for one order's status (watched by the live status stream)"""
+    return f"order:{order_id}"
+
+
+def get_version(scope):
+    """Current stamp for `scope`, initialising it if missing"""
+    key = KEY_PREFIX + scope
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _now_ms(), settings.VERSION_STAMP_TTL)
+        version = cache.get(key, _now_ms())
+    return version
+
+
+def bump_version(scope):
+    """Move `scope` to a new stamp, strictly greater than the current one"""
+    key = KEY_PREFIX + scope
+    version = max(_now_ms(), (cache.get(key) or 0) + 1)
+    cache.set(key, version, settings.VERSION_STAMP_TTL)
+    return version
@@ -2,12 +2,39 @@
 Store views for browsing candies
 """
 
+import hashlib
+import json
+
+from django.conf import settings
+from django.utils import dateformat, timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
 from django.shortcuts import render, get_object_or_404, redirect
 from django.views.decorators.http import require_POST
-from django.http import HttpResponse, JsonResponse
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    JsonResponse,
+    QueryDict,
+    StreamingHttpResponse,
+)
 from .models import Candy, Order, OrderItem, Favorite, Review
 from django.db import models
-from .cart import Cart
+from .cart import Cart, cart_item_count
+from .images import RENDITION_NAME, thumbnail_storage
+from .catalog import (
+    CatalogFilters,
+    SORT_LABELS,
+    cached_catalog_categories,
+    render_catalog_grid,
+)
+from .pagination import paginate
+from .orders import OutOfStock, new_idempotency_key, place_order, replayed_order
+from .rankings import cached_best_sellers
+from .recommendations import cached_recommendations
+from .search import search_candies
+from . import admission, live, reservations, typeahead
 
 
 from django.contrib.admin.views.decorators import staff_member_required
@@ -15,14 +42,59 @@ from .forms import CandyForm, CheckoutForm, ReviewForm
 
 
 def home(request):
-    """Home page showing all candies"""
-    candies = Candy.objects.all()
+    """Home page showing one page of the filtered catalog"""
+    filters = CatalogFilters(request.GET)
     context = {
-        "candies": candies,
+        "grid": render_catalog_grid(request, filters),
+        "best_sellers": cached_best_sellers(),
+        "filters": filters,
+        "categories": cached_catalog_categories(),
+        "sort_options": SORT_LABELS,
     }
     return render(request, "store/home.html", context)
 
 
+def search(request):
+    """Ranked full-text search results"""
+    query = request.GET.get("q", "").strip()
+    try:
+        page_number = int(request.GET.get("page", 1))
+    except ValueError:
+        page_number = 1
+
+    results = None
+    if query:
+        results = search_candies(query, page_number, settings.CATALOG_PAGE_SIZE)
+
+    context = {
+        "query": query,
+        "results": results,
+    }
+    return render(request, "store/search_results.html", context)
+
+
+def search_autocomplete(request):
+    """JSON typeahead suggestions served from the in-memory prefix index"""
+    query = request.GET.get("q", "")
+    return JsonResponse({"query": query, "results": typeahead.suggest(query)})
+
+
+def candy_thumbnail(request, name):
+    """
+    Serve a product thumbnail WhiteNoise doesn't know about yet: it indexes
+    WHITENOISE_ROOT at startup, so thumbnails built later fall through to here.
+    """
+    name = f"thumbs/{name}"
+    if not RENDITION_NAME.match(name):
+        raise Http404
+    storage = thumbnail_storage()
+    if not storage.exists(name):
+        raise Http404
+    response = FileResponse(storage.open(name, "rb"), content_type="image/webp")
+    response["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
+
+
 def candy_detail(request, candy_id):
     """Detail page for a single candy"""
     candy = get_object_or_404(Candy, id=candy_id)
@@ -32,13 +104,13 @@ def candy_detail(request, candy_id):
     if request.user.is_authenticated:
         is_favorited = Favorite.objects.filter(user=request.user, candy=candy).exists()
 
-    # Reviews logic
-    reviews = candy.reviews.all()
-    average_rating = reviews.aggregate(models.Avg("rating"))["rating__avg"]
+    # Reviews logic: first page only, newest first, authors joined in
+    reviews = review_page(candy)
+    average_rating = candy.average_rating
 
     user_review = None
     if request.user.is_authenticated:
-        user_review = reviews.filter(user=request.user).first()
+        user_review = candy.reviews.filter(user=request.user).first()
 
     # Handle Add Review
     if request.method == "POST" and "add_review" in request.POST:
@@ -56,17 +128,61 @@ def candy_detail(request, candy_id):
     else:
         form = ReviewForm()
 
+    # With stock reservations, other carts' holds aren't for sale
+    available = candy.stock
+    if reservations.enabled():
+        cart = Cart(request)
+        holder = cart.storage.holder_id() if cart_item_count(request) else None
+        available = reservations.available_to_sell(candy, holder)
+
     context = {
         "candy": candy,
+        "available": available,
         "is_favorited": is_favorited,
         "reviews": reviews,
         "average_rating": average_rating,
         "user_review": user_review,
         "form": form,
+        "recommendations": cached_recommendations(candy.id),
     }
     return render(request, "store/candy_detail.html", context)
 
 
+REVIEW_ORDERING = ("-created_at", "-id")
+
+
+def review_page(candy, cursor=None):
+    """One keyset page of a candy's reviews with their authors"""
+    return paginate(
+        candy.reviews.select_related("user"),
+        REVIEW_ORDERING,
+        cursor,
+        settings.REVIEWS_PAGE_SIZE,
+    )
+
+
+def candy_reviews_api(request, candy_id):
+    """JSON "load more" endpoint for the reviews on candy_detail"""
+    candy = get_object_or_404(Candy.objects.only("id"), id=candy_id)
+    page = review_page(candy, request.GET.get("after"))
+    data = {
+        "reviews": [
+            {
+                "username": review.user.username,
+                "rating": review.rating,
+                "comment": review.comment,
+                "created_at": review.created_at.isoformat(),
+                "created_display": dateformat.format(
+                    timezone.localtime(review.created_at), "M d, Y"
+                ),
+            }
+            for review in page
+        ],
+        "next_cursor": page.next_cursor,
+    }
+    return JsonResponse(data)
+
+
 @require_POST
 def cart_add(request, candy_id):
     cart = Cart(request)
@@ -74,9 +190,25 @@ def cart_add(request, candy_id):
     quantity = int(request.POST.get("quantity", 1))
     override = request.POST.get("override", False)
     cart.add(product=candy, quantity=quantity, override_quantity=override)
+    _warn_shortages(request, cart)
     return redirect("cart_detail")
 
 
+def _warn_shortages(request, cart):
+    """Tell the buyer which lines were cut down to the stock that was left"""
+    if not cart.shortages:
+        return
+    names = dict(Candy.objects.filter(pk__in=cart.shortages).values_list("id", "name"))
+    messages.warning(
+        request,
+        "Not enough stock left for: "
+        + ", ".join(
+            f"{names.get(pid, pid)} (only {qty} available)"
+            for pid, qty in cart.shortages.items()
+        ),
+    )
+
+
 @require_POST
 def cart_remove(request, candy_id):
     cart = Cart(request)
@@ -90,6 +222,90 @@ def cart_detail(request):
     return render(request, "store/cart.html", {"cart": cart})
 
 
+def _mini_cart(cart):
+    """JSON payload describing the cart after a change"""
+    return {
+        "items": [
+            {
+                "id": item["product"].id,
+                "name": item["product"].name,
+                "quantity": item["quantity"],
+                "price": str(item["price"]),
+                "total_price": str(item["total_price"]),
+            }
+            for item in cart
+        ],
+        "count": len(cart),
+        "total": str(cart.get_total_price()),
+        "shortages": {str(pid): qty for pid, qty in cart.shortages.items()},
+    }
+
+
+def _quantity(value, default=1):
+    """Parse a non-negative quantity, or None if it isn't one"""
+    try:
+        quantity = int(value if value not in (None, "") else default)
+    except (TypeError, ValueError):
+        return None
+    return quantity if quantity >= 0 else None
+
+
+def cart_api(request):
+    """
+    GET: the mini-cart. POST: replace the whole cart from a JSON body
+    {"items": {"<candy id>": quantity, ...}}; unknown ids are ignored.
+    """
+    cart = Cart(request)
+    if request.method == "POST":
+        try:
+            lines = json.loads(request.body)["items"]
+            lines = {int(pid): _quantity(qty) for pid, qty in lines.items()}
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return JsonResponse({"error": "Expected an items object"}, status=400)
+        if None in lines.values():
+            return JsonResponse(
+                {"error": "Quantities must be whole numbers"}, status=400
+            )
+        products = Candy.objects.in_bulk(lines)
+        cart.set_quantities(
+            {product: lines[pid] for pid, product in products.items()}, replace=True
+        )
+    return JsonResponse(_mini_cart(cart))
+
+
+@require_POST
+def cart_api_add(request, candy_id):
+    """Add `quantity` (default 1) of a candy to the cart"""
+    candy = get_object_or_404(Candy, id=candy_id)
+    quantity = _quantity(request.POST.get("quantity"))
+    if not quantity:
+        return JsonResponse({"error": "Quantity must be at least 1"}, status=400)
+    cart = Cart(request)
+    cart.add(product=candy, quantity=quantity)
+    return JsonResponse(_mini_cart(cart))
+
+
+@require_POST
+def cart_api_update(request, candy_id):
+    """Set the quantity of one line; 0 removes it"""
+    candy = get_object_or_404(Candy, id=candy_id)
+    quantity = _quantity(request.POST.get("quantity"), default=None)
+    if quantity is None:
+        return JsonResponse({"error": "Quantity must be a whole number"}, status=400)
+    cart = Cart(request)
+    cart.set_quantities({candy: quantity})
+    return JsonResponse(_mini_cart(cart))
+
+
+@require_POST
+def cart_api_remove(request, candy_id):
+    """Remove one line from the cart"""
+    candy = get_object_or_404(Candy, id=candy_id)
+    cart = Cart(request)
+    cart.remove(candy)
+    return JsonResponse(_mini_cart(cart))
+
+
 from django.contrib.auth.decorators import login_required
 
 
@@ -106,68 +322,219 @@ def order_create(request):
         else:
             user = None
 
-        # Verify stock first
-        for item in cart:
-            if item["product"].stock < item["quantity"]:
-                messages.error(
-                    request,
-                    f"Not enough stock for {item['product'].name}. Only {item['product'].stock} left.",
-                )
-                return redirect("cart_detail")
-
-        order = Order.objects.create(user=user, total_price=cart.get_total_price())
-        for item in cart:
-            OrderItem.objects.create(
-                order=order,
-                product=item["product"],
-                price=item["price"],
-                quantity=item["quantity"],
-            )
-            # Update stock
-            product = item["product"]
-            product.stock -= item["quantity"]
-            product.save()
+        try:
+            with admission.admitted(request.POST.get("admission_ticket")):
+                order = place_order(user, cart)
+        except admission.Waiting as waiting:
+            return _waiting_room(request, waiting)
+        except OutOfStock as e:
+            messages.error(request, str(e))
+            return redirect("cart_detail")
         cart.clear()
         return render(request, "store/order_created.html", {"order": order})
     return redirect("cart_detail")
 
 
+def _waiting_room(request, waiting, data=None):
+    """
+    Queue page for a shopper who couldn't be admitted to place their order.
+    The shipping part of their checkout submission (`data`) is kept on the
+    server under the ticket; the page asks for the payment fields again and
+    posts them with the ticket once it is called.
+    """
+    payment_fields = []
+    if data is not None:
+        fields = {
+            name: data.getlist(name)
+            for name in CheckoutForm.base_fields
+            if name not in CheckoutForm.PAYMENT_FIELDS and name in data
+        }
+        admission.keep_submission(waiting.ticket, request.user.pk, fields)
+        form = CheckoutForm()
+        payment_fields = [form[name] for name in CheckoutForm.PAYMENT_FIELDS]
+    response = render(
+        request,
+        "store/waiting_room.html",
+        {
+            "ticket": waiting.ticket,
+            "position": waiting.position,
+            "payment_fields": payment_fields,
+            "poll_interval": settings.CHECKOUT_ADMIT_INTERVAL,
+        },
+        status=503,
+    )
+    response["Retry-After"] = str(settings.CHECKOUT_ADMIT_INTERVAL)
+    return response
+
+
+def _submission(request):
+    """
+    The POST data of an order attempt. A shopper coming back from the waiting
+    room posts their ticket and payment fields; the rest was kept when they
+    were queued.
+    """
+    fields = admission.pop_submission(
+        request.POST.get("admission_ticket"), request.user.pk
+    )
+    if fields is None:
+        return request.POST
+    data = QueryDict(mutable=True)
+    for name in CheckoutForm.PAYMENT_FIELDS:
+        data.setlist(name, request.POST.getlist(name))
+    for name, values in fields.items():
+        data.setlist(name, values)
+    return data
+
+
+def checkout_queue(request):
+    """Where a waiting shopper's ticket stands; polled by the waiting room"""
+    number = admission.read_ticket(request.GET.get("ticket", ""))
+    if number is None:
+        return JsonResponse({"error": "Invalid or expired ticket"}, status=400)
+    position = admission.position(number)
+    return JsonResponse(
+        {
+            "position": position,
+            "ready": position == 0,
+            "retry_after": settings.CHECKOUT_ADMIT_INTERVAL,
+        }
+    )
+
+
+ORDER_HISTORY_ORDERING = ("-created_at", "-id")
+ORDER_PREVIEW_ITEMS = 3
+
+
+def order_history_page(user, cursor=None, per_page=20):
+    """
+    One keyset page of `user`'s orders, newest first, with their statuses,
+    item counts and first few lines (products joined) in a fixed number of
+    queries however many orders there are
+    """
+    preview = OrderItem.objects.select_related("product").order_by("id")
+    orders = (
+        Order.objects.filter(user=user)
+        .with_effective_status()
+        .annotate(item_count=models.Count("items"))
+        .prefetch_related(
+            models.Prefetch(
+                "items",
+                queryset=preview[:ORDER_PREVIEW_ITEMS],
+                to_attr="preview_items",
+            )
+        )
+    )
+    return paginate(orders, ORDER_HISTORY_ORDERING, cursor, per_page=per_page)
+
+
 @login_required(login_url="login")
 def order_history(request):
     """List of orders for the current user"""
-    orders = Order.objects.filter(user=request.user).order_by("-created_at")
-    for order in orders:
-        order.update_status_based_on_time()
-    return render(request, "store/order_list.html", {"orders": orders})
+    # Statuses are worked out in the query; viewing never writes
+    cursor = request.GET.get("after")
+    orders = order_history_page(request.user, cursor)
+    # The page refreshes open orders' badges when the first one is due to move
+    now = timezone.now()
+    refresh_in = min(
+        (
+            live.status_max_age(order, now)
+            for order in orders
+            if order.effective_status not in live.FINAL_STATUSES
+        ),
+        default=None,
+    )
+    return render(
+        request,
+        "store/order_list.html",
+        {
+            "orders": orders,
+            "is_first_page": not cursor,
+            "status_refresh_in": refresh_in,
+        },
+    )
 
 
 @login_required(login_url="login")
 def order_detail(request, order_id):
     """Order detail page"""
-    order = get_object_or_404(Order, id=order_id, user=request.user)
-
-    # Simulate status updates
-    order.update_status_based_on_time()
-
+    order = get_object_or_404(
+        Order.objects.with_effective_status(), id=order_id, user=request.user
+    )
     return render(request, "store/order_detail.html", {"order": order})
 
 
 @login_required(login_url="login")
 def order_status_api(request, order_id):
     """API endpoint for live order status updates"""
-    order = get_object_or_404(Order, id=order_id, user=request.user)
+    order = get_object_or_404(
+        Order.objects.with_effective_status(), id=order_id, user=request.user
+    )
 
-    # Trigger simulation update
-    order.update_status_based_on_time()
+    return _cached_status_response(
+        request, live.status_payload(order), live.status_max_age(order)
+    )
 
-    data = {
-        "status": order.status,
-        "shipped_at": order.shipped_at.isoformat() if order.shipped_at else None,
-        "delivered_at": order.delivered_at.isoformat() if order.delivered_at else None,
-        "is_shipped": order.status in [Order.STATUS_SHIPPED, Order.STATUS_DELIVERED],
-        "is_delivered": order.status == Order.STATUS_DELIVERED,
-    }
-    return JsonResponse(data)
+
+# Most order ids one order_statuses_api request may ask about
+STATUS_BATCH_LIMIT = 100
+
+
+@login_required(login_url="login")
+def order_statuses_api(request):
+    """Statuses of several of the user's orders (`?ids=1,2,3`) in one query"""
+    ids = [part for part in request.GET.get("ids", "").split(",") if part]
+    if not ids or not all(part.isdigit() for part in ids):
+        return JsonResponse({"error": "Expected ids=1,2,3"}, status=400)
+    if len(ids) > STATUS_BATCH_LIMIT:
+        return JsonResponse(
+            {"error": f"At most {STATUS_BATCH_LIMIT} orders at a time"}, status=400
+        )
+
+    orders = list(
+        Order.objects.filter(user=request.user, pk__in=ids)
+        .with_effective_status()
+        .order_by("pk")
+    )
+    now = timezone.now()
+    payload = {"orders": {str(o.pk): live.status_payload(o) for o in orders}}
+    max_age = min(
+        (live.status_max_age(o, now) for o in orders), default=live.FINAL_MAX_AGE
+    )
+    return _cached_status_response(request, payload, max_age)
+
+
+def _cached_status_response(request, payload, max_age):
+    """
+    JSON status response the browser may reuse until the next transition is
+    due, and revalidate with its ETag after that
+    """
+    body = json.dumps(payload, sort_keys=True)
+    etag = quote_etag(hashlib.sha256(body.encode()).hexdigest()[:32])
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(body, content_type="application/json")
+    response["ETag"] = etag
+    patch_cache_control(response, private=True, max_age=max_age)
+    return response
+
+
+@login_required(login_url="login")
+async def order_status_stream(request, order_id):
+    """
+    Server-sent events with the order's status as it changes (see store.live).
+    Needs ASGI; under WSGI it answers 501 and the page keeps polling.
+    """
+    if not hasattr(request, "scope"):
+        return HttpResponse("Live updates need the ASGI server", status=501)
+    user = await request.auser()
+    if not await Order.objects.filter(id=order_id, user=user).aexists():
+        raise Http404("No such order")
+
+    response = StreamingHttpResponse(
+        live.order_status_events(order_id, user), content_type="text/event-stream"
+    )
+    response["X-Accel-Buffering"] = "no"  # let proxies pass events straight on
+    return response
 
 
 @staff_member_required
@@ -181,7 +548,7 @@ def inventory_list(request):
 def inventory_add(request):
     """Add a new product"""
     if request.method == "POST":
-        form = CandyForm(request.POST)
+        form = CandyForm(request.POST, request.FILES)
         if form.is_valid():
             form.save()
             return redirect("inventory_list")
@@ -198,7 +565,7 @@ def inventory_update(request, pk):
     """Update an existing product"""
     candy = get_object_or_404(Candy, pk=pk)
     if request.method == "POST":
-        form = CandyForm(request.POST, instance=candy)
+        form = CandyForm(request.POST, request.FILES, instance=candy)
         if form.is_valid():
             form.save()
             return redirect("inventory_list")
@@ -212,47 +579,42 @@ def inventory_update(request, pk):
 
 @login_required(login_url="login")
 def checkout(request):
+    data = _submission(request) if request.method == "POST" else None
+    if data is not None:
+        # A resubmitted form (double-click, retry) gets the original response
+        order = replayed_order(request.user, data.get("idempotency_key"))
+        if order is not None:
+            return render(request, "store/order_created.html", {"order": order})
+
     cart = Cart(request)
     if len(cart) == 0:
         return redirect("cart_detail")
 
-    if request.method == "POST":
-        form = CheckoutForm(request.POST)
+    if data is not None:
+        form = CheckoutForm(data)
         if form.is_valid():
-            # Verify stock availability first
-            for item in cart:
-                if item["product"].stock < item["quantity"]:
-                    messages.error(
-                        request,
-                        f"Not enough stock for {item['product'].name}. Only {item['product'].stock} left.",
-                    )
-                    return redirect("cart_detail")
-
             # Process mock payment
-            order = Order.objects.create(
-                user=request.user,
-                total_price=cart.get_total_price(),
-                full_name=form.cleaned_data["full_name"],
-                address=form.cleaned_data["address"],
-                city=form.cleaned_data["city"],
-                zip_code=form.cleaned_data["zip_code"],
-            )
-            for item in cart:
-                OrderItem.objects.create(
-                    order=order,
-                    product=item["product"],
-                    price=item["price"],
-                    quantity=item["quantity"],
-                )
-                # Deduct stock
-                product = item["product"]
-                product.stock -= item["quantity"]
-                product.save()
+            try:
+                with admission.admitted(request.POST.get("admission_ticket")):
+                    order = place_order(
+                        request.user,
+                        cart,
+                        full_name=form.cleaned_data["full_name"],
+                        address=form.cleaned_data["address"],
+                        city=form.cleaned_data["city"],
+                        zip_code=form.cleaned_data["zip_code"],
+                        idempotency_key=form.cleaned_data["idempotency_key"],
+                    )
+            except admission.Waiting as waiting:
+                return _waiting_room(request, waiting, data)
+            except OutOfStock as e:
+                messages.error(request, str(e))
+                return redirect("cart_detail")
 
             cart.clear()
             return render(request, "store/order_created.html", {"order": order})
     else:
-        form = CheckoutForm()
+        form = CheckoutForm(initial={"idempotency_key": new_idempotency_key()})
 
     return render(request, "store/checkout.html", {"cart": cart, "form": form})
 
@@ -301,19 +663,25 @@ def reorder(request, order_id):
     order = get_object_or_404(Order, id=order_id, user=request.user)
     cart = Cart(request)
 
-    added_items = []
-    out_of_stock_items = []
+    # One joined query for every line; a product ordered on several lines
+    # is checked and added as one
+    wanted = {}
+    for item in order.items.select_related("product"):
+        wanted[item.product] = wanted.get(item.product, 0) + item.quantity
 
-    for item in order.items.all():
-        if item.product.stock >= item.quantity:
-            cart.add(
-                product=item.product, quantity=item.quantity, override_quantity=False
-            )
-            added_items.append(item.product.name)
+    added = {}
+    out_of_stock_items = []
+    for product, quantity in wanted.items():
+        if product.stock >= quantity:
+            added[product] = quantity
         else:
             out_of_stock_items.append(
-                f"{item.product.name} (only {item.product.stock} available)"
+                f"{product.name} (only {product.stock} available)"
             )
+    if added:
+        cart.add_many(added)
+    _warn_shortages(request, cart)
+    added_items = [product.name for product in added if product.id in cart.cart]
 
     if added_items:
         messages.success(request, f"Added to cart: {', '.join(added_items)}")
@@ -339,7 +707,9 @@ from io import BytesIO
 @login_required(login_url="login")
 def download_invoice(request, order_id):
     """Generate and download PDF invoice for an order"""
-    order = get_object_or_404(Order, id=order_id, user=request.user)
+    order = get_object_or_404(
+        Order.objects.with_effective_status(), id=order_id, user=request.user
+    )
 
     # Create PDF in memory
     buffer = BytesIO()
@@ -374,7 +744,7 @@ def download_invoice(request, order_id):
     order_info = [
         ["Order Number:", f"#{order.id}"],
         ["Order Date:", order.created_at.strftime("%B %d, %Y at %I:%M %p")],
-        ["Status:", order.status],
+        ["Status:", order.effective_status],
         ["Customer:", order.full_name or request.user.username],
     ]
 